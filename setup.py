@@ -73,6 +73,10 @@ setup(name="twod.wsgi",
         
         [paste.composite_factory]
         full_django = twod.wsgi.factories:make_full_django_app
+        prefix_dispatcher = twod.wsgi.factories:make_prefix_dispatcher
+        
+        [console_scripts]
+        twod-compress-media = twod.wsgi.media:compress_media_command
         
         [nose.plugins.0.10]
         django-wsgified = django_testing:DjangoWsgifiedPlugin
@@ -116,6 +116,36 @@ class MockGeneratorApp(MockApp):
         return gen()
 
 
+class MockLazyApp(MockApp):
+    """
+    Mock WSGI application that calls start_response() when its body is
+    iterated over.
+    
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super(MockLazyApp, self).__init__(*args, **kwargs)
+        self.chunks_read = 0
+    
+    def __call__(self, environ, start_response):
+        self.environ = environ
+        def gen():
+            start_response(self.status, self.headers)
+            for chunk in ("body", " as", " iterable"):
+                self.chunks_read += 1
+                yield chunk
+        return gen()
+
+
+class MockFileWrapperApp(MockApp):
+    """Mock WSGI app which returns its body with the server's file wrapper."""
+    
+    def __call__(self, environ, start_response):
+        self.environ = environ
+        start_response(self.status, self.headers)
+        return environ['wsgi.file_wrapper'](StringIO("body"))
+
+
 class MockWriteApp(MockApp):
     """
     Mock WSGI app which uses the write() function.
@@ -155,6 +185,20 @@ class ClosingAppIter(list):
         self.closed = True
 
 
+class MockFileWrapper(object):
+    """Mock ``wsgi.file_wrapper``."""
+    
+    def __init__(self, file_, block_size=8192):
+        self.file = file_
+        self.block_size = block_size
+    
+    def __iter__(self):
+        return iter(lambda: self.file.read(self.block_size), "")
+    
+    def close(self):
+        self.file.close()
+
+
 class MockStartResponse(object):
     """Mock start_response() callable which keeps the arguments it receives."""
     
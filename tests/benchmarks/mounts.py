@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Benchmark of :class:`~twod.wsgi.mounts.MountTable` against
+:class:`paste.urlmap.URLMap`.
+
+"""
+from timeit import Timer
+
+from paste.urlmap import URLMap
+
+from twod.wsgi.mounts import MountTable
+
+
+REPETITIONS = 10000
+
+
+def make_mounts(mount_table, mount_count):
+    """
+    Mount a WSGI application on ``mount_count`` prefixes in ``mount_table``,
+    plus the root.
+    
+    """
+    mount_table['/'] = _app
+    for mount_index in range(mount_count):
+        mount_table['/mount%s/files' % mount_index] = _app
+    return mount_table
+
+
+def benchmark(mount_count, path_info):
+    url_map = make_mounts(URLMap(), mount_count)
+    mount_table = make_mounts(MountTable(), mount_count)
+    
+    url_map_time = Timer(lambda: _call(url_map, path_info)).timeit(REPETITIONS)
+    mount_table_time = Timer(lambda: _call(mount_table, path_info)).timeit(
+        REPETITIONS,
+        )
+    print "%6s %-30s %10.1f %10.1f" % (
+        mount_count,
+        path_info,
+        url_map_time * 1000000 / REPETITIONS,
+        mount_table_time * 1000000 / REPETITIONS,
+        )
+
+
+def _app(environ, start_response):
+    return []
+
+
+def _call(wsgi_app, path_info):
+    environ = {
+        'SCRIPT_NAME': "",
+        'PATH_INFO': path_info,
+        'HTTP_HOST': "example.org",
+        'wsgi.url_scheme': "http",
+        }
+    return wsgi_app(environ, None)
+
+
+def main():
+    print "%6s %-30s %10s %10s" % ("Mounts", "Path", "URLMap/us",
+                                   "Trie/us")
+    for mount_count in (5, 50, 500):
+        for path_info in (
+            "/mount0/files/site.css",
+            "/mount%s/files/site.css" % (mount_count - 1),
+            "/blog/2010/hello-world/",
+            ):
+            benchmark(mount_count, path_info)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Benchmark of the ``start_response()`` wrapper of
+:class:`~twod.wsgi.DjangoApplication` against the one which scanned the
+response headers for the status reason.
+
+"""
+from timeit import Timer
+
+from twod.wsgi.handler import _STATUS_REASON_ENVIRON_KEY, _StartResponseWrapper
+
+
+REPETITIONS = 100000
+
+HEADER_COUNTS = (5, 25, 100)
+
+
+class HeaderScanningStartResponseWrapper(object):
+    """
+    ``start_response()`` wrapper which took the status reason from a
+    pseudo-header, as in twod.wsgi 1.0.
+    
+    """
+    
+    def __init__(self, original_start_response):
+        self.original_start_response = original_start_response
+    
+    def __call__(self, status, response_headers, exc_info=None):
+        final_headers = []
+        for (header_name, header_value) in response_headers:
+            if header_name == "X-Actual-Status-Reason":
+                status = header_value
+            else:
+                final_headers.append((header_name, header_value))
+        return self.original_start_response(status, final_headers)
+
+
+def benchmark(header_count, status_reason=None):
+    response_headers = [("X-Header-%s" % header_index, "value")
+                        for header_index in range(header_count)]
+    
+    def call_header_scanning_wrapper():
+        headers = response_headers
+        if status_reason:
+            headers = headers + [("X-Actual-Status-Reason",
+                                  "200 %s" % status_reason)]
+        wrapper = HeaderScanningStartResponseWrapper(_start_response)
+        wrapper("200 OK", headers)
+    
+    def call_wrapper():
+        environ = {}
+        if status_reason:
+            environ[_STATUS_REASON_ENVIRON_KEY] = status_reason
+        wrapper = _StartResponseWrapper(_start_response, environ)
+        wrapper("200 OK", response_headers)
+    
+    header_scanning_time = Timer(call_header_scanning_wrapper).timeit(
+        REPETITIONS,
+        )
+    wrapper_time = Timer(call_wrapper).timeit(REPETITIONS)
+    print "%8s %-14s %12.2f %12.2f" % (
+        header_count,
+        status_reason or "-",
+        header_scanning_time * 1000000 / REPETITIONS,
+        wrapper_time * 1000000 / REPETITIONS,
+        )
+
+
+def _start_response(status, response_headers, exc_info=None):
+    pass
+
+
+def main():
+    print "%8s %-14s %12s %12s" % ("Headers", "Reason", "Scanning/us",
+                                   "Environ/us")
+    for header_count in HEADER_COUNTS:
+        benchmark(header_count)
+        benchmark(header_count, "Custom Reason")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Benchmark of :class:`~twod.wsgi.routing.CompiledURLResolver` against
+Django's URL resolver.
+
+"""
+from timeit import Timer
+
+from django.conf.urls.defaults import include, patterns, url
+from django.core.urlresolvers import RegexURLResolver, Resolver404
+
+from twod.wsgi.routing import CompiledURLResolver
+
+from tests.fixtures.sampledjango import mock_view, routing_urls, urls
+
+
+REPETITIONS = 10000
+
+
+def make_big_urlconf(application_count=50, patterns_per_application=10):
+    """
+    Return the URL patterns for ``application_count`` applications, each with
+    ``patterns_per_application`` patterns.
+    
+    """
+    urlpatterns = patterns('')
+    for application_index in range(application_count):
+        application_patterns = patterns('', *[
+            url(r"^section%s/(?P<id>\d+)/$" % pattern_index, mock_view)
+            for pattern_index in range(patterns_per_application)
+            ])
+        urlpatterns.append(url(r"^app%s/" % application_index,
+                               include(application_patterns)))
+    return urlpatterns
+
+
+def benchmark(urlpatterns, path):
+    django_resolver = RegexURLResolver(r"^/", urlpatterns)
+    compiled_resolver = RegexURLResolver(
+        r"^/",
+        [CompiledURLResolver(urlpatterns)],
+        )
+    cached_resolver = RegexURLResolver(
+        r"^/",
+        [CompiledURLResolver(urlpatterns, max_cached_paths=1000)],
+        )
+    # Compiling the patterns and caching the match beforehand:
+    _resolve(compiled_resolver, path)
+    _resolve(cached_resolver, path)
+    
+    django_time = Timer(lambda: _resolve(django_resolver, path)).timeit(
+        REPETITIONS,
+        )
+    compiled_time = Timer(lambda: _resolve(compiled_resolver, path)).timeit(
+        REPETITIONS,
+        )
+    cached_time = Timer(lambda: _resolve(cached_resolver, path)).timeit(
+        REPETITIONS,
+        )
+    print "%-30s %10.1f %10.1f %10.1f" % (
+        path,
+        django_time * 1000000 / REPETITIONS,
+        compiled_time * 1000000 / REPETITIONS,
+        cached_time * 1000000 / REPETITIONS,
+        )
+
+
+def _resolve(resolver, path):
+    try:
+        return resolver.resolve(path)
+    except Resolver404:
+        return None
+
+
+def main():
+    big_urlpatterns = make_big_urlconf()
+    print "%-30s %10s %10s %10s" % ("Path", "Django/us", "Trie/us",
+                                    "Cached/us")
+    for (urlpatterns, path) in (
+        (urls.urlpatterns, "/app1/blog"),
+        (urls.urlpatterns, "/app2/nothing"),
+        (routing_urls.urlpatterns, "/blog/2010/hello-world/"),
+        (routing_urls.urlpatterns, "/nested/42/"),
+        (big_urlpatterns, "/app0/section0/1/"),
+        (big_urlpatterns, "/app25/section5/1/"),
+        (big_urlpatterns, "/app49/section9/1/"),
+        (big_urlpatterns, "/not-found/"),
+        ):
+        benchmark(urlpatterns, path)
+
+
+if __name__ == "__main__":
+    main()
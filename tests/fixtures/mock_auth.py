@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Mock Django session engine and authentication backend, which don't need a
+database.
+
+"""
+
+from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY
+
+
+SESSIONS = {
+    'valid-session': {
+        SESSION_KEY: 1,
+        BACKEND_SESSION_KEY: "tests.fixtures.mock_auth.AuthBackend",
+        },
+    'anonymous-session': {},
+    'deleted-user-session': {
+        SESSION_KEY: 2,
+        BACKEND_SESSION_KEY: "tests.fixtures.mock_auth.AuthBackend",
+        },
+    }
+
+USERS = {1: "foobar"}
+
+
+class SessionStore(dict):
+    
+    def __init__(self, session_key=None):
+        super(SessionStore, self).__init__(SESSIONS.get(session_key, {}))
+
+
+class AuthBackend(object):
+    
+    def get_user(self, user_id):
+        if user_id not in USERS:
+            return None
+        return MockUser(USERS[user_id])
+
+
+class MockUser(object):
+    
+    def __init__(self, username):
+        self.username = username
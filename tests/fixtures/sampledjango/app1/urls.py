@@ -22,7 +22,7 @@ from __future__ import absolute_import
 from django.conf.urls.defaults import patterns, include, url
 from twod.wsgi import make_wsgi_view
 
-from .... import MockApp
+from .... import MockApp, MockFileWrapperApp
 from .. import mock_view
 
 app = make_wsgi_view(MockApp("206 One step at a time",
@@ -30,10 +30,13 @@ app = make_wsgi_view(MockApp("206 One step at a time",
 
 ok_app = make_wsgi_view(MockApp("200 OK", [("X-SALUTATION", "Hey")]))
 
+file_app = make_wsgi_view(MockFileWrapperApp("200 OK", []), stream=True)
+
 urlpatterns = patterns('',
     url(r'^blog', mock_view),
     url(r'^admin', mock_view),
     url(r'^secret', mock_view),
     url(r"wsgi-view-ok(/.*)?", ok_app),
+    url(r"wsgi-view-file(/.*)?", file_app),
     url(r"wsgi-view(/.*)?", app),
 )
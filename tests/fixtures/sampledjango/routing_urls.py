@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+URL definitions to compare the compiled URL resolver with Django's.
+
+"""
+from __future__ import absolute_import
+
+from django.conf.urls.defaults import patterns, include, url
+
+
+def post_view(request, *args, **kwargs):
+    return "Post"
+
+
+def archive_view(request, *args, **kwargs):
+    return "Archive"
+
+
+def catch_all_view(request, *args, **kwargs):
+    return "Catch-all"
+
+
+blog_urls = patterns('',
+    url(r'^$', archive_view, name="blog-index"),
+    url(r'^(?P<year>\d{4})/$', archive_view, name="blog-year"),
+    url(r'^(?P<year>\d{4})/(?P<slug>[\w-]+)/$', post_view, name="blog-post"),
+    url(r'^(\d{4})/(\d{2})/$', archive_view, name="blog-month"),
+    url(r'^feeds?/$', archive_view, name="blog-feed"),
+)
+
+wiki_urls = patterns('',
+    url(r'^(?P<page>[\w]+)$', post_view, {'editable': False}, name="wiki-page"),
+    url(r'edit$', post_view, {'editable': True}, name="wiki-edit"),
+)
+
+urlpatterns = patterns('',
+    url(r'^$', archive_view, name="home"),
+    url(r'^blog/', include(blog_urls, namespace="blog", app_name="blogs")),
+    url(r'^(?P<lang>en|es)/blog/', include(blog_urls)),
+    url(r'^wiki/', include(wiki_urls), {'section': "wiki"}),
+    url(r'^users/(\d+)/$', post_view, name="user"),
+    url(r'^about\.html$', post_view, name="about"),
+    url(r'^help/?$', post_view, name="help"),
+    url(r'^Search|^find/$', archive_view, name="search"),
+    url(r'(?i)^caseless/$', archive_view, name="caseless"),
+    url(r'^a+b/$', archive_view, name="repeated"),
+    url(r'^static/(.*)$', post_view, name="static"),
+    url(r'latest/$', archive_view, name="latest"),
+    url(r'^', include(patterns('',
+        url(r'^nested/(?P<id>\d+)/$', post_view, name="nested"),
+    ))),
+    url(r'^.*\.php$', catch_all_view, name="php"),
+)
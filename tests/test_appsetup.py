@@ -42,6 +42,8 @@ class TestDjangoWsgifytor(BaseDjangoTestCase):
         global_conf = {
             'debug': "no",
             'django_settings_module': "tests.fixtures.sampledjango.settings",
+            'twod.input_memory_threshold': "2048",
+            'twod.deadline_header': "X-Request-Budget",
             }
         app = wsgify_django(
             global_conf,
@@ -53,6 +55,8 @@ class TestDjangoWsgifytor(BaseDjangoTestCase):
         from django.conf import settings
         self.assertFalse(settings.DEBUG)
         self.assertEqual(settings.FOO, 10)
+        self.assertEqual(app.input_memory_threshold, 2048)
+        self.assertEqual(app.deadline_environ_key, "HTTP_X_REQUEST_BUDGET")
 
 
 class TestSettingUpSettings(BaseDjangoTestCase):
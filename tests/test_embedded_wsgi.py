@@ -17,12 +17,23 @@
 Tests for the use of WSGI applications within Django.
 
 """
+from StringIO import StringIO
+from threading import current_thread, Thread
+from time import sleep, time
+
+from django.utils import unittest
+
 from twod.wsgi import call_wsgi_app, make_wsgi_view
+from twod.wsgi.embedded_wsgi import (call_wsgi_apps, CircuitBreaker,
+                                     DEADLINE_THREADS, make_pooled_wsgi_view,
+                                     MAX_ENFORCED_BUDGET, RequestCoalescer,
+                                     WSGIApplicationPool, WSGIResponseCache,
+                                     _make_embedded_request)
 from twod.wsgi.exc import ApplicationCallError
-from twod.wsgi.handler import TwodWSGIRequest
+from twod.wsgi.handler import TwodResponse, TwodWSGIRequest
 
 from . import (BaseDjangoTestCase, MockApp, MockClosingApp, MockWriteApp,
-                   MockGeneratorApp, complete_environ)
+                   MockGeneratorApp, MockLazyApp, complete_environ)
 
 
 class TestCallWSGIApp(BaseDjangoTestCase):
@@ -45,6 +56,26 @@ class TestCallWSGIApp(BaseDjangoTestCase):
         del request.environ['webob.adhoc_attrs']
         self.assertEqual(request.environ, expected_environ)
     
+    def test_body_is_shared(self):
+        """
+        The embedded application must be able to read the body, without
+        altering the input of the original request.
+        
+        """
+        original_input = StringIO("foo=bar")
+        environ = complete_environ(REQUEST_METHOD="POST",
+                                   PATH_INFO="/admin/models",
+                                   CONTENT_LENGTH="7",
+                                   **{'wsgi.input': original_input})
+        request = _make_request(**environ)
+        original_input.read(3)
+        # Running the app:
+        app = MockBodyReadingApp("200 OK", [])
+        call_wsgi_app(app, request, "/models")
+        self.assertEqual(app.body, "foo=bar")
+        self.assertEqual(original_input.tell(), 3)
+        self.assertEqual(original_input.read(), "=bar")
+    
     def test_routing_args_are_removed(self):
         """The ``wsgiorg.routing_args`` environment key must be removed."""
         environ = {
@@ -121,7 +152,6 @@ class TestCallWSGIApp(BaseDjangoTestCase):
         expected_headers = {
             'x-foo': ("X-Foo", "bar"),
             'content-type': ("Content-Type", "text/plain"),
-            'x-actual-status-reason': ("X-Actual-Status-Reason", "200 OK"),
             }
         # Running the app:
         app = MockApp("200 OK", headers)
@@ -137,6 +167,7 @@ class TestCallWSGIApp(BaseDjangoTestCase):
         self.assertEqual("foobar", app.environ['REMOTE_USER'])
     
     def test_cookies_sent(self):
+        """The cookies must be passed on as they were set by the application."""
         environ = complete_environ(SCRIPT_NAME="/dev", PATH_INFO="/trac/wiki")
         request = _make_request(**environ)
         headers = [
@@ -149,44 +180,45 @@ class TestCallWSGIApp(BaseDjangoTestCase):
             ("Set-Cookie", "arg7=val7; expires=Fri,%2031-Dec-2010%2023:59:59%20GMT; max-age=3600; domain=.example.org; path=/wiki"),
             # Now let's try an Unicode cookie:
             ("Set-Cookie", u"arg8=val8; max-age=3600"),
-            # TODO: The "secure" cookie *attribute* is broken in SimpleCookie.
-            # See: http://bugs.python.org/issue1028088
-            #("Set-Cookie", "arg9=val9; secure"),
+            # These attributes were lost when the cookies were parsed:
+            ("Set-Cookie", "arg9=val9; secure"),
+            ("Set-Cookie", "arg10=val10; path=/; HttpOnly"),
+            ]
+        # Running the app:
+        app = MockApp("200 OK", headers)
+        django_response = call_wsgi_app(app, request, "/wiki")
+        # Checking the cookies:
+        self.assertEqual(len(headers), len(django_response.cookies))
+        for (header, raw_cookie) in headers:
+            cookie_name = raw_cookie.split("=", 1)[0]
+            cookie = django_response.cookies[cookie_name]
+            self.assertEqual(cookie.value, "val" + cookie_name[3:])
+            self.assertEqual(cookie.output(header=""), " " + raw_cookie)
+    
+    def test_cookies_overridden(self):
+        """
+        The cookies from the application can be replaced by those set by
+        Django.
+        
+        """
+        environ = complete_environ(SCRIPT_NAME="/dev", PATH_INFO="/trac/wiki")
+        request = _make_request(**environ)
+        headers = [
+            ("Set-Cookie", "arg1=val1; path=/wiki; secure"),
+            ("Set-Cookie", "arg2=val2; path=/wiki"),
             ]
-        expected_cookies = {
-            'arg1': {'value': "val1"},
-            'arg2': {'value': "val2", 'expires': "Fri,%2031-Dec-2010%2023:59:59%20GMT"},
-            'arg3': {'value': "val3", 'path': "/"},
-            'arg4': {'value': "val4", 'path': "/wiki"},
-            'arg5': {'value': "val5", 'domain': ".example.org"},
-            'arg6': {'value': "val6", 'max-age': "3600"},
-            'arg7': {
-                'value': "val7",
-                'expires': "Fri,%2031-Dec-2010%2023:59:59%20GMT",
-                'path': "/wiki",
-                'domain': ".example.org",
-                'max-age': "3600",
-                },
-            'arg8': {'value': "val8", 'max-age': "3600"},
-            # Why the next item as disabled? Check the `headers` variable above
-            #'arg9': {'value': "val9", 'secure': True},
-            }
         # Running the app:
         app = MockApp("200 OK", headers)
         django_response = call_wsgi_app(app, request, "/wiki")
+        django_response.set_cookie("arg2", "new-value")
+        django_response.set_cookie("arg3", "val3")
         # Checking the cookies:
-        self.assertEqual(len(expected_cookies), len(django_response.cookies))
-        # Finally, let's check each cookie:
-        for (cookie_set_name, cookie_set) in django_response.cookies.items():
-            expected_cookie = expected_cookies[cookie_set_name]
-            expected_cookie_value = expected_cookie.pop("value")
-            self.assertEqual(expected_cookie_value, cookie_set.value,
-                             'Cookie "%s" has a wrong value ("%s")' %
-                             (cookie_set_name, cookie_set.value))
-            for (attr_key, attr_val) in expected_cookie.items():
-                self.assertEqual(cookie_set[attr_key], attr_val,
-                                 'Attribute "%s" in cookie "%s" is wrong (%s)' %
-                                 (attr_key, cookie_set_name, cookie_set[attr_key]))
+        self.assertEqual(len(django_response.cookies), 3)
+        self.assertEqual(django_response.cookies['arg1'].output(header=""),
+                         " arg1=val1; path=/wiki; secure")
+        self.assertEqual(django_response.cookies['arg2'].value, "new-value")
+        self.assertEqual(django_response.cookies['arg2']['path'], "/")
+        self.assertEqual(django_response.cookies['arg3'].value, "val3")
     
     def test_string_as_response(self):
         app = MockApp("200 It is OK", [("X-HEADER", "Foo")])
@@ -198,7 +230,6 @@ class TestCallWSGIApp(BaseDjangoTestCase):
         http_response = (
             "X-HEADER: Foo\n"
             "Content-Type: text/html; charset=utf-8\n"
-            "X-Actual-Status-Reason: 200 It is OK\n"
             "\n"
             "body"
             )
@@ -216,7 +247,6 @@ class TestCallWSGIApp(BaseDjangoTestCase):
         http_response = (
             "X-HEADER: Foo\n"
             "Content-Type: text/html; charset=utf-8\n"
-            "X-Actual-Status-Reason: 200 It is OK\n"
             "\n"
             "body as iterable"
             )
@@ -234,7 +264,6 @@ class TestCallWSGIApp(BaseDjangoTestCase):
         http_response = (
             "X-HEADER: Foo\n"
             "Content-Type: text/html; charset=utf-8\n"
-            "X-Actual-Status-Reason: 200 It is OK\n"
             "\n"
             "body as iterable"
             )
@@ -253,6 +282,211 @@ class TestCallWSGIApp(BaseDjangoTestCase):
         self.assertTrue(app.app_iter.closed)
 
 
+class TestStreamingCallWSGIApp(BaseDjangoTestCase):
+    """
+    Tests for call_wsgi_app() when the response is streamed.
+    
+    """
+    
+    def test_iterable_as_response(self):
+        """The iterable must be used as the body without reading it."""
+        app = MockClosingApp("200 It is OK", [("X-HEADER", "Foo")])
+        environ = complete_environ(SCRIPT_NAME="/dev", PATH_INFO="/blog/posts")
+        request = _make_request(**environ)
+        
+        django_response = call_wsgi_app(app, request, "/posts", stream=True)
+        
+        self.assertEqual(django_response.status_reason, "It is OK")
+        self.assertEqual(django_response['X-HEADER'], "Foo")
+        self.assertIs(django_response._container, app.app_iter)
+        self.assertEqual(django_response.content, "body")
+    
+    def test_lazy_start_response(self):
+        """
+        The body must only be read until start_response() is called.
+        
+        """
+        app = MockLazyApp("200 It is OK", [("X-HEADER", "Foo")])
+        environ = complete_environ(SCRIPT_NAME="/dev", PATH_INFO="/blog/posts")
+        request = _make_request(**environ)
+        
+        django_response = call_wsgi_app(app, request, "/posts", stream=True)
+        
+        self.assertEqual(django_response.status_code, 200)
+        self.assertEqual(django_response['X-HEADER'], "Foo")
+        self.assertEqual(app.chunks_read, 1)
+        self.assertEqual(django_response.content, "body as iterable")
+        self.assertEqual(app.chunks_read, 3)
+    
+    def test_write_response(self):
+        app = MockWriteApp("200 It is OK", [("X-HEADER", "Foo")])
+        environ = complete_environ(SCRIPT_NAME="/dev", PATH_INFO="/blog/posts")
+        request = _make_request(**environ)
+        
+        django_response = call_wsgi_app(app, request, "/posts", stream=True)
+        
+        self.assertEqual(django_response.content, "body as iterable")
+    
+    def test_closure_response(self):
+        """The .close() method in the response (if any) must be kept."""
+        app = MockClosingApp("200 It is OK", [])
+        environ = complete_environ(SCRIPT_NAME="/dev", PATH_INFO="/blog/posts")
+        request = _make_request(**environ)
+        
+        django_response = call_wsgi_app(app, request, "/posts", stream=True)
+        
+        self.assertFalse(app.app_iter.closed)
+        django_response.close()
+        self.assertTrue(app.app_iter.closed)
+    
+    def test_start_response_not_called(self):
+        app = lambda environ, start_response: ["body"]
+        environ = complete_environ(SCRIPT_NAME="/dev", PATH_INFO="/blog/posts")
+        request = _make_request(**environ)
+        
+        self.assertRaises(ApplicationCallError, call_wsgi_app, app, request,
+                          "/posts", stream=True)
+
+
+class TestCallWSGIApps(BaseDjangoTestCase):
+    """Tests for call_wsgi_apps()."""
+    
+    def test_responses_in_order(self):
+        app1 = MockApp("200 OK", [("X-APP", "1")])
+        app2 = MockApp("404 Not Found", [("X-APP", "2")])
+        request = _make_request(**complete_environ(SCRIPT_NAME="/dev",
+                                                   PATH_INFO="/dashboard/a"))
+        
+        (response1, response2) = call_wsgi_apps([(app1, "/a"), (app2, "/a")],
+                                                request)
+        
+        self.assertEqual(response1['X-APP'], "1")
+        self.assertEqual(response2['X-APP'], "2")
+        self.assertEqual(response2.status_code, 404)
+    
+    def test_requests_are_derived(self):
+        """Each application must get its own request."""
+        app1 = MockApp("200 OK", [])
+        app2 = MockApp("200 OK", [])
+        request = _make_request(authenticated=True,
+                                **complete_environ(SCRIPT_NAME="/dev",
+                                                   PATH_INFO="/dashboard/a"))
+        
+        call_wsgi_apps([(app1, "/dashboard/a"), (app2, "/a")], request)
+        
+        self.assertIsNot(app1.environ, app2.environ)
+        self.assertEqual(app1.environ['SCRIPT_NAME'], "/dev")
+        self.assertEqual(app1.environ['PATH_INFO'], "/dashboard/a")
+        self.assertEqual(app2.environ['SCRIPT_NAME'], "/dev/dashboard")
+        self.assertEqual(app2.environ['PATH_INFO'], "/a")
+        self.assertEqual(app2.environ['REMOTE_USER'], "foobar")
+        self.assertEqual(request.environ['PATH_INFO'], "/dashboard/a")
+    
+    def test_body_is_shared(self):
+        apps = [MockBodyReadingApp("200 OK", []) for i in range(5)]
+        body = "foo=bar\n" * 1000
+        environ = complete_environ(REQUEST_METHOD="POST", PATH_INFO="/",
+                                   CONTENT_LENGTH=str(len(body)),
+                                   **{'wsgi.input': StringIO(body)})
+        request = _make_request(**environ)
+        
+        call_wsgi_apps([(app, "/") for app in apps], request)
+        
+        for app in apps:
+            self.assertEqual(app.body, body)
+    
+    def test_calls_are_concurrent(self):
+        apps = [MockSlowApp(0.3) for i in range(3)]
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        
+        start = time()
+        call_wsgi_apps([(app, "/") for app in apps], request)
+        
+        self.assertTrue(time() - start < 0.6)
+    
+    def test_errors_propagated(self):
+        app = MockApp("200 OK", [])
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        
+        self.assertRaises(ZeroDivisionError, call_wsgi_apps,
+                          [(app, "/"), (MockFailingApp(), "/")], request)
+    
+    def test_invalid_path_info(self):
+        app = MockApp("200 OK", [])
+        request = _make_request(**complete_environ(PATH_INFO="/foo"))
+        
+        self.assertRaises(ApplicationCallError, call_wsgi_apps,
+                          [(app, "/foo"), (app, "/bar")], request)
+    
+    def test_timeout(self):
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        apps = [(MockApp("200 OK", []), "/"), (MockSlowApp(0.5), "/")]
+        
+        start = time()
+        self.assertRaises(ApplicationCallError, call_wsgi_apps, apps, request,
+                          timeout=0.1)
+        
+        self.assertTrue(time() - start < 0.4)
+    
+    def test_slow_bodies(self):
+        """The bodies are read in parallel when they're not streamed."""
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        apps = [(MockSlowBodyApp(0.3), "/") for i in range(3)]
+        
+        start = time()
+        responses = call_wsgi_apps(apps, request, timeout=10)
+        
+        self.assertTrue(time() - start < 0.6)
+        self.assertEqual([r.content for r in responses], ["body"] * 3)
+    
+    def test_slow_body_timeout(self):
+        """The deadline applies to the bodies when they're not streamed."""
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        
+        self.assertRaises(ApplicationCallError, call_wsgi_apps,
+                          [(MockSlowBodyApp(0.5), "/")], request, timeout=0.1)
+    
+    def test_streaming(self):
+        app = MockClosingApp("200 OK", [])
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        
+        (response, ) = call_wsgi_apps([(app, "/")], request, stream=True)
+        
+        self.assertIs(response._container, app.app_iter)
+        self.assertFalse(app.app_iter.closed)
+    
+    def test_streamed_bodies_closed_on_error(self):
+        app = MockClosingApp("200 OK", [])
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        
+        self.assertRaises(ZeroDivisionError, call_wsgi_apps,
+                          [(app, "/"), (MockFailingApp(), "/")], request,
+                          stream=True)
+        
+        self.assertTrue(app.app_iter.closed)
+    
+    def test_streamed_bodies_closed_on_timeout(self):
+        app = MockClosingApp("200 OK", [])
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        
+        self.assertRaises(ApplicationCallError, call_wsgi_apps,
+                          [(app, "/"), (MockSlowApp(0.5), "/")], request,
+                          timeout=0.1, stream=True)
+        
+        self.assertTrue(app.app_iter.closed)
+    
+    def test_late_body_closed(self):
+        """The body of a response which arrived too late is closed."""
+        app = MockSlowClosingApp(0.2)
+        request = _make_request(**complete_environ(PATH_INFO="/"))
+        
+        self.assertRaises(ApplicationCallError, call_wsgi_apps,
+                          [(app, "/")], request, timeout=0.05, stream=True)
+        
+        sleep(0.4)
+        self.assertTrue(app.app_iter.closed)
+
+
 class TestWSGIView(BaseDjangoTestCase):
     """
     Tests for make_wsgi_view().
@@ -297,9 +531,973 @@ class TestWSGIView(BaseDjangoTestCase):
         self.assertRaises(ApplicationCallError, django_view, request, "/foo")
 
 
+class TestPooledWSGIView(BaseDjangoTestCase):
+    """
+    Tests for make_pooled_wsgi_view().
+    
+    """
+    
+    def test_app_per_key(self):
+        apps = {}
+        def app_factory(key):
+            apps[key] = MockApp("200 OK", [("X-PROJECT", key)])
+            return apps[key]
+        django_view = make_pooled_wsgi_view(
+            app_factory,
+            lambda request, project: project,
+            )
+        environ = complete_environ(SCRIPT_NAME="/dev",
+                                   PATH_INFO="/tracs/foo/wiki")
+        request = _make_request(**environ)
+        
+        django_response = django_view(request, "/wiki", project="foo")
+        
+        self.assertEqual(django_response['X-PROJECT'], "foo")
+        self.assertEqual(apps['foo'].environ['PATH_INFO'], "/wiki")
+        self.assertIn("foo", django_view.pool)
+        self.assertEqual(django_view.pool._calls_in_progress, {})
+    
+    def test_app_not_closed_while_streaming(self):
+        closed_apps = []
+        django_view = make_pooled_wsgi_view(
+            lambda key: MockApp("200 OK", []),
+            lambda request, project: project,
+            stream=True,
+            close_app=lambda key, app: closed_apps.append(key),
+            )
+        request = _make_request(**complete_environ(PATH_INFO="/tracs/foo"))
+        
+        django_response = django_view(request, "", project="foo")
+        django_view.pool.evict("foo")
+        self.assertEqual(closed_apps, [])
+        
+        self.assertEqual("".join(django_response), "body")
+        django_response.close()
+        self.assertEqual(closed_apps, ["foo"])
+
+
+class TestWSGIResponseCache(BaseDjangoTestCase):
+    """Tests for the caching of responses by call_wsgi_app()."""
+    
+    def setUp(self):
+        super(TestWSGIResponseCache, self).setUp()
+        self.cache = WSGIResponseCache()
+    
+    def test_cached_response(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60"),
+                               ("X-Foo", "bar")])
+        
+        for i in range(2):
+            response = self._call(app)
+        
+        self.assertEqual(app.calls, 1)
+        self.assertIsInstance(response, TwodResponse)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Foo'], "bar")
+        self.assertEqual(response.content, "body")
+        self.assertEqual(len(self.cache), 1)
+    
+    def test_cached_responses_are_copies(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60")])
+        
+        self._call(app)['X-Foo'] = "bar"
+        response = self._call(app)
+        
+        self.assertFalse(response.has_header("X-Foo"))
+    
+    def test_no_cache_headers(self):
+        app = MockCountingApp([])
+        
+        for i in range(2):
+            self._call(app)
+        
+        self.assertEqual(app.calls, 2)
+    
+    def test_uncacheable_responses(self):
+        uncacheable_headers = (
+            [("Cache-Control", "no-store, max-age=60")],
+            [("Cache-Control", "no-cache, max-age=60")],
+            [("Cache-Control", "private, max-age=60")],
+            [("Cache-Control", "max-age=0")],
+            [("Cache-Control", "max-age=60"), ("Set-Cookie", "a=b")],
+            [("Cache-Control", "max-age=60"), ("Vary", "*")],
+            )
+        for headers in uncacheable_headers:
+            app = MockCountingApp(headers)
+            for i in range(2):
+                self._call(app)
+            self.assertEqual(app.calls, 2, headers)
+    
+    def test_uncacheable_status(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60")],
+                              "500 Internal Server Error")
+        
+        for i in range(2):
+            self._call(app)
+        
+        self.assertEqual(app.calls, 2)
+    
+    def test_uncacheable_method(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60")])
+        
+        for i in range(2):
+            self._call(app, REQUEST_METHOD="POST")
+        
+        self.assertEqual(app.calls, 2)
+    
+    def test_expires(self):
+        app = MockCountingApp([
+            ("Date", "Fri, 01 Jan 2010 00:00:00 GMT"),
+            ("Expires", "Fri, 01 Jan 2010 00:01:00 GMT"),
+            ])
+        
+        for i in range(2):
+            self._call(app)
+        
+        self.assertEqual(app.calls, 1)
+    
+    def test_expired_response(self):
+        app = MockCountingApp([("Expires", "Fri, 01 Jan 2010 00:00:00 GMT")])
+        
+        for i in range(2):
+            self._call(app)
+        
+        self.assertEqual(app.calls, 2)
+    
+    def test_freshness(self):
+        app = MockCountingApp([("Cache-Control", "max-age=1")])
+        
+        self._call(app)
+        sleep(1.1)
+        self._call(app)
+        
+        self.assertEqual(app.calls, 2)
+    
+    def test_key(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60")])
+        
+        self._call(app, PATH_INFO="/trac/wiki")
+        self._call(app, PATH_INFO="/trac/timeline")
+        self._call(app, PATH_INFO="/trac/wiki", QUERY_STRING="a=b")
+        self._call(app, PATH_INFO="/trac/wiki", REQUEST_METHOD="HEAD")
+        self._call(app, PATH_INFO="/trac/wiki", SCRIPT_NAME="/other")
+        self._call(app, PATH_INFO="/trac/wiki", QUERY_STRING="a=b")
+        
+        self.assertEqual(app.calls, 5)
+    
+    def test_remote_user(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60")])
+        
+        self._call(app)
+        self._call(app, authenticated=True)
+        self._call(app, authenticated=True)
+        
+        self.assertEqual(app.calls, 2)
+    
+    def test_private_responses_for_users(self):
+        app = MockCountingApp([("Cache-Control", "private, max-age=60")])
+        
+        for i in range(2):
+            self._call(app, authenticated=True)
+        
+        self.assertEqual(app.calls, 1)
+    
+    def test_vary(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60"),
+                               ("Vary", "Accept-Language, Cookie")])
+        
+        self._call(app, HTTP_ACCEPT_LANGUAGE="en")
+        self._call(app, HTTP_ACCEPT_LANGUAGE="en")
+        self._call(app, HTTP_ACCEPT_LANGUAGE="es")
+        self._call(app, HTTP_ACCEPT_LANGUAGE="es", HTTP_COOKIE="a=b")
+        
+        self.assertEqual(app.calls, 3)
+    
+    def test_max_bytes(self):
+        cache = WSGIResponseCache(max_bytes=8)
+        app = MockCountingApp([("Cache-Control", "max-age=60")])
+        
+        for path_info in ("/trac/a", "/trac/b", "/trac/c", "/trac/a"):
+            self._call(app, cache=cache, PATH_INFO=path_info)
+        
+        # Only two 4-byte bodies fit:
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(app.calls, 4)
+    
+    def test_vary_header_names_evicted(self):
+        """The Vary header names mustn't outlive the responses."""
+        cache = WSGIResponseCache(max_bytes=8)
+        app = MockCountingApp([("Cache-Control", "max-age=60"),
+                               ("Vary", "Accept-Language")])
+        
+        for i in range(100):
+            self._call(app, cache=cache, QUERY_STRING="page=%s" % i)
+        
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(len(cache._vary_header_names), 2)
+    
+    def test_vary_header_names_kept_for_variants(self):
+        cache = WSGIResponseCache(max_bytes=8)
+        app = MockCountingApp([("Cache-Control", "max-age=60"),
+                               ("Vary", "Accept-Language")])
+        
+        self._call(app, cache=cache, HTTP_ACCEPT_LANGUAGE="en")
+        self._call(app, cache=cache, HTTP_ACCEPT_LANGUAGE="es")
+        self._call(app, cache=cache, HTTP_ACCEPT_LANGUAGE="fr")
+        self._call(app, cache=cache, HTTP_ACCEPT_LANGUAGE="es")
+        
+        self.assertEqual(app.calls, 3)
+        self.assertEqual(len(cache._vary_header_names), 1)
+    
+    def test_replaced_response(self):
+        """A response stored twice, by concurrent calls, must be kept."""
+        headers = [("Cache-Control", "max-age=60"),
+                   ("Vary", "Accept-Language")]
+        request = _make_request(**complete_environ(PATH_INFO="/trac/wiki",
+                                                   HTTP_ACCEPT_LANGUAGE="en"))
+        new_request = _make_embedded_request(request, "/wiki")
+        
+        for i in range(2):
+            self.cache._store_response(new_request, "200 OK", headers,
+                                       ["body"])
+        
+        self.assertEqual(len(self.cache), 1)
+        self.assertIsNotNone(self.cache._get_response(new_request))
+    
+    def test_vary_header_names_of_expired_responses(self):
+        app = MockCountingApp([("Cache-Control", "max-age=1"),
+                               ("Vary", "Accept-Language")])
+        
+        self._call(app)
+        sleep(1.1)
+        self._call(app)
+        
+        self.assertEqual(app.calls, 2)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(len(self.cache._vary_header_names), 1)
+    
+    def test_streamed_responses_not_cached(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60")])
+        
+        for i in range(2):
+            self._call(app, stream=True)
+        
+        self.assertEqual(app.calls, 2)
+    
+    def test_clear(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60")])
+        
+        self._call(app)
+        self.cache.clear()
+        self._call(app)
+        
+        self.assertEqual(app.calls, 2)
+    
+    def test_view(self):
+        app = MockCountingApp([("Cache-Control", "max-age=60")])
+        django_view = make_wsgi_view(app, cache=self.cache)
+        
+        for i in range(2):
+            request = _make_request(**complete_environ(PATH_INFO="/trac/wiki"))
+            django_view(request, "/wiki")
+        
+        self.assertEqual(app.calls, 1)
+    
+    def _call(self, app, authenticated=False, stream=False, cache=None,
+              **environ):
+        environ.setdefault("PATH_INFO", "/trac/wiki")
+        request = _make_request(authenticated, **complete_environ(**environ))
+        if cache is None:
+            cache = self.cache
+        return call_wsgi_app(app, request, environ['PATH_INFO'][5:], stream,
+                             cache)
+
+
+class TestRequestCoalescer(BaseDjangoTestCase):
+    """Tests for the coalescing of calls by call_wsgi_app()."""
+    
+    def setUp(self):
+        super(TestRequestCoalescer, self).setUp()
+        self.coalescer = RequestCoalescer()
+    
+    def test_concurrent_calls_coalesced(self):
+        app = MockCountingApp([("X-Foo", "bar")], delay=0.2)
+        
+        responses = self._call_concurrently(app, [{}] * 5)
+        
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(self.coalescer.calls, 1)
+        self.assertEqual(self.coalescer.coalesced_calls, 4)
+        for response in responses:
+            self.assertEqual(response.content, "body")
+            self.assertEqual(response['X-Foo'], "bar")
+        self.assertEqual(len(set(id(response) for response in responses)), 5)
+    
+    def test_different_keys(self):
+        app = MockCountingApp([], delay=0.2)
+        
+        self._call_concurrently(app, [
+            {},
+            {'QUERY_STRING': "a=b"},
+            {'authenticated': True},
+            {'REQUEST_METHOD': "HEAD"},
+            ])
+        
+        self.assertEqual(app.calls, 4)
+        self.assertEqual(self.coalescer.coalesced_calls, 0)
+    
+    def test_requests_with_credentials_not_coalesced(self):
+        app = MockCountingApp([], delay=0.2)
+        
+        self._call_concurrently(app, [
+            {'HTTP_COOKIE': "trac_auth=abc"},
+            {'HTTP_COOKIE': "trac_auth=abc"},
+            {'HTTP_AUTHORIZATION': "Basic Zm9vOmJhcg=="},
+            {'HTTP_AUTHORIZATION': "Basic Zm9vOmJhcg=="},
+            ])
+        
+        self.assertEqual(app.calls, 4)
+        self.assertEqual(self.coalescer.coalesced_calls, 0)
+    
+    def test_responses_setting_cookies_not_shared(self):
+        app = MockCountingApp([("Set-Cookie", "trac_session=abc")], delay=0.2)
+        
+        responses = self._call_concurrently(app, [{}] * 3)
+        
+        self.assertEqual(app.calls, 3)
+        self.assertEqual(self.coalescer.calls, 3)
+        self.assertEqual(self.coalescer.coalesced_calls, 0)
+        for response in responses:
+            self.assertEqual(response.cookies['trac_session'].value, "abc")
+    
+    def test_different_apps(self):
+        app1 = MockCountingApp([], delay=0.2)
+        app2 = MockCountingApp([], delay=0.2)
+        threads = [
+            Thread(target=self._call, args=(app1, )),
+            Thread(target=self._call, args=(app2, )),
+            ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(app1.calls, 1)
+        self.assertEqual(app2.calls, 1)
+    
+    def test_unsafe_methods_not_coalesced(self):
+        app = MockCountingApp([], delay=0.2)
+        
+        self._call_concurrently(app, [{'REQUEST_METHOD': "POST"}] * 3)
+        
+        self.assertEqual(app.calls, 3)
+        self.assertEqual(self.coalescer.calls, 3)
+    
+    def test_sequential_calls_not_coalesced(self):
+        app = MockCountingApp([])
+        
+        self._call(app)
+        self._call(app)
+        
+        self.assertEqual(app.calls, 2)
+        self.assertEqual(self.coalescer.coalesced_calls, 0)
+    
+    def test_errors_shared(self):
+        errors = []
+        app = MockFailingApp(delay=0.2)
+        def call():
+            try:
+                self._call(app)
+            except ZeroDivisionError:
+                errors.append(True)
+        threads = [Thread(target=call) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [True] * 3)
+        self.assertEqual(self.coalescer.calls, 1)
+    
+    def test_app_iter_closed(self):
+        app = MockClosingApp("200 OK", [])
+        
+        response = self._call(app)
+        
+        self.assertTrue(app.app_iter.closed)
+        self.assertEqual(response.content, "body")
+    
+    def test_with_cache(self):
+        cache = WSGIResponseCache()
+        app = MockCountingApp([("Cache-Control", "max-age=60")], delay=0.2)
+        
+        self._call_concurrently(app, [{'cache': cache}] * 3)
+        self._call(app, cache=cache)
+        
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(self.coalescer.calls, 1)
+        self.assertEqual(self.coalescer.coalesced_calls, 2)
+    
+    def test_view(self):
+        app = MockCountingApp([], delay=0.2)
+        django_view = make_wsgi_view(app, coalescer=self.coalescer)
+        def call():
+            request = _make_request(**complete_environ(PATH_INFO="/trac/wiki"))
+            django_view(request, "/wiki")
+        threads = [Thread(target=call) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(app.calls, 1)
+    
+    def _call_concurrently(self, app, call_arguments):
+        responses = []
+        def call(kwargs):
+            responses.append(self._call(app, **kwargs))
+        threads = [Thread(target=call, args=(kwargs, ))
+                   for kwargs in call_arguments]
+        for thread in threads:
+            thread.start()
+            # Making sure they're in the same order as the arguments:
+            sleep(0.01)
+        for thread in threads:
+            thread.join()
+        return responses
+    
+    def _call(self, app, authenticated=False, cache=None, **environ):
+        environ.setdefault("PATH_INFO", "/trac/wiki")
+        request = _make_request(authenticated, **complete_environ(**environ))
+        return call_wsgi_app(app, request, "/wiki", cache=cache,
+                             coalescer=self.coalescer)
+
+
+class TestDeadlines(BaseDjangoTestCase):
+    """Tests for the deadlines of the calls made by call_wsgi_app()."""
+    
+    def test_deadline_thread_pool(self):
+        """The calls with a deadline must run in a bounded thread pool."""
+        app = MockThreadRecordingApp()
+        
+        for i in range(DEADLINE_THREADS * 2):
+            request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+            call_wsgi_app(app, request, "/wiki", timeout=10)
+        
+        self.assertNotIn(current_thread(), app.threads)
+        self.assertTrue(len(set(app.threads)) <= DEADLINE_THREADS)
+    
+    def test_distant_deadline(self):
+        """Distant deadlines must not be enforced in another thread."""
+        app = MockThreadRecordingApp()
+        request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+        
+        response = call_wsgi_app(app, request, "/wiki",
+                                 timeout=MAX_ENFORCED_BUDGET + 10)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(app.threads, [current_thread()])
+        self.assertIn("twod.wsgi.deadline", app.environ)
+    
+    def test_no_deadline(self):
+        app = MockApp("200 OK", [])
+        request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+        
+        call_wsgi_app(app, request, "/wiki")
+        
+        self.assertNotIn("twod.wsgi.deadline", app.environ)
+    
+    def test_timeout(self):
+        app = MockSlowApp(0.5)
+        request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+        
+        start = time()
+        response = call_wsgi_app(app, request, "/wiki", timeout=0.1)
+        
+        self.assertTrue(time() - start < 0.4)
+        self.assertIsInstance(response, TwodResponse)
+        self.assertEqual(response.status_code, 504)
+    
+    def test_timeout_not_reached(self):
+        app = MockApp("200 OK", [])
+        request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+        
+        start = time()
+        response = call_wsgi_app(app, request, "/wiki", timeout=10)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, "body")
+        deadline = app.environ['twod.wsgi.deadline']
+        self.assertTrue(start + 10 <= deadline <= time() + 10)
+    
+    def test_deadline_in_environ(self):
+        app = MockSlowApp(0.5)
+        request = _make_request(**complete_environ(
+            PATH_INFO="/wiki",
+            **{'twod.wsgi.deadline': time() + 0.1}
+            ))
+        
+        response = call_wsgi_app(app, request, "/wiki", timeout=10)
+        
+        self.assertEqual(response.status_code, 504)
+    
+    def test_earliest_deadline(self):
+        app = MockApp("200 OK", [])
+        deadline = time() + 10
+        request = _make_request(**complete_environ(
+            PATH_INFO="/wiki",
+            **{'twod.wsgi.deadline': deadline}
+            ))
+        
+        call_wsgi_app(app, request, "/wiki")
+        self.assertEqual(app.environ['twod.wsgi.deadline'], deadline)
+        
+        call_wsgi_app(app, request, "/wiki", timeout=1)
+        self.assertTrue(app.environ['twod.wsgi.deadline'] < deadline)
+    
+    def test_past_deadline(self):
+        app = MockCountingApp([])
+        request = _make_request(**complete_environ(
+            PATH_INFO="/wiki",
+            **{'twod.wsgi.deadline': time() - 1}
+            ))
+        
+        response = call_wsgi_app(app, request, "/wiki")
+        
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(app.calls, 0)
+    
+    def test_custom_timeout_response(self):
+        app = MockSlowApp(0.5)
+        request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+        def make_timeout_response(request):
+            return TwodResponse("Try again later", status=504)
+        
+        response = call_wsgi_app(app, request, "/wiki", timeout=0.1,
+                                 make_timeout_response=make_timeout_response)
+        
+        self.assertEqual(response.content, "Try again later")
+    
+    def test_errors_propagated(self):
+        request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+        
+        self.assertRaises(ZeroDivisionError, call_wsgi_app, MockFailingApp(),
+                          request, "/wiki", timeout=1)
+    
+    def test_slow_body(self):
+        """The deadline applies to the body when it's not streamed."""
+        app = MockSlowBodyApp(0.5)
+        request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+        
+        response = call_wsgi_app(app, request, "/wiki", timeout=0.1)
+        
+        self.assertEqual(response.status_code, 504)
+    
+    def test_streaming(self):
+        app = MockClosingApp("200 OK", [])
+        request = _make_request(**complete_environ(PATH_INFO="/wiki"))
+        
+        response = call_wsgi_app(app, request, "/wiki", stream=True,
+                                 timeout=1)
+        
+        self.assertIs(response._container, app.app_iter)
+        self.assertFalse(app.app_iter.closed)
+    
+    def test_view(self):
+        django_view = make_wsgi_view(MockSlowApp(0.5), timeout=0.1)
+        request = _make_request(**complete_environ(PATH_INFO="/trac/wiki"))
+        
+        response = django_view(request, "/wiki")
+        
+        self.assertEqual(response.status_code, 504)
+    
+    def test_fan_out(self):
+        app = MockApp("200 OK", [])
+        deadline = time() + 10
+        request = _make_request(**complete_environ(
+            PATH_INFO="/wiki",
+            **{'twod.wsgi.deadline': deadline}
+            ))
+        
+        call_wsgi_apps([(app, "/wiki")], request)
+        
+        self.assertEqual(app.environ['twod.wsgi.deadline'], deadline)
+
+
+class TestCircuitBreaker(BaseDjangoTestCase):
+    """Tests for the circuit breakers used by call_wsgi_app()."""
+    
+    def setUp(self):
+        super(TestCircuitBreaker, self).setUp()
+        self.breaker = CircuitBreaker(window_size=4, min_calls=4,
+                                      error_rate_threshold=0.5,
+                                      reset_timeout=0.2)
+    
+    def test_closed_initially(self):
+        app = MockCountingApp([])
+        
+        response = self._call(app)
+        
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(app.calls, 1)
+    
+    def test_opened_on_error_rate(self):
+        self._call(MockCountingApp([]))
+        self._call(MockCountingApp([]))
+        self._call(MockCountingApp([], "500 Internal Server Error"))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        
+        self._call(MockCountingApp([], "502 Bad Gateway"))
+        
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.error_rate, 0.5)
+    
+    def test_exceptions_are_failures(self):
+        for i in range(4):
+            self.assertRaises(ZeroDivisionError, self._call, MockFailingApp())
+        
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+    
+    def test_timeouts_are_failures(self):
+        for i in range(4):
+            self._call(MockSlowApp(0.2), timeout=0.01)
+        
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+    
+    def test_client_errors_are_successes(self):
+        for i in range(4):
+            self._call(MockCountingApp([], "404 Not Found"))
+        
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_min_calls(self):
+        for i in range(3):
+            self._call(MockFailingApp(), expect_error=True)
+        
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_sliding_window(self):
+        self._call(MockFailingApp(), expect_error=True)
+        for i in range(3):
+            self._call(MockCountingApp([]))
+        
+        self._call(MockFailingApp(), expect_error=True)
+        
+        # The first failure is out of the window now:
+        self.assertEqual(self.breaker.error_rate, 0.25)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_opened_on_latency(self):
+        breaker = CircuitBreaker(window_size=4, min_calls=4,
+                                 latency_threshold=0.05,
+                                 latency_percentile=75)
+        for i in range(2):
+            self._call(MockCountingApp([]), circuit_breaker=breaker)
+        self._call(MockSlowApp(0.1), circuit_breaker=breaker)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        
+        self._call(MockSlowApp(0.1), circuit_breaker=breaker)
+        
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(0.1 <= breaker.latency)
+    
+    def test_fallback_while_open(self):
+        self._open_circuit()
+        app = MockCountingApp([])
+        
+        start = time()
+        response = self._call(app)
+        
+        self.assertTrue(time() - start < 0.01)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(app.calls, 0)
+    
+    def test_custom_fallback(self):
+        def make_fallback_response(request):
+            return TwodResponse("Come back later", status=503)
+        breaker = CircuitBreaker(window_size=1, min_calls=1,
+                                 make_fallback_response=make_fallback_response)
+        self._call(MockFailingApp(), expect_error=True,
+                   circuit_breaker=breaker)
+        
+        response = self._call(MockCountingApp([]), circuit_breaker=breaker)
+        
+        self.assertEqual(response.content, "Come back later")
+    
+    def test_half_open(self):
+        self._open_circuit()
+        sleep(0.2)
+        app = MockCountingApp([], delay=0.1)
+        responses = []
+        def call():
+            responses.append(self._call(app))
+        threads = [Thread(target=call) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        sleep(0.05)
+        
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        for thread in threads:
+            thread.join()
+        # Only the trial call went through:
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(sorted(response.status_code for response in
+                                responses),
+                         [200, 503, 503])
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.error_rate, 0)
+    
+    def test_failed_trial_call(self):
+        self._open_circuit()
+        sleep(0.2)
+        
+        self._call(MockFailingApp(), expect_error=True)
+        
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self._call(MockCountingApp([])).status_code, 503)
+    
+    def test_view(self):
+        self._open_circuit()
+        app = MockCountingApp([])
+        django_view = make_wsgi_view(app, circuit_breaker=self.breaker)
+        request = _make_request(**complete_environ(PATH_INFO="/trac/wiki"))
+        
+        response = django_view(request, "/wiki")
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(app.calls, 0)
+    
+    def _open_circuit(self):
+        for i in range(4):
+            self._call(MockFailingApp(), expect_error=True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+    
+    def _call(self, app, expect_error=False, circuit_breaker=None, **kwargs):
+        request = _make_request(**complete_environ(PATH_INFO="/trac/wiki"))
+        if circuit_breaker is None:
+            circuit_breaker = self.breaker
+        try:
+            return call_wsgi_app(app, request, "/wiki",
+                                 circuit_breaker=circuit_breaker, **kwargs)
+        except ZeroDivisionError:
+            if not expect_error:
+                raise
+
+
+class TestWSGIApplicationPool(unittest.TestCase):
+    """Tests for :class:`WSGIApplicationPool`."""
+    
+    def setUp(self):
+        self.built_apps = []
+        self.closed_apps = []
+        self.pool = WSGIApplicationPool(self._build_app, max_size=2,
+                                        close_app=self._close_app)
+    
+    def test_apps_are_reused(self):
+        app1 = self.pool.get_app("foo")
+        app2 = self.pool.get_app("foo")
+        
+        self.assertIs(app1, app2)
+        self.assertEqual(self.built_apps, ["foo"])
+    
+    def test_least_recently_used_app_is_evicted(self):
+        foo_app = self.pool.get_app("foo")
+        self.pool.get_app("bar")
+        self.pool.get_app("foo")
+        self.pool.get_app("baz")
+        
+        self.assertEqual(len(self.pool), 2)
+        self.assertIn("foo", self.pool)
+        self.assertNotIn("bar", self.pool)
+        self.assertEqual(self.closed_apps, ["bar"])
+        self.assertIs(self.pool.get_app("foo"), foo_app)
+    
+    def test_idle_apps_are_evicted(self):
+        self.pool.idle_ttl = 60
+        self.pool.get_app("foo")
+        self.pool.get_app("bar")
+        # Making "foo" look idle:
+        self.pool._apps['foo'] = (self.pool._apps['foo'][0], time() - 61)
+        
+        self.pool.get_app("bar")
+        
+        self.assertNotIn("foo", self.pool)
+        self.assertEqual(self.closed_apps, ["foo"])
+    
+    def test_explicit_eviction(self):
+        self.pool.get_app("foo")
+        self.pool.get_app("bar")
+        
+        self.pool.evict("foo")
+        self.assertEqual(self.closed_apps, ["foo"])
+        
+        self.pool.clear()
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.closed_apps, ["foo", "bar"])
+    
+    def test_single_construction(self):
+        """Each application must be built once, even by concurrent threads."""
+        def slow_app_factory(key):
+            sleep(0.05)
+            return self._build_app(key)
+        self.pool.app_factory = slow_app_factory
+        apps = []
+        threads = [Thread(target=lambda: apps.append(self.pool.get_app("foo")))
+                   for i in range(5)]
+        
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(self.built_apps, ["foo"])
+        self.assertEqual(len(apps), 5)
+        self.assertEqual(len(set(apps)), 1)
+    
+    def test_construction_error(self):
+        def broken_app_factory(key):
+            raise ValueError(key)
+        self.pool.app_factory = broken_app_factory
+        
+        self.assertRaises(ValueError, self.pool.get_app, "foo")
+        self.assertNotIn("foo", self.pool)
+        self.assertEqual(self.pool._construction_locks, {})
+    
+    def test_acquired_app_closed_once_released(self):
+        foo_app = self.pool.acquire_app("foo")
+        self.pool.acquire_app("foo")
+        
+        self.pool.evict("foo")
+        self.assertEqual(self.closed_apps, [])
+        
+        self.pool.release_app(foo_app)
+        self.assertEqual(self.closed_apps, [])
+        
+        self.pool.release_app(foo_app)
+        self.assertEqual(self.closed_apps, ["foo"])
+        self.assertEqual(self.pool._calls_in_progress, {})
+    
+    def test_released_app_not_closed_until_evicted(self):
+        foo_app = self.pool.acquire_app("foo")
+        self.pool.release_app(foo_app)
+        
+        self.assertEqual(self.closed_apps, [])
+        self.pool.get_app("bar")
+        self.pool.get_app("baz")
+        self.assertEqual(self.closed_apps, ["foo"])
+    
+    def test_app_evicted_while_acquired(self):
+        foo_app = self.pool.acquire_app("foo")
+        self.pool.get_app("bar")
+        self.pool.get_app("baz")
+        
+        self.assertNotIn("foo", self.pool)
+        self.assertEqual(self.closed_apps, [])
+        self.assertIsNot(self.pool.get_app("foo"), foo_app)
+        
+        self.pool.release_app(foo_app)
+        self.assertEqual(self.closed_apps, ["bar", "foo"])
+    
+    def _build_app(self, key):
+        self.built_apps.append(key)
+        return MockApp("200 OK", [])
+    
+    def _close_app(self, key, app):
+        self.closed_apps.append(key)
+
+
 #{ Test utilities
 
 
+class MockBodyReadingApp(MockApp):
+    """Mock WSGI application which reads the body of the request."""
+    
+    def __call__(self, environ, start_response):
+        self.body = environ['wsgi.input'].read()
+        environ['wsgi.input'].seek(0)
+        self.body_lines = environ['wsgi.input'].readlines()
+        return super(MockBodyReadingApp, self).__call__(environ, start_response)
+
+
+class MockThreadRecordingApp(MockApp):
+    """Mock WSGI application which records the threads it's run in."""
+    
+    def __init__(self):
+        super(MockThreadRecordingApp, self).__init__("200 OK", [])
+        self.threads = []
+    
+    def __call__(self, environ, start_response):
+        self.threads.append(current_thread())
+        return super(MockThreadRecordingApp, self).__call__(environ,
+                                                            start_response)
+
+
+class MockSlowApp(MockApp):
+    """Mock WSGI application which takes ``delay`` seconds to respond."""
+    
+    def __init__(self, delay):
+        super(MockSlowApp, self).__init__("200 OK", [])
+        self.delay = delay
+    
+    def __call__(self, environ, start_response):
+        sleep(self.delay)
+        return super(MockSlowApp, self).__call__(environ, start_response)
+
+
+class MockSlowBodyApp(MockSlowApp):
+    """Mock WSGI application which takes ``delay`` seconds to send its body."""
+    
+    def __call__(self, environ, start_response):
+        start_response(self.status, self.headers)
+        def generate_body():
+            sleep(self.delay)
+            yield "body"
+        return generate_body()
+
+
+class MockSlowClosingApp(MockClosingApp):
+    """
+    Mock WSGI application which takes ``delay`` seconds to respond with a
+    closeable body.
+    
+    """
+    
+    def __init__(self, delay):
+        super(MockSlowClosingApp, self).__init__("200 OK", [])
+        self.delay = delay
+    
+    def __call__(self, environ, start_response):
+        sleep(self.delay)
+        return super(MockSlowClosingApp, self).__call__(environ,
+                                                        start_response)
+
+
+class MockFailingApp(object):
+    """Mock WSGI application which raises an exception."""
+    
+    def __init__(self, delay=0):
+        self.delay = delay
+    
+    def __call__(self, environ, start_response):
+        sleep(self.delay)
+        1 / 0
+
+
+class MockCountingApp(MockApp):
+    """Mock WSGI application which counts the times it's called."""
+    
+    def __init__(self, headers, status="200 OK", delay=0):
+        super(MockCountingApp, self).__init__(status, headers)
+        self.calls = 0
+        self.delay = delay
+    
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        sleep(self.delay)
+        return super(MockCountingApp, self).__call__(environ, start_response)
+
+
 def _make_request(authenticated=False, **environ):
     """
     Make a Django request from the items in the WSGI ``environ``.
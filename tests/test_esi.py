@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the resolution of ESI includes.
+
+"""
+from time import sleep, time
+
+from twod.wsgi.esi import ESIIncludeProcessor
+from twod.wsgi.exc import ApplicationCallError
+from twod.wsgi.handler import TwodResponse
+
+from . import BaseDjangoTestCase, MockClosingApp, complete_environ
+from .test_embedded_wsgi import _make_request
+
+
+class TestESIIncludeProcessor(BaseDjangoTestCase):
+    """Tests for :class:`ESIIncludeProcessor`."""
+    
+    def setUp(self):
+        super(TestESIIncludeProcessor, self).setUp()
+        self.fragment_app = MockFragmentApp()
+        self.processor = ESIIncludeProcessor({'/fragments': self.fragment_app})
+        self.request = _make_request(
+            authenticated=True,
+            **complete_environ(SCRIPT_NAME="/site", PATH_INFO="/page",
+                               HTTP_ACCEPT_LANGUAGE="en")
+            )
+    
+    def test_includes_replaced(self):
+        response = _make_html_response(
+            '<p><esi:include src="/fragments/a?x=1&amp;y=2"/></p>'
+            "<esi:include src='/fragments/b' ></esi:include>"
+            )
+        
+        response = self.processor(self.request, response)
+        
+        self.assertEqual(response.content,
+                         "<p>/fragments/a?x=1&y=2</p>/fragments/b")
+    
+    def test_fragment_request(self):
+        response = _make_html_response('<esi:include src="/fragments/a?b=c"/>')
+        
+        self.processor(self.request, response)
+        
+        environ = self.fragment_app.environs[0]
+        self.assertEqual(environ['REQUEST_METHOD'], "GET")
+        self.assertEqual(environ['SCRIPT_NAME'], "/site/fragments")
+        self.assertEqual(environ['PATH_INFO'], "/a")
+        self.assertEqual(environ['QUERY_STRING'], "b=c")
+        self.assertEqual(environ['REMOTE_USER'], "foobar")
+        self.assertEqual(self.request.environ['PATH_INFO'], "/page")
+    
+    def test_conditional_headers_not_forwarded(self):
+        """The fragments must be complete, uncompressed responses."""
+        self.request.environ.update(
+            HTTP_IF_MODIFIED_SINCE="Sat, 29 Oct 1994 19:43:31 GMT",
+            HTTP_IF_NONE_MATCH='"abc"',
+            HTTP_RANGE="bytes=0-1",
+            HTTP_IF_RANGE='"abc"',
+            HTTP_ACCEPT_ENCODING="gzip",
+            )
+        response = _make_html_response('<esi:include src="/fragments/a"/>')
+        
+        self.processor(self.request, response)
+        
+        environ = self.fragment_app.environs[0]
+        for environ_key in ("HTTP_IF_MODIFIED_SINCE", "HTTP_IF_NONE_MATCH",
+                            "HTTP_RANGE", "HTTP_IF_RANGE",
+                            "HTTP_ACCEPT_ENCODING"):
+            self.assertNotIn(environ_key, environ)
+        self.assertEqual(environ['HTTP_ACCEPT_LANGUAGE'], "en")
+        self.assertIn("HTTP_IF_MODIFIED_SINCE", self.request.environ)
+    
+    def test_longest_mount_point(self):
+        other_app = MockFragmentApp()
+        processor = ESIIncludeProcessor({
+            '/fragments': self.fragment_app,
+            '/fragments/other/': other_app,
+            })
+        response = _make_html_response('<esi:include src="/fragments/other/a"/>')
+        
+        processor(self.request, response)
+        
+        self.assertEqual(len(other_app.environs), 1)
+        self.assertEqual(other_app.environs[0]['PATH_INFO'], "/a")
+    
+    def test_fragments_in_parallel(self):
+        self.fragment_app.delay = 0.3
+        response = _make_html_response(
+            '<esi:include src="/fragments/a"/><esi:include src="/fragments/b"/>'
+            '<esi:include src="/fragments/c"/>'
+            )
+        
+        start = time()
+        self.processor(self.request, response)
+        
+        self.assertTrue(time() - start < 0.6)
+    
+    def test_repeated_fragment_requested_once(self):
+        response = _make_html_response(
+            '<esi:include src="/fragments/a"/><esi:include src="/fragments/a"/>'
+            )
+        
+        response = self.processor(self.request, response)
+        
+        self.assertEqual(response.content, "/fragments/a/fragments/a")
+        self.assertEqual(len(self.fragment_app.environs), 1)
+    
+    def test_non_html_response(self):
+        response = TwodResponse('<esi:include src="/fragments/a"/>',
+                                content_type="text/plain")
+        
+        response = self.processor(self.request, response)
+        
+        self.assertEqual(response.content, '<esi:include src="/fragments/a"/>')
+    
+    def test_content_length_updated(self):
+        response = _make_html_response('<esi:include src="/fragments/a"/>')
+        response['Content-Length'] = str(len(response.content))
+        
+        response = self.processor(self.request, response)
+        
+        self.assertEqual(response['Content-Length'], "12")
+    
+    def test_errors(self):
+        self.fragment_app.status = "500 Internal Server Error"
+        response = _make_html_response('<esi:include src="/fragments/a"/>')
+        
+        self.assertRaises(ApplicationCallError, self.processor, self.request,
+                          response)
+    
+    def test_fragment_body_closed(self):
+        fragment_app = MockClosingApp("200 OK", [])
+        processor = ESIIncludeProcessor({'/fragments': fragment_app})
+        response = _make_html_response('<esi:include src="/fragments/a"/>')
+        
+        response = processor(self.request, response)
+        
+        self.assertEqual(response.content, "body")
+        self.assertTrue(fragment_app.app_iter.closed)
+    
+    def test_unmounted_fragment(self):
+        response = _make_html_response('<esi:include src="/other"/>')
+        
+        self.assertRaises(ApplicationCallError, self.processor, self.request,
+                          response)
+    
+    def test_errors_ignored(self):
+        self.fragment_app.status = "404 Not Found"
+        response = _make_html_response(
+            'a<esi:include src="/fragments/a" onerror="continue"/>b'
+            '<esi:include src="/other" onerror="continue"/>'
+            )
+        
+        response = self.processor(self.request, response)
+        
+        self.assertEqual(response.content, "ab")
+    
+    def test_timeout(self):
+        self.fragment_app.delay = 0.5
+        processor = ESIIncludeProcessor({'/fragments': self.fragment_app},
+                                        timeout=0.1)
+        response = _make_html_response('<esi:include src="/fragments/a"/>')
+        
+        self.assertRaises(ApplicationCallError, processor, self.request,
+                          response)
+    
+    #{ Caching
+    
+    def test_uncacheable_fragments(self):
+        for i in range(2):
+            self._process('<esi:include src="/fragments/a"/>')
+        
+        self.assertEqual(len(self.fragment_app.environs), 2)
+    
+    def test_cached_fragments(self):
+        self.fragment_app.headers = [("Cache-Control", "max-age=60")]
+        
+        for i in range(2):
+            response = self._process('<esi:include src="/fragments/a"/>')
+        
+        self.assertEqual(response.content, "/fragments/a")
+        self.assertEqual(len(self.fragment_app.environs), 1)
+    
+    def test_cache_expiry(self):
+        self.fragment_app.headers = [("Cache-Control", "max-age=1")]
+        
+        self._process('<esi:include src="/fragments/a"/>')
+        sleep(1.1)
+        self._process('<esi:include src="/fragments/a"/>')
+        
+        self.assertEqual(len(self.fragment_app.environs), 2)
+    
+    def test_private_fragments_not_cached(self):
+        self.fragment_app.headers = [("Cache-Control", "private, max-age=60")]
+        
+        for i in range(2):
+            self._process('<esi:include src="/fragments/a"/>')
+        
+        self.assertEqual(len(self.fragment_app.environs), 2)
+    
+    def test_fragments_setting_cookies_not_cached(self):
+        self.fragment_app.headers = [("Cache-Control", "max-age=60"),
+                                     ("Set-Cookie", "a=b")]
+        
+        for i in range(2):
+            self._process('<esi:include src="/fragments/a"/>')
+        
+        self.assertEqual(len(self.fragment_app.environs), 2)
+    
+    def test_vary(self):
+        self.fragment_app.headers = [("Cache-Control", "max-age=60"),
+                                     ("Vary", "Accept-Language")]
+        
+        self._process('<esi:include src="/fragments/a"/>')
+        self._process('<esi:include src="/fragments/a"/>')
+        self.request.environ['HTTP_ACCEPT_LANGUAGE'] = "es"
+        self._process('<esi:include src="/fragments/a"/>')
+        
+        self.assertEqual(len(self.fragment_app.environs), 2)
+    
+    def test_fragments_cached_by_user(self):
+        self.fragment_app.headers = [("Cache-Control", "max-age=60")]
+        anonymous_request = _make_request(
+            **complete_environ(SCRIPT_NAME="/site", PATH_INFO="/page")
+            )
+        other_user_request = _make_request(
+            **complete_environ(SCRIPT_NAME="/site", PATH_INFO="/page",
+                               REMOTE_USER="bob")
+            )
+        
+        for request in (self.request, anonymous_request, other_user_request,
+                        self.request):
+            response = _make_html_response('<esi:include src="/fragments/a"/>')
+            self.processor(request, response)
+        
+        self.assertEqual(len(self.fragment_app.environs), 3)
+        self.assertEqual(
+            [environ.get("REMOTE_USER") for environ in
+             self.fragment_app.environs],
+            ["foobar", None, "bob"],
+            )
+    
+    def test_max_cached_fragments(self):
+        self.fragment_app.headers = [("Cache-Control", "max-age=60")]
+        processor = ESIIncludeProcessor({'/fragments': self.fragment_app},
+                                        max_cached_fragments=1)
+        
+        for path in ("/fragments/a", "/fragments/b", "/fragments/a"):
+            response = _make_html_response('<esi:include src="%s"/>' % path)
+            processor(self.request, response)
+        
+        self.assertEqual(len(self.fragment_app.environs), 3)
+    
+    #}
+    
+    def _process(self, content):
+        return self.processor(self.request, _make_html_response(content))
+
+
+class MockFragmentApp(object):
+    """Mock WSGI application which returns its path as the body."""
+    
+    def __init__(self):
+        self.status = "200 OK"
+        self.headers = []
+        self.delay = 0
+        self.environs = []
+    
+    def __call__(self, environ, start_response):
+        self.environs.append(environ)
+        sleep(self.delay)
+        start_response(self.status, self.headers)
+        path = environ['SCRIPT_NAME'][len("/site"):] + environ['PATH_INFO']
+        if environ['QUERY_STRING']:
+            path = path + "?" + environ['QUERY_STRING']
+        return [path]
+
+
+def _make_html_response(content):
+    return TwodResponse(content, content_type="text/html; charset=utf-8")
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the PasteDeploy application factories.
+
+"""
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from django.utils import unittest
+from paste.urlparser import StaticURLParser
+
+from twod.wsgi.factories import make_full_django_app, make_prefix_dispatcher
+from twod.wsgi.media import _MEDIA_MANIFESTS, MediaApplication, get_media_url
+from twod.wsgi.middleware import (PrefixDispatcher,
+                                  resolve_django_session_identity)
+
+from . import BaseDjangoTestCase, MockApp
+
+
+class TestFullDjangoAppFactory(BaseDjangoTestCase):
+    """Tests for :func:`make_full_django_app`."""
+    
+    def tearDown(self):
+        _MEDIA_MANIFESTS.clear()
+        super(TestFullDjangoAppFactory, self).tearDown()
+    
+    def test_default_media_app(self):
+        app = make_full_django_app(MockLoader(), {}, django_app="mydjango")
+        
+        mounts = dict((path, app) for ((domain, path), app) in
+                      app.applications)
+        self.assertIsInstance(mounts['/media'], StaticURLParser)
+        self.assertIsInstance(mounts['/static/admin'], StaticURLParser)
+    
+    def test_twod_media_app(self):
+        loader = MockLoader()
+        app = make_full_django_app(loader, {}, django_app="mydjango",
+                                   media_app="twod")
+        
+        mounts = dict((path, app) for ((domain, path), app) in
+                      app.applications)
+        self.assertIsInstance(mounts['/media'], MediaApplication)
+        self.assertIsInstance(mounts['/static/admin'], MediaApplication)
+        self.assertIs(mounts[''], loader.apps['mydjango'])
+    
+    #{ Fingerprinted media
+    
+    def test_fingerprinted_media(self):
+        from django.conf import settings
+        media_root = mkdtemp()
+        try:
+            with open(path.join(media_root, "site.css"), "wb") as file_:
+                file_.write("body {color: red}")
+            settings.MEDIA_ROOT = media_root
+            
+            app = make_full_django_app(MockLoader(), {},
+                                       django_app="mydjango",
+                                       fingerprint_media="true")
+        finally:
+            rmtree(media_root)
+        
+        mounts = dict((path, app) for ((domain, path), app) in
+                      app.applications)
+        self.assertIsInstance(mounts['/media'], MediaApplication)
+        self.assertEqual(mounts['/media'].manifest.fingerprinted_paths,
+                         {'site.css': "site.54b83696b687.css"})
+        admin_manifest = mounts['/static/admin'].manifest
+        self.assertIn("css/base.css", admin_manifest.fingerprinted_paths)
+        self.assertEqual(get_media_url("site.css"),
+                         "/media/site.54b83696b687.css")
+        self.assertEqual(get_media_url("/static/admin/css/base.css"),
+                         admin_manifest.get_url("css/base.css"))
+        self.assertNotEqual(get_media_url("/static/admin/css/base.css"),
+                            "/static/admin/css/base.css")
+    
+    def test_fingerprinted_media_without_media_root(self):
+        app = make_full_django_app(MockLoader(), {}, django_app="mydjango",
+                                   fingerprint_media="true")
+        
+        mounts = dict((path, app) for ((domain, path), app) in
+                      app.applications)
+        self.assertIsNone(mounts['/media'].manifest)
+        self.assertIsNotNone(mounts['/static/admin'].manifest)
+    
+    def test_fingerprinted_media_with_other_media_app(self):
+        self.assertRaises(ValueError, make_full_django_app, MockLoader(), {},
+                          django_app="mydjango", media_app="paste",
+                          fingerprint_media="true")
+    
+    #}
+
+
+class TestPrefixDispatcherFactory(unittest.TestCase):
+    """Tests for :func:`make_prefix_dispatcher`."""
+    
+    def setUp(self):
+        self.loader = MockLoader()
+    
+    def test_mounts(self):
+        app = make_prefix_dispatcher(self.loader, {'debug': "no"},
+                                     django_app="mydjango",
+                                     **{'/trac': "trac", '/wiki': "wiki"})
+        
+        self.assertIsInstance(app, PrefixDispatcher)
+        self.assertIs(app.django_app, self.loader.apps['mydjango'])
+        self.assertEqual(sorted(app.mounts), [
+            ("/trac", self.loader.apps['trac']),
+            ("/wiki", self.loader.apps['wiki']),
+            ])
+        self.assertIsNone(app.identity_resolver)
+        self.assertEqual(self.loader.global_confs,
+                         [{'debug': "no"}] * 3)
+    
+    def test_identity_resolver(self):
+        app = make_prefix_dispatcher(
+            self.loader,
+            {},
+            django_app="mydjango",
+            identity_resolver="twod.wsgi.middleware:"
+                              "resolve_django_session_identity",
+            )
+        
+        self.assertIs(app.identity_resolver, resolve_django_session_identity)
+        self.assertEqual(app.mounts, [])
+
+
+#{ Mock objects
+
+
+class MockLoader(object):
+    """Mock PasteDeploy loader."""
+    
+    def __init__(self):
+        self.apps = {}
+        self.global_confs = []
+    
+    def get_app(self, name, global_conf=None):
+        self.global_confs.append(global_conf)
+        self.apps[name] = MockApp("200 OK", [])
+        return self.apps[name]
+
+
+#}
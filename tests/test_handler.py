@@ -17,18 +17,25 @@
 Tests for the WSGI request handler.
 
 """
+from hashlib import md5
 from StringIO import StringIO
+from time import time
 from urllib import urlencode
 
 from django.core.handlers.wsgi import WSGIRequest
+from django.middleware.common import settings as common_middleware_settings
 from django.utils import unittest
 from webob import Request
+from webob.multidict import MultiDict
 
 from twod.wsgi import DjangoApplication
+from twod.wsgi.exc import ApplicationCallError
 from twod.wsgi.handler import (TwodWSGIRequest, TwodResponse,
-                               _StartResponseWrapper)
+                               _SpooledInput, _StartResponseWrapper,
+                               _STATUS_REASON_ENVIRON_KEY)
 
-from . import BaseDjangoTestCase, MockStartResponse, complete_environ
+from . import (BaseDjangoTestCase, MockFileWrapper, MockStartResponse,
+               complete_environ)
 
 
 class TestRequest(BaseDjangoTestCase):
@@ -95,7 +102,7 @@ class TestRequest(BaseDjangoTestCase):
     
     def test_content_length_in_post(self):
         """
-        The content length should be set if it wasn't set originally in a
+        The content length must not be set if it wasn't set originally in a
         POST request.
         
         """
@@ -114,9 +121,110 @@ class TestRequest(BaseDjangoTestCase):
         twod_request.POST
         self.assertNotIn("CONTENT_LENGTH", twod_request.environ)
         
-        # But it should have been set when read with WebOb:
+        # Nor when read with WebOb:
         twod_request.uPOST
-        self.assertIn("CONTENT_LENGTH", twod_request.environ)
+        self.assertNotIn("CONTENT_LENGTH", twod_request.environ)
+    
+    def test_post_parsed_once(self):
+        """
+        The body must be parsed once when the POST arguments are read by both
+        Django and WebOb.
+        
+        """
+        input = urlencode({'foo': "bar", 'bar': "foo"})
+        environ = complete_environ(
+            REQUEST_METHOD="POST",
+            CONTENT_TYPE="application/x-www-form-urlencoded",
+            CONTENT_LENGTH=str(len(input)),
+            **{'wsgi.input': StringIO(input)}
+            )
+        twod_request = TwodWSGIRequest(environ)
+        
+        self.assertEqual(twod_request.uPOST['foo'], "bar")
+        self.assertEqual(twod_request.POST['bar'], "foo")
+        self.assertIs(twod_request.str_POST, twod_request.str_POST)
+        self.assertIsInstance(twod_request.str_POST, MultiDict)
+    
+    def test_body_after_post(self):
+        """
+        The raw body must still be available to WebOb once Django parsed the
+        POST arguments.
+        
+        """
+        input = "foo=bar&baz=1"
+        environ = complete_environ(
+            REQUEST_METHOD="POST",
+            CONTENT_TYPE="application/x-www-form-urlencoded",
+            CONTENT_LENGTH=str(len(input)),
+            **{'wsgi.input': StringIO(input)}
+            )
+        twod_request = TwodWSGIRequest(environ)
+        
+        self.assertEqual(twod_request.POST['foo'], "bar")
+        self.assertEqual(twod_request.body, input)
+        self.assertEqual(twod_request.body_file.read(), input)
+    
+    def test_multipart_body_after_post(self):
+        input = (
+            "--boundary\r\n"
+            'Content-Disposition: form-data; name="foo"\r\n'
+            "\r\n"
+            "bar\r\n"
+            "--boundary--\r\n"
+            )
+        environ = complete_environ(
+            REQUEST_METHOD="POST",
+            CONTENT_TYPE="multipart/form-data; boundary=boundary",
+            CONTENT_LENGTH=str(len(input)),
+            **{'wsgi.input': StringIO(input)}
+            )
+        twod_request = TwodWSGIRequest(environ)
+        
+        self.assertEqual(twod_request.POST['foo'], "bar")
+        self.assertEqual(twod_request.body, input)
+    
+    def test_uploaded_files_in_webob(self):
+        """Files uploaded must be available in WebOb's POST arguments."""
+        input = (
+            "--boundary\r\n"
+            'Content-Disposition: form-data; name="foo"\r\n'
+            "\r\n"
+            "bar\r\n"
+            "--boundary\r\n"
+            'Content-Disposition: form-data; name="file"; filename="a.txt"\r\n'
+            "Content-Type: text/plain\r\n"
+            "\r\n"
+            "File contents\r\n"
+            "--boundary--\r\n"
+            )
+        environ = complete_environ(
+            REQUEST_METHOD="POST",
+            CONTENT_TYPE="multipart/form-data; boundary=boundary",
+            CONTENT_LENGTH=str(len(input)),
+            **{'wsgi.input': StringIO(input)}
+            )
+        twod_request = TwodWSGIRequest(environ)
+        
+        self.assertEqual(twod_request.str_POST['foo'], "bar")
+        uploaded_file = twod_request.str_POST['file']
+        self.assertEqual(uploaded_file.filename, "a.txt")
+        self.assertEqual(uploaded_file.type, "text/plain")
+        self.assertEqual(uploaded_file.value, "File contents")
+        # Django got the same file:
+        self.assertEqual(twod_request.FILES['file'].read(), "File contents")
+    
+    def test_drop_in_replacement(self):
+        """The request must be usable as both a Django and a WebOb request."""
+        environ = complete_environ(PATH_INFO="/foo", QUERY_STRING="bar=baz")
+        twod_request = TwodWSGIRequest(environ)
+        
+        self.assertIsInstance(twod_request, WSGIRequest)
+        self.assertIsInstance(twod_request, Request)
+        self.assertEqual(twod_request.path, "/foo")
+        self.assertEqual(twod_request.uGET['bar'], "baz")
+        self.assertEqual(twod_request.copy().path_info, "/foo")
+        # Django's attributes must not be taken as WebOb ad-hoc attributes:
+        self.assertNotIn("webob.adhoc_attrs", twod_request.environ)
     
     def _make_requests(self, environ):
         
@@ -191,13 +299,12 @@ class TestResponse(BaseDjangoTestCase):
         self.assertEqual(response.status_code, 200)
         # But the reason phrase must still be available:
         self.assertEqual(response.status_reason, status[4:])
-        # And both must be included in the actual response:
+        # And no pseudo-header must be used to keep it:
         expected_response = (
             "Content-Type: text/html; charset=utf-8\n"
-            "X-Actual-Status-Reason: %s\n"
             "\n"
             "%s"
-            ) % (status, body)
+            ) % body
         self.assertEqual(expected_response, str(response))
     
     def test_backwards_compatibility(self):
@@ -274,6 +381,158 @@ class TestWSGIHandler(BaseDjangoTestCase):
         self.assertEqual(start_response.response_headers[1][0], "X-SALUTATION")
         self.assertEqual(start_response.response_headers[2][0], "Content-Type")
     
+    def test_non_seekable_input(self):
+        """Non-seekable inputs must be replaced with a seekable buffer."""
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   CONTENT_LENGTH="3",
+                                   **{'wsgi.input': NonSeekableInput("foo")})
+        
+        self.handler(environ, MockStartResponse())
+        
+        self.assertIsInstance(environ['wsgi.input'], _SpooledInput)
+        environ['wsgi.input'].seek(0)
+        self.assertEqual(environ['wsgi.input'].read(), "foo")
+    
+    def test_input_without_content_length(self):
+        """Inputs without a length must not be read, unless terminated."""
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   REQUEST_METHOD="POST",
+                                   **{'wsgi.input': BlockingInput()})
+        
+        self.handler(environ, MockStartResponse())
+        
+        self.assertEqual(Request(environ).body, "")
+    
+    def test_chunked_input(self):
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   HTTP_TRANSFER_ENCODING="chunked",
+                                   **{'wsgi.input': NonSeekableInput("foo")})
+        
+        self.handler(environ, MockStartResponse())
+        
+        environ['wsgi.input'].seek(0)
+        self.assertEqual(environ['wsgi.input'].read(), "foo")
+    
+    def test_terminated_input(self):
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   **{'wsgi.input': NonSeekableInput("foo"),
+                                      'wsgi.input_terminated': True})
+        
+        self.handler(environ, MockStartResponse())
+        
+        environ['wsgi.input'].seek(0)
+        self.assertEqual(environ['wsgi.input'].read(), "foo")
+    
+    def test_seekable_input(self):
+        """Seekable inputs must be used as is."""
+        wsgi_input = StringIO("foo")
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   CONTENT_LENGTH="3",
+                                   **{'wsgi.input': wsgi_input})
+        
+        self.handler(environ, MockStartResponse())
+        
+        self.assertIs(environ['wsgi.input'], wsgi_input)
+    
+    def test_file_wrapper(self):
+        """Bodies made by the server's file wrapper must be returned as is."""
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-file/",
+                                   **{'wsgi.file_wrapper': MockFileWrapper})
+        
+        response = self.handler(environ, MockStartResponse())
+        
+        self.assertIsInstance(response, MockFileWrapper)
+        self.assertEqual("".join(response), "body")
+    
+    def test_input_memory_threshold(self):
+        self.assertEqual(DjangoApplication().input_memory_threshold,
+                         DjangoApplication.input_memory_threshold)
+        self.assertEqual(DjangoApplication(10).input_memory_threshold, 10)
+    
+    def test_response_processors(self):
+        processed = []
+        def response_processor(request, response):
+            processed.append((request.path_info, response.status_code))
+            return TwodResponse("replaced", status=202)
+        handler = DjangoApplication(response_processors=[response_processor])
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/")
+        start_response = MockStartResponse()
+        
+        response = handler(environ, start_response)
+        
+        self.assertEqual(processed, [("/app1/wsgi-view-ok/", 200)])
+        self.assertEqual(start_response.status, "202 ACCEPTED")
+        self.assertEqual("".join(response), "replaced")
+    
+    def test_response_processors_before_response_middleware(self):
+        """The ETag computed by the response middleware must be up-to-date."""
+        def response_processor(request, response):
+            return TwodResponse("replaced")
+        handler = DjangoApplication(response_processors=[response_processor])
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/")
+        start_response = MockStartResponse()
+        
+        common_middleware_settings.USE_ETAGS = True
+        try:
+            handler(environ, start_response)
+        finally:
+            common_middleware_settings.USE_ETAGS = False
+        
+        headers = dict(start_response.response_headers)
+        self.assertEqual(headers['ETag'], '"%s"' % md5("replaced").hexdigest())
+    
+    def test_response_processor_errors(self):
+        """Errors in the response processors must be handled by Django."""
+        def response_processor(request, response):
+            raise ApplicationCallError("Fragment could not be retrieved")
+        handler = ErrorPageHandler(response_processors=[response_processor])
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/")
+        start_response = MockStartResponse()
+        
+        response = handler(environ, start_response)
+        
+        self.assertEqual(start_response.status[:3], "500")
+        self.assertEqual("".join(response), "ApplicationCallError")
+    
+    def test_deadline_header(self):
+        handler = TelltaleHandler(deadline_header="X-Request-Budget")
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   HTTP_X_REQUEST_BUDGET="2.5")
+        
+        start = time()
+        handler(environ, MockStartResponse())
+        
+        deadline = environ['twod.wsgi.deadline']
+        self.assertTrue(start + 2.5 <= deadline <= time() + 2.5)
+    
+    def test_earlier_deadline_kept(self):
+        handler = TelltaleHandler(deadline_header="X-Request-Budget")
+        deadline = time() + 1
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   HTTP_X_REQUEST_BUDGET="10",
+                                   **{'twod.wsgi.deadline': deadline})
+        
+        handler(environ, MockStartResponse())
+        
+        self.assertEqual(environ['twod.wsgi.deadline'], deadline)
+    
+    def test_invalid_deadline_header(self):
+        handler = TelltaleHandler(deadline_header="X-Request-Budget")
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   HTTP_X_REQUEST_BUDGET="soon")
+        
+        handler(environ, MockStartResponse())
+        
+        self.assertNotIn("twod.wsgi.deadline", environ)
+    
+    def test_no_deadline_header(self):
+        environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/",
+                                   HTTP_X_REQUEST_BUDGET="10")
+        
+        TelltaleHandler()(environ, MockStartResponse())
+        
+        self.assertNotIn("twod.wsgi.deadline", environ)
+    
     def test_no_actual_reason_phrase(self):
         """It must not replace the status reason if a custom one was not set."""
         environ = complete_environ(PATH_INFO="/app1/wsgi-view-ok/")
@@ -297,7 +556,8 @@ class TestStartResponse(unittest.TestCase):
     
     def setUp(self):
         self.original_sr = MockStartResponse()
-        self.sr_wrapper = _StartResponseWrapper(self.original_sr)
+        self.environ = {}
+        self.sr_wrapper = _StartResponseWrapper(self.original_sr, self.environ)
     
     def test_no_actual_phrase(self):
         """Nothing should be changed if there's no actual status reason."""
@@ -309,28 +569,133 @@ class TestStartResponse(unittest.TestCase):
         self.sr_wrapper(status, response_headers)
         self.assertTrue(self.original_sr.called)
         self.assertEqual(self.original_sr.status, status)
-        self.assertEqual(len(self.original_sr.response_headers), 2)
-        self.assertEqual(self.original_sr.response_headers, response_headers)
+        # The very same headers must be passed on, without copying them:
+        self.assertIs(self.original_sr.response_headers, response_headers)
         self.assertEqual(self.original_sr.exc_info, None)
     
     def test_with_actual_phrase(self):
-        """The status reason must be replaced if it's set in the headers."""
-        actual_status = "200 Cool"
-        response_headers = [
-            ("X-Foo", "Whatever"),
-            ("X-Actual-Status-Reason", actual_status),
-            ]
+        """The status reason must be replaced if it's set in the environ."""
+        self.environ[_STATUS_REASON_ENVIRON_KEY] = "Cool"
+        response_headers = [("X-Foo", "Whatever")]
         self.sr_wrapper("200 Sweet", response_headers)
         self.assertTrue(self.original_sr.called)
-        self.assertEqual(self.original_sr.status, actual_status)
-        self.assertEqual(len(self.original_sr.response_headers), 1)
-        self.assertEqual(self.original_sr.response_headers, [("X-Foo", "Whatever")])
+        self.assertEqual(self.original_sr.status, "200 Cool")
+        self.assertEqual(self.original_sr.response_headers, response_headers)
         self.assertEqual(self.original_sr.exc_info, None)
+        # The status reason must not be left in the environ:
+        self.assertNotIn(_STATUS_REASON_ENVIRON_KEY, self.environ)
+    
+    def test_exc_info(self):
+        """The exception information must be passed on, if any."""
+        exc_info = (ValueError, ValueError("Oops"), None)
+        self.sr_wrapper("500 Oops", [], exc_info)
+        self.assertEqual(self.original_sr.exc_info, exc_info)
+
+
+class TestSpooledInput(unittest.TestCase):
+    """Tests for :class:`_SpooledInput`."""
+    
+    def test_content_length(self):
+        """The input must not be read beyond the content length."""
+        original_input = NonSeekableInput("foobar")
+        spooled_input = _SpooledInput(original_input, "3", 1024)
+        
+        self.assertEqual(spooled_input.read(), "foo")
+        self.assertEqual(original_input.read(), "bar")
+    
+    def test_no_content_length(self):
+        """The input must not be read if there's no length."""
+        spooled_input = _SpooledInput(BlockingInput(), None, 1024)
+        
+        self.assertEqual(spooled_input.read(), "")
+        self.assertEqual(spooled_input.readline(), "")
+        spooled_input.seek(0, 2)
+        self.assertEqual(spooled_input.tell(), 0)
+    
+    def test_terminated_input(self):
+        """Terminated inputs must be read until exhausted."""
+        spooled_input = _SpooledInput(NonSeekableInput("foobar"), None, 1024,
+                                      True)
+        
+        self.assertEqual(spooled_input.read(), "foobar")
+    
+    def test_invalid_content_length(self):
+        spooled_input = _SpooledInput(BlockingInput(), "-1", 1024)
+        
+        self.assertEqual(spooled_input.read(), "")
+    
+    def test_lazy_reading(self):
+        """The original input must only be read when necessary."""
+        original_input = NonSeekableInput("foobar")
+        spooled_input = _SpooledInput(original_input, "6", 1024)
+        spooled_input.chunk_size = 2
+        
+        self.assertEqual(spooled_input.read(3), "foo")
+        self.assertEqual(original_input.read(), "ar")
+    
+    def test_seeking(self):
+        spooled_input = _SpooledInput(NonSeekableInput("foobar"), "6", 1024)
+        
+        self.assertEqual(spooled_input.read(3), "foo")
+        self.assertEqual(spooled_input.tell(), 3)
+        spooled_input.seek(0)
+        self.assertEqual(spooled_input.read(), "foobar")
+        spooled_input.seek(-3, 2)
+        self.assertEqual(spooled_input.read(), "bar")
+        spooled_input.seek(-4, 1)
+        self.assertEqual(spooled_input.read(2), "ob")
+    
+    def test_lines(self):
+        original_input = NonSeekableInput("foo\nbar\nbaz")
+        spooled_input = _SpooledInput(original_input, None, 1024, True)
+        spooled_input.chunk_size = 2
+        
+        self.assertEqual(spooled_input.readline(), "foo\n")
+        self.assertEqual(spooled_input.readline(2), "ba")
+        self.assertEqual(spooled_input.readlines(), ["r\n", "baz"])
+        spooled_input.seek(0)
+        self.assertEqual(list(spooled_input), ["foo\n", "bar\n", "baz"])
+    
+    def test_memory_threshold(self):
+        """Bodies beyond the memory threshold must be spooled to disk."""
+        small_input = _SpooledInput(NonSeekableInput("foo"), "3", 5)
+        small_input.read()
+        self.assertFalse(small_input.buffer._rolled)
+        
+        big_input = _SpooledInput(NonSeekableInput("foobar"), "6", 5)
+        big_input.read()
+        self.assertTrue(big_input.buffer._rolled)
+        big_input.seek(0)
+        self.assertEqual(big_input.read(), "foobar")
 
 
 #{ Test utilities
 
 
+class BlockingInput(object):
+    """
+    Mock ``wsgi.input`` for a socket with no more data, which would block if
+    read.
+    
+    """
+    
+    def read(self, size=-1):
+        raise AssertionError("The input was read past the end of the request")
+    
+    readline = read
+
+
+class NonSeekableInput(object):
+    """Mock ``wsgi.input`` which cannot be rewound."""
+    
+    def __init__(self, body):
+        self._body = StringIO(body)
+    
+    def read(self, size=-1):
+        return self._body.read(size)
+
+
+
 class TelltaleHandler(DjangoApplication):
     """
     Mock WSGI handler based on Twod's, which is going to be called once and it's
@@ -343,4 +708,15 @@ class TelltaleHandler(DjangoApplication):
         return super(TelltaleHandler, self).get_response(request)
 
 
+class ErrorPageHandler(DjangoApplication):
+    """
+    Mock WSGI handler based on Twod's, whose error page is the name of the
+    exception.
+    
+    """
+    
+    def handle_uncaught_exception(self, request, resolver, exc_info):
+        return TwodResponse(exc_info[0].__name__, status=500)
+
+
 #}
@@ -0,0 +1,867 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the WSGI application to serve static files.
+
+"""
+from email.utils import formatdate
+from gzip import GzipFile
+from os import (chmod, listdir, mkdir, path, remove, stat, symlink, urandom,
+                utime)
+from shutil import rmtree
+from stat import S_IMODE
+from StringIO import StringIO
+from tempfile import mkdtemp
+import sys
+
+from django.utils import unittest
+
+from twod.wsgi.media import (MediaApplication, MediaManifest, _compress_file,
+                             _FileIterator, _MappingIterator, _MEDIA_MANIFESTS,
+                             compress_media, compress_media_command,
+                             get_media_url, register_media_manifest)
+from twod.wsgi.templatetags.twod_media import media_url
+
+from . import (BaseDjangoTestCase, MockFileWrapper, MockStartResponse,
+               complete_environ)
+
+
+class TestMediaApplication(unittest.TestCase):
+    """Tests for :class:`MediaApplication`."""
+    
+    def setUp(self):
+        self.root_directory = mkdtemp()
+        mkdir(path.join(self.root_directory, "css"))
+        self.file_path = self._write_file("css/site.css", "body {color: red}")
+        utime(self.file_path, (1300000000, 1300000000))
+        self.app = MediaApplication(self.root_directory)
+    
+    def tearDown(self):
+        rmtree(self.root_directory)
+    
+    def test_file(self):
+        (status, headers, body) = self._get_response("/css/site.css")
+        
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(body, "body {color: red}")
+        self.assertEqual(headers['Content-Type'], "text/css")
+        self.assertEqual(headers['Content-Length'], "17")
+        self.assertEqual(headers['Accept-Ranges'], "bytes")
+        self.assertEqual(headers['Last-Modified'],
+                         "Sun, 13 Mar 2011 07:06:40 GMT")
+        self.assertTrue(headers['ETag'].startswith('"'))
+        self.assertNotIn("Cache-Control", headers)
+    
+    def test_unknown_content_type(self):
+        self._write_file("data.unknown-extension", "data")
+        
+        (status, headers, body) = self._get_response("/data.unknown-extension")
+        
+        self.assertEqual(headers['Content-Type'], "application/octet-stream")
+    
+    def test_cache_max_age(self):
+        app = MediaApplication(self.root_directory, cache_max_age=3600)
+        
+        (status, headers, body) = self._get_response("/css/site.css", app=app)
+        
+        self.assertEqual(headers['Cache-Control'], "max-age=3600")
+    
+    def test_head(self):
+        (status, headers, body) = self._get_response("/css/site.css",
+                                                     REQUEST_METHOD="HEAD")
+        
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers['Content-Length'], "17")
+        self.assertEqual(body, "")
+    
+    def test_unsupported_method(self):
+        (status, headers, body) = self._get_response("/css/site.css",
+                                                     REQUEST_METHOD="POST")
+        
+        self.assertEqual(status, "405 Method Not Allowed")
+        self.assertEqual(headers['Allow'], "GET, HEAD")
+    
+    def test_missing_file(self):
+        (status, headers, body) = self._get_response("/css/other.css")
+        
+        self.assertEqual(status, "404 Not Found")
+    
+    def test_directory(self):
+        for path_info in ("/css", "/css/", "/", ""):
+            (status, headers, body) = self._get_response(path_info)
+            self.assertEqual(status, "404 Not Found")
+    
+    def test_parent_directory(self):
+        file_name = path.basename(self.root_directory)
+        
+        for path_info in ("/../%s/css/site.css" % file_name,
+                          "/css/../../%s/css/site.css" % file_name):
+            (status, headers, body) = self._get_response(path_info)
+            self.assertEqual(status, "404 Not Found")
+    
+    def test_dot_segments(self):
+        (status, headers, body) = self._get_response("/./css//site.css")
+        
+        self.assertEqual(body, "body {color: red}")
+    
+    #{ Conditional requests
+    
+    def test_if_none_match(self):
+        etag = self._get_response("/css/site.css")[1]['ETag']
+        
+        for if_none_match in (etag, "W/" + etag, '"other", %s' % etag, "*"):
+            (status, headers, body) = self._get_response(
+                "/css/site.css",
+                HTTP_IF_NONE_MATCH=if_none_match,
+                )
+            self.assertEqual(status, "304 Not Modified")
+            self.assertEqual(headers['ETag'], etag)
+            self.assertEqual(body, "")
+    
+    def test_if_none_match_with_other_etag(self):
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            HTTP_IF_NONE_MATCH='"other"',
+            HTTP_IF_MODIFIED_SINCE=formatdate(1300000000, usegmt=True),
+            )
+        
+        self.assertEqual(status, "200 OK")
+    
+    def test_if_modified_since(self):
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            HTTP_IF_MODIFIED_SINCE=formatdate(1300000000, usegmt=True),
+            )
+        
+        self.assertEqual(status, "304 Not Modified")
+    
+    def test_modified_since(self):
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            HTTP_IF_MODIFIED_SINCE=formatdate(1200000000, usegmt=True),
+            )
+        
+        self.assertEqual(status, "200 OK")
+    
+    def test_invalid_if_modified_since(self):
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            HTTP_IF_MODIFIED_SINCE="yesterday",
+            )
+        
+        self.assertEqual(status, "200 OK")
+    
+    #}
+    
+    #{ Byte ranges
+    
+    def test_byte_range(self):
+        (status, headers, body) = self._get_response("/css/site.css",
+                                                     HTTP_RANGE="bytes=1-3")
+        
+        self.assertEqual(status, "206 Partial Content")
+        self.assertEqual(body, "ody")
+        self.assertEqual(headers['Content-Range'], "bytes 1-3/17")
+        self.assertEqual(headers['Content-Length'], "3")
+    
+    def test_open_byte_range(self):
+        (status, headers, body) = self._get_response("/css/site.css",
+                                                     HTTP_RANGE="bytes=13-")
+        
+        self.assertEqual(body, "red}")
+        self.assertEqual(headers['Content-Range'], "bytes 13-16/17")
+    
+    def test_byte_range_beyond_end(self):
+        (status, headers, body) = self._get_response("/css/site.css",
+                                                     HTTP_RANGE="bytes=13-99")
+        
+        self.assertEqual(body, "red}")
+    
+    def test_suffix_byte_range(self):
+        (status, headers, body) = self._get_response("/css/site.css",
+                                                     HTTP_RANGE="bytes=-4")
+        
+        self.assertEqual(body, "red}")
+        self.assertEqual(headers['Content-Range'], "bytes 13-16/17")
+    
+    def test_unsatisfiable_byte_range(self):
+        for range_header in ("bytes=17-", "bytes=-0"):
+            (status, headers, body) = self._get_response(
+                "/css/site.css",
+                HTTP_RANGE=range_header,
+                )
+            self.assertEqual(status, "416 Requested Range Not Satisfiable")
+            self.assertEqual(headers['Content-Range'], "bytes */17")
+    
+    def test_ignored_byte_ranges(self):
+        for range_header in ("bytes=0-1,3-4", "bytes=3-1", "bytes=a-b",
+                             "lines=1-2"):
+            (status, headers, body) = self._get_response(
+                "/css/site.css",
+                HTTP_RANGE=range_header,
+                )
+            self.assertEqual(status, "200 OK")
+            self.assertEqual(body, "body {color: red}")
+    
+    def test_if_range(self):
+        (status, headers, body) = self._get_response("/css/site.css")
+        
+        for if_range in (headers['ETag'], headers['Last-Modified']):
+            (status, headers, body) = self._get_response(
+                "/css/site.css",
+                HTTP_RANGE="bytes=1-3",
+                HTTP_IF_RANGE=if_range,
+                )
+            self.assertEqual(status, "206 Partial Content")
+        
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            HTTP_RANGE="bytes=1-3",
+            HTTP_IF_RANGE='"outdated"',
+            )
+        self.assertEqual(status, "200 OK")
+    
+    #}
+    
+    #{ Big files
+    
+    def test_file_wrapper(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10)
+        
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            app=app,
+            **{'wsgi.file_wrapper': MockFileWrapper}
+            )
+        
+        self.assertEqual(body, "body {color: red}")
+        self.assertIsInstance(self.app_iter, MockFileWrapper)
+    
+    def test_no_file_wrapper(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               block_size=5, max_mapped_size=0)
+        
+        (status, headers, body) = self._get_response("/css/site.css", app=app)
+        
+        self.assertEqual(body, "body {color: red}")
+        self.assertIsInstance(self.app_iter, _FileIterator)
+    
+    def test_file_removed(self):
+        """A file removed after its status was cached is not found."""
+        app = MediaApplication(self.root_directory, stat_ttl=60,
+                               max_cached_file_size=10, max_mapped_size=0)
+        self._get_response("/css/site.css", app=app)
+        remove(self.file_path)
+        
+        (status, headers, body) = self._get_response("/css/site.css", app=app)
+        
+        self.assertEqual(status, "404 Not Found")
+        self.assertEqual(headers['Content-Length'], str(len(body)))
+    
+    def test_unreadable_file(self):
+        app = MediaApplication(self.root_directory, stat_ttl=60,
+                               max_cached_file_size=10, max_mapped_size=0)
+        self._get_response("/css/site.css", app=app)
+        remove(self.file_path)
+        mkdir(self.file_path)
+        
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            app=app,
+            **{'wsgi.file_wrapper': MockFileWrapper}
+            )
+        
+        self.assertEqual(status, "500 Internal Server Error")
+        self.assertEqual(headers['Content-Length'], str(len(body)))
+    
+    def test_byte_range_of_big_file(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               block_size=2, max_mapped_size=0)
+        
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            app=app,
+            HTTP_RANGE="bytes=1-10",
+            **{'wsgi.file_wrapper': MockFileWrapper}
+            )
+        
+        self.assertEqual(body, "ody {color")
+        self.assertIsInstance(self.app_iter, _FileIterator)
+    
+    #}
+    
+    #{ Memory mappings
+    
+    def test_no_mappings_by_default(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10)
+        
+        (status, headers, body) = self._get_response("/css/site.css", app=app)
+        
+        self.assertEqual(body, "body {color: red}")
+        self.assertIsInstance(self.app_iter, _FileIterator)
+        self.assertEqual(len(app._mapped_files), 0)
+    
+    def test_mapped_file(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               block_size=5, max_mapped_size=1024)
+        
+        (status, headers, body) = self._get_response("/css/site.css", app=app)
+        
+        self.assertEqual(body, "body {color: red}")
+        self.assertIsInstance(self.app_iter, _MappingIterator)
+        self.assertEqual(list(app._mapped_files), [self.file_path])
+        self.assertEqual(app._mapped_files_size, 17)
+    
+    def test_byte_range_of_mapped_file(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               block_size=2, max_mapped_size=1024)
+        
+        (status, headers, body) = self._get_response(
+            "/css/site.css",
+            app=app,
+            HTTP_RANGE="bytes=1-10",
+            **{'wsgi.file_wrapper': MockFileWrapper}
+            )
+        
+        self.assertEqual(status, "206 Partial Content")
+        self.assertEqual(body, "ody {color")
+        self.assertIsInstance(self.app_iter, _MappingIterator)
+    
+    def test_file_wrapper_preferred_to_mapping(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               max_mapped_size=1024)
+        
+        self._get_response(
+            "/css/site.css",
+            app=app,
+            **{'wsgi.file_wrapper': MockFileWrapper}
+            )
+        
+        self.assertIsInstance(self.app_iter, MockFileWrapper)
+        self.assertEqual(len(app._mapped_files), 0)
+    
+    def test_mapping_reused(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               max_mapped_size=1024)
+        
+        self._get_response("/css/site.css", app=app)
+        mapping = app._mapped_files[self.file_path][1]
+        self._get_response("/css/site.css", app=app)
+        
+        self.assertIs(app._mapped_files[self.file_path][1], mapping)
+    
+    def test_changed_file_mapped_again(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               stat_ttl=0, max_mapped_size=1024)
+        
+        self._get_response("/css/site.css", app=app)
+        self._write_file("css/site.css", "body {color: blue}")
+        (status, headers, body) = self._get_response("/css/site.css", app=app)
+        
+        self.assertEqual(body, "body {color: blue}")
+        self.assertEqual(app._mapped_files_size, 18)
+    
+    def test_file_too_big_to_be_mapped(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               max_mapped_size=16)
+        
+        (status, headers, body) = self._get_response("/css/site.css", app=app)
+        
+        self.assertEqual(body, "body {color: red}")
+        self.assertIsInstance(self.app_iter, _FileIterator)
+    
+    def test_least_recently_used_mappings_evicted(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               max_mapped_size=40)
+        self._write_file("a.css", "a" * 17)
+        self._write_file("b.css", "b" * 17)
+        
+        for path_info in ("/css/site.css", "/a.css", "/css/site.css",
+                          "/b.css"):
+            self._get_response(path_info, app=app)
+        
+        self.assertEqual(sorted(app._mapped_files),
+                         [path.join(self.root_directory, "b.css"),
+                          self.file_path])
+        self.assertEqual(app._mapped_files_size, 34)
+    
+    def test_evicted_mapping_still_served(self):
+        app = MediaApplication(self.root_directory, max_cached_file_size=10,
+                               max_mapped_size=20, block_size=5)
+        self._write_file("a.css", "a" * 17)
+        environ = complete_environ(PATH_INFO="/css/site.css")
+        app_iter = app(environ, MockStartResponse())
+        
+        self._get_response("/a.css", app=app)
+        
+        self.assertNotIn(self.file_path, app._mapped_files)
+        self.assertEqual("".join(app_iter), "body {color: red}")
+    
+    #}
+    
+    #{ Caching
+    
+    def test_file_status_reused(self):
+        app = MediaApplication(self.root_directory, stat_ttl=60)
+        
+        self._get_response("/new.css", app=app)
+        self._write_file("new.css", "a {}")
+        (status, headers, body) = self._get_response("/new.css", app=app)
+        
+        self.assertEqual(status, "404 Not Found")
+    
+    def test_file_status_expired(self):
+        app = MediaApplication(self.root_directory, stat_ttl=0)
+        
+        self._get_response("/new.css", app=app)
+        self._write_file("new.css", "a {}")
+        (status, headers, body) = self._get_response("/new.css", app=app)
+        
+        self.assertEqual(status, "200 OK")
+    
+    def test_changed_file(self):
+        app = MediaApplication(self.root_directory, stat_ttl=0)
+        
+        self._get_response("/css/site.css", app=app)
+        self._write_file("css/site.css", "body {color: blue}")
+        (status, headers, body) = self._get_response("/css/site.css", app=app)
+        
+        self.assertEqual(body, "body {color: blue}")
+    
+    def test_file_contents_reused(self):
+        self._get_response("/css/site.css")
+        # Replacing the file without changing its status:
+        self._write_file("css/site.css", "body {color: blue}")
+        utime(self.file_path, (1300000000, 1300000000))
+        
+        (status, headers, body) = self._get_response("/css/site.css")
+        
+        self.assertEqual(body, "body {color: red}")
+    
+    def test_least_recently_used_files_evicted(self):
+        app = MediaApplication(self.root_directory, max_cache_size=40)
+        self._write_file("a.css", "a" * 17)
+        self._write_file("b.css", "b" * 17)
+        
+        for path_info in ("/css/site.css", "/a.css", "/css/site.css",
+                          "/b.css"):
+            self._get_response(path_info, app=app)
+        
+        self.assertEqual(sorted(app._cached_files),
+                         [path.join(self.root_directory, "b.css"),
+                          self.file_path])
+    
+    #}
+    
+    def _get_response(self, path_info, app=None, **environ):
+        environ = complete_environ(PATH_INFO=path_info, **environ)
+        start_response = MockStartResponse()
+        self.app_iter = (app or self.app)(environ, start_response)
+        try:
+            body = "".join(self.app_iter)
+        finally:
+            if hasattr(self.app_iter, "close"):
+                self.app_iter.close()
+        return (start_response.status, dict(start_response.response_headers),
+                body)
+    
+    def _write_file(self, relative_path, contents):
+        file_path = path.join(self.root_directory, relative_path)
+        with open(file_path, "wb") as file_:
+            file_.write(contents)
+        return file_path
+
+
+class TestPrecompressedVariants(unittest.TestCase):
+    """Tests for the precompressed variants of the files in the media."""
+    
+    def setUp(self):
+        self.root_directory = mkdtemp()
+        self.app = MediaApplication(self.root_directory)
+        _write_file(self.root_directory, "site.css", "body {color: red}",
+                    1300000000)
+        _write_file(self.root_directory, "site.css.gz", "gzip", 1300000000)
+        _write_file(self.root_directory, "site.css.br", "brotli", 1300000000)
+        _write_file(self.root_directory, "other.css", "p {}", 1300000000)
+    
+    def tearDown(self):
+        rmtree(self.root_directory)
+    
+    def test_preferred_variant(self):
+        (status, headers, body) = self._get_response(
+            "/site.css",
+            HTTP_ACCEPT_ENCODING="gzip, deflate, br",
+            )
+        
+        self.assertEqual(body, "brotli")
+        self.assertEqual(headers['Content-Encoding'], "br")
+        self.assertEqual(headers['Content-Type'], "text/css")
+        self.assertEqual(headers['Content-Length'], "6")
+        self.assertEqual(headers['Vary'], "Accept-Encoding")
+    
+    def test_quality_values(self):
+        (status, headers, body) = self._get_response(
+            "/site.css",
+            HTTP_ACCEPT_ENCODING="br;q=0.5, gzip",
+            )
+        
+        self.assertEqual(body, "gzip")
+        self.assertEqual(headers['Content-Encoding'], "gzip")
+    
+    def test_wildcard(self):
+        (status, headers, body) = self._get_response(
+            "/site.css",
+            HTTP_ACCEPT_ENCODING="br;q=0, *",
+            )
+        
+        self.assertEqual(body, "gzip")
+    
+    def test_alias(self):
+        app = MediaApplication(self.root_directory,
+                               precompressed_encodings=("gzip", ))
+        
+        (status, headers, body) = self._get_response(
+            "/site.css",
+            app,
+            HTTP_ACCEPT_ENCODING="x-gzip",
+            )
+        
+        self.assertEqual(body, "gzip")
+    
+    def test_no_acceptable_variant(self):
+        for accept_encoding in (None, "deflate", "gzip;q=0, br;q=0"):
+            environ = {}
+            if accept_encoding:
+                environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+            
+            (status, headers, body) = self._get_response("/site.css",
+                                                         **environ)
+            
+            self.assertEqual(body, "body {color: red}")
+            self.assertNotIn("Content-Encoding", headers)
+            self.assertEqual(headers['Vary'], "Accept-Encoding")
+    
+    def test_file_without_variants(self):
+        (status, headers, body) = self._get_response(
+            "/other.css",
+            HTTP_ACCEPT_ENCODING="gzip",
+            )
+        
+        self.assertEqual(body, "p {}")
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertNotIn("Vary", headers)
+    
+    def test_outdated_variant(self):
+        _write_file(self.root_directory, "site.css", "body {color: blue}",
+                    1300000001)
+        
+        (status, headers, body) = self._get_response(
+            "/site.css",
+            HTTP_ACCEPT_ENCODING="gzip, br",
+            )
+        
+        self.assertEqual(body, "body {color: blue}")
+        self.assertNotIn("Vary", headers)
+    
+    def test_variants_disabled(self):
+        app = MediaApplication(self.root_directory, precompressed_encodings=())
+        
+        (status, headers, body) = self._get_response(
+            "/site.css",
+            app,
+            HTTP_ACCEPT_ENCODING="gzip, br",
+            )
+        
+        self.assertEqual(body, "body {color: red}")
+    
+    def test_variant_requested_directly(self):
+        (status, headers, body) = self._get_response(
+            "/site.css.gz",
+            HTTP_ACCEPT_ENCODING="gzip",
+            )
+        
+        self.assertEqual(body, "gzip")
+        self.assertEqual(headers['Content-Type'], "application/gzip")
+        self.assertNotIn("Content-Encoding", headers)
+    
+    def test_variant_not_modified(self):
+        (status, headers, body) = self._get_response(
+            "/site.css",
+            HTTP_ACCEPT_ENCODING="gzip",
+            )
+        
+        (status, headers, body) = self._get_response(
+            "/site.css",
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=headers['ETag'],
+            )
+        
+        self.assertEqual(status, "304 Not Modified")
+        self.assertEqual(headers['Vary'], "Accept-Encoding")
+    
+    def _get_response(self, path_info, app=None, **environ):
+        environ = complete_environ(PATH_INFO=path_info, **environ)
+        start_response = MockStartResponse()
+        body = "".join((app or self.app)(environ, start_response))
+        return (start_response.status, dict(start_response.response_headers),
+                body)
+
+
+class TestMediaFingerprinting(BaseDjangoTestCase):
+    """Tests for :class:`MediaManifest` and the fingerprinted media."""
+    
+    def setUp(self):
+        super(TestMediaFingerprinting, self).setUp()
+        self.root_directory = mkdtemp()
+        mkdir(path.join(self.root_directory, "css"))
+        _write_file(self.root_directory, "css/site.css", "body {color: red}",
+                    1300000000)
+        _write_file(self.root_directory, "css/site.css.gz", "gzip",
+                    1300000000)
+        _write_file(self.root_directory, "LICENSE", "BSD")
+        self.manifest = MediaManifest(self.root_directory, "/media/")
+        self.app = MediaApplication(self.root_directory, cache_max_age=60,
+                                    manifest=self.manifest)
+    
+    def tearDown(self):
+        rmtree(self.root_directory)
+        _MEDIA_MANIFESTS.clear()
+        super(TestMediaFingerprinting, self).tearDown()
+    
+    def test_fingerprinted_paths(self):
+        self.assertEqual(self.manifest.fingerprinted_paths, {
+            'css/site.css': "css/site.54b83696b687.css",
+            'LICENSE': "LICENSE.c539e03be7b2",
+            })
+    
+    def test_url(self):
+        self.assertEqual(self.manifest.get_url("css/site.css"),
+                         "/media/css/site.54b83696b687.css")
+        self.assertEqual(self.manifest.get_url("/css/site.css"),
+                         "/media/css/site.54b83696b687.css")
+        self.assertEqual(self.manifest.get_url("css/missing.css"),
+                         "/media/css/missing.css")
+    
+    def test_logical_path(self):
+        self.assertEqual(
+            self.manifest.get_logical_path("/css/site.54b83696b687.css"),
+            "css/site.css",
+            )
+        self.assertIsNone(self.manifest.get_logical_path("/css/site.css"))
+    
+    def test_fingerprinted_file(self):
+        (status, headers, body) = self._get_response(
+            "/css/site.54b83696b687.css",
+            )
+        
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(body, "body {color: red}")
+        self.assertEqual(headers['Content-Type'], "text/css")
+        self.assertEqual(headers['Cache-Control'],
+                         "public, max-age=31536000, immutable")
+    
+    def test_fingerprinted_variant(self):
+        (status, headers, body) = self._get_response(
+            "/css/site.54b83696b687.css",
+            HTTP_ACCEPT_ENCODING="gzip",
+            )
+        
+        self.assertEqual(body, "gzip")
+        self.assertEqual(headers['Content-Encoding'], "gzip")
+        self.assertEqual(headers['Cache-Control'],
+                         "public, max-age=31536000, immutable")
+    
+    def test_logical_path_served(self):
+        (status, headers, body) = self._get_response("/css/site.css")
+        
+        self.assertEqual(body, "body {color: red}")
+        self.assertEqual(headers['Cache-Control'], "max-age=60")
+    
+    def test_outdated_fingerprint(self):
+        _write_file(self.root_directory, "css/site.css", "body {color: blue}",
+                    1300000001)
+        
+        (status, headers, body) = self._get_response(
+            "/css/site.54b83696b687.css",
+            )
+        
+        self.assertEqual(body, "body {color: blue}")
+        self.assertEqual(headers['Cache-Control'], "max-age=60")
+    
+    def test_unknown_fingerprint(self):
+        (status, headers, body) = self._get_response(
+            "/css/site.000000000000.css",
+            )
+        
+        self.assertEqual(status, "404 Not Found")
+    
+    #{ URL resolution
+    
+    def test_media_url(self):
+        register_media_manifest(self.manifest)
+        
+        self.assertEqual(get_media_url("css/site.css"),
+                         "/media/css/site.54b83696b687.css")
+        self.assertEqual(get_media_url("/media/LICENSE"),
+                         "/media/LICENSE.c539e03be7b2")
+    
+    def test_media_url_without_manifest(self):
+        self.assertEqual(get_media_url("css/site.css"), "/media/css/site.css")
+        self.assertEqual(get_media_url("/static/admin/css/base.css"),
+                         "/static/admin/css/base.css")
+    
+    def test_longest_manifest_prefix(self):
+        register_media_manifest(self.manifest)
+        css_directory = mkdtemp()
+        try:
+            _write_file(css_directory, "site.css", "BSD")
+            register_media_manifest(MediaManifest(css_directory,
+                                                  "/media/css/"))
+        finally:
+            rmtree(css_directory)
+        
+        self.assertEqual(get_media_url("css/site.css"),
+                         "/media/css/site.c539e03be7b2.css")
+        self.assertEqual(get_media_url("LICENSE"),
+                         "/media/LICENSE.c539e03be7b2")
+    
+    def test_template_tag(self):
+        register_media_manifest(self.manifest)
+        
+        self.assertEqual(media_url("css/site.css"),
+                         "/media/css/site.54b83696b687.css")
+    
+    #}
+    
+    def _get_response(self, path_info, **environ):
+        environ = complete_environ(PATH_INFO=path_info, **environ)
+        start_response = MockStartResponse()
+        body = "".join(self.app(environ, start_response))
+        return (start_response.status, dict(start_response.response_headers),
+                body)
+
+
+class TestMediaCompression(unittest.TestCase):
+    """Tests for :func:`compress_media`."""
+    
+    def setUp(self):
+        self.root_directory = mkdtemp()
+        mkdir(path.join(self.root_directory, "js"))
+        self.css_path = _write_file(self.root_directory, "site.css",
+                                    "body {color: red}\n" * 20, 1300000000)
+        self.js_path = _write_file(self.root_directory, "js/site.js",
+                                   "var a = 1;\n" * 40, 1300000000)
+    
+    def tearDown(self):
+        rmtree(self.root_directory)
+    
+    def test_text_files(self):
+        _write_file(self.root_directory, "image.png", "x" * 1000)
+        
+        compressed_files = compress_media(self.root_directory, processes=2)
+        
+        self.assertEqual(sorted(compressed_files),
+                         sorted([self.css_path, self.js_path]))
+        variant = GzipFile(self.css_path + ".gz")
+        self.assertEqual(variant.read(), "body {color: red}\n" * 20)
+        self.assertEqual(stat(self.css_path + ".gz").st_mtime, 1300000000)
+        self.assertFalse(path.exists(path.join(self.root_directory,
+                                               "image.png.gz")))
+    
+    def test_up_to_date_variants_skipped(self):
+        compress_media(self.root_directory, processes=1)
+        _write_file(self.root_directory, "js/site.js", "var b = 2;\n" * 40,
+                    1300000001)
+        
+        compressed_files = compress_media(self.root_directory, processes=1)
+        
+        self.assertEqual(compressed_files, [self.js_path])
+    
+    def test_variants_served(self):
+        """The variants are up-to-date even with sub-second timestamps."""
+        # The file system sets the current time, with its full precision:
+        _write_file(self.root_directory, "site.css", "body {color: red}\n" * 20)
+        compress_media(self.root_directory, processes=1)
+        app = MediaApplication(self.root_directory)
+        environ = complete_environ(PATH_INFO="/site.css",
+                                   HTTP_ACCEPT_ENCODING="gzip")
+        start_response = MockStartResponse()
+        
+        body = "".join(app(environ, start_response))
+        
+        headers = dict(start_response.response_headers)
+        self.assertEqual(headers['Content-Encoding'], "gzip")
+        self.assertEqual(GzipFile(fileobj=StringIO(body)).read(),
+                         "body {color: red}\n" * 20)
+        self.assertEqual(compress_media(self.root_directory, processes=1), [])
+    
+    def test_variant_permissions(self):
+        chmod(self.css_path, 0644)
+        
+        compress_media(self.root_directory, processes=1)
+        
+        self.assertEqual(S_IMODE(stat(self.css_path + ".gz").st_mode), 0644)
+    
+    def test_small_files_skipped(self):
+        compressed_files = compress_media(self.root_directory, min_size=400,
+                                          processes=1)
+        
+        self.assertEqual(compressed_files, [self.js_path])
+    
+    def test_incompressible_files_skipped(self):
+        _write_file(self.root_directory, "random.txt", urandom(2000))
+        
+        compressed_files = compress_media(self.root_directory, processes=1)
+        
+        self.assertEqual(len(compressed_files), 2)
+        self.assertEqual(sorted(listdir(self.root_directory)),
+                         ["js", "random.txt", "site.css", "site.css.gz"])
+    
+    def test_broken_symbolic_links_skipped(self):
+        symlink(path.join(self.root_directory, "missing.css"),
+                path.join(self.root_directory, "broken.css"))
+        
+        compressed_files = compress_media(self.root_directory, processes=1)
+        
+        self.assertEqual(len(compressed_files), 2)
+    
+    def test_removed_files_skipped(self):
+        remove(self.css_path)
+        
+        self.assertFalse(_compress_file((self.css_path, 9)))
+        self.assertFalse(path.exists(self.css_path + ".gz"))
+    
+    def test_command(self):
+        original_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            compress_media_command([self.root_directory, "--processes=1"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = original_stdout
+        
+        self.assertEqual(output,
+                         "%s: 2 files compressed\n" % self.root_directory)
+        self.assertTrue(path.exists(self.js_path + ".gz"))
+
+
+def _write_file(root_directory, relative_path, contents, mtime=None):
+    file_path = path.join(root_directory, relative_path)
+    with open(file_path, "wb") as file_:
+        file_.write(contents)
+    if mtime is not None:
+        utime(file_path, (mtime, mtime))
+    return file_path
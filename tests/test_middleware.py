@@ -21,7 +21,10 @@ import os
 
 from django.utils import unittest
 
-from twod.wsgi.middleware import RoutingArgsMiddleware
+from twod.wsgi.middleware import (PrefixDispatcher, RoutingArgsMiddleware,
+                                  resolve_django_session_identity)
+
+from . import BaseDjangoTestCase, MockApp, MockStartResponse, complete_environ
 
 os.environ['DJANGO_SETTINGS_MODULE'] = "tests.fixtures.sampledjango"
 
@@ -66,6 +69,152 @@ class TestRoutingArgs(unittest.TestCase):
         self.assertIsNone(result, None)
 
 
+class TestPrefixDispatcher(unittest.TestCase):
+    """Tests for the WSGI middleware which dispatches requests by prefix."""
+    
+    def setUp(self):
+        self.django_app = MockApp("200 OK", [("X-APP", "django")])
+        self.trac_app = MockApp("200 OK", [("X-APP", "trac")])
+        self.wiki_app = MockApp("200 OK", [("X-APP", "wiki")])
+        self.dispatcher = PrefixDispatcher(self.django_app, {
+            '/trac': self.trac_app,
+            '/trac/wiki/': self.wiki_app,
+            })
+    
+    def test_unmounted_path(self):
+        start_response = self._call(PATH_INFO="/blog/post")
+        
+        self.assertIn(("X-APP", "django"), start_response.response_headers)
+        self.assertEqual(self.django_app.environ['PATH_INFO'], "/blog/post")
+    
+    def test_prefix_not_followed_by_slash(self):
+        start_response = self._call(PATH_INFO="/tracker")
+        
+        self.assertIn(("X-APP", "django"), start_response.response_headers)
+    
+    def test_mount_point(self):
+        environ = complete_environ(SCRIPT_NAME="/dev",
+                                   PATH_INFO="/trac/timeline")
+        
+        self.dispatcher(environ, MockStartResponse())
+        
+        self.assertEqual(self.trac_app.environ['SCRIPT_NAME'], "/dev/trac")
+        self.assertEqual(self.trac_app.environ['PATH_INFO'], "/timeline")
+        # The original environ must have not been modified:
+        self.assertEqual(environ['SCRIPT_NAME'], "/dev")
+        self.assertEqual(environ['PATH_INFO'], "/trac/timeline")
+    
+    def test_exact_prefix(self):
+        self._call(PATH_INFO="/trac")
+        
+        self.assertEqual(self.trac_app.environ['SCRIPT_NAME'], "/trac")
+        self.assertEqual(self.trac_app.environ['PATH_INFO'], "")
+    
+    def test_longest_prefix(self):
+        start_response = self._call(PATH_INFO="/trac/wiki/Main")
+        
+        self.assertIn(("X-APP", "wiki"), start_response.response_headers)
+        self.assertEqual(self.wiki_app.environ['SCRIPT_NAME'], "/trac/wiki")
+        self.assertEqual(self.wiki_app.environ['PATH_INFO'], "/Main")
+    
+    def test_routing_args_removed(self):
+        self._call(PATH_INFO="/trac/timeline",
+                   **{'wsgiorg.routing_args': ((), {}),
+                      'webob.adhoc_attrs': {}})
+        
+        self.assertNotIn("wsgiorg.routing_args", self.trac_app.environ)
+        self.assertNotIn("webob.adhoc_attrs", self.trac_app.environ)
+    
+    def test_identity(self):
+        dispatcher = PrefixDispatcher(self.django_app,
+                                      {'/trac': self.trac_app},
+                                      lambda environ: "foobar")
+        
+        dispatcher(complete_environ(PATH_INFO="/trac/timeline"),
+                   MockStartResponse())
+        dispatcher(complete_environ(PATH_INFO="/blog"), MockStartResponse())
+        
+        self.assertEqual(self.trac_app.environ['REMOTE_USER'], "foobar")
+        # The Django application must be left alone:
+        self.assertNotIn("REMOTE_USER", self.django_app.environ)
+    
+    def test_anonymous_identity(self):
+        dispatcher = PrefixDispatcher(self.django_app,
+                                      {'/trac': self.trac_app},
+                                      lambda environ: None)
+        
+        dispatcher(complete_environ(PATH_INFO="/trac/timeline",
+                                    REMOTE_USER="server-user"),
+                   MockStartResponse())
+        
+        self.assertEqual(self.trac_app.environ['REMOTE_USER'], "server-user")
+    
+    def _call(self, **environ):
+        start_response = MockStartResponse()
+        self.dispatcher(complete_environ(**environ), start_response)
+        return start_response
+
+
+class TestDjangoSessionIdentity(BaseDjangoTestCase):
+    """Tests for the identity resolver based on Django sessions."""
+    
+    def setUp(self):
+        super(TestDjangoSessionIdentity, self).setUp()
+        from django.conf import settings
+        settings.SESSION_ENGINE = "tests.fixtures.mock_auth"
+    
+    def test_logged_in_user(self):
+        environ = complete_environ(HTTP_COOKIE="sessionid=valid-session")
+        
+        self.assertEqual(resolve_django_session_identity(environ), "foobar")
+    
+    def test_no_session(self):
+        self.assertIsNone(resolve_django_session_identity(complete_environ()))
+    
+    def test_anonymous_session(self):
+        environ = complete_environ(HTTP_COOKIE="sessionid=anonymous-session")
+        
+        self.assertIsNone(resolve_django_session_identity(environ))
+    
+    def test_unknown_session(self):
+        environ = complete_environ(HTTP_COOKIE="sessionid=unknown")
+        
+        self.assertIsNone(resolve_django_session_identity(environ))
+    
+    def test_deleted_user(self):
+        environ = complete_environ(HTTP_COOKIE="sessionid=deleted-user-session")
+        
+        self.assertIsNone(resolve_django_session_identity(environ))
+    
+    def test_request_signals(self):
+        """The database connection must be closed after the lookup."""
+        from django.core.signals import request_finished, request_started
+        signals = []
+        def receive_request_started(sender, **kwargs):
+            signals.append("request_started")
+        def receive_request_finished(sender, **kwargs):
+            signals.append("request_finished")
+        request_started.connect(receive_request_started)
+        request_finished.connect(receive_request_finished)
+        environ = complete_environ(HTTP_COOKIE="sessionid=valid-session")
+        
+        try:
+            resolve_django_session_identity(environ)
+            resolve_django_session_identity(complete_environ())
+        finally:
+            request_started.disconnect(receive_request_started)
+            request_finished.disconnect(receive_request_finished)
+        
+        self.assertEqual(signals, ["request_started", "request_finished"])
+    
+    def test_custom_cookie_name(self):
+        from django.conf import settings
+        settings.SESSION_COOKIE_NAME = "s"
+        environ = complete_environ(HTTP_COOKIE="s=valid-session")
+        
+        self.assertEqual(resolve_django_session_identity(environ), "foobar")
+
+
 #{ Mock objects
 
 
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the WSGI application to dispatch requests to mounted applications.
+
+"""
+from django.utils import unittest
+
+from twod.wsgi.mounts import MountTable
+
+from . import MockApp, MockStartResponse, complete_environ
+
+
+class TestMountTable(unittest.TestCase):
+    """Tests for :class:`MountTable`."""
+    
+    def setUp(self):
+        self.root_app = _make_app()
+        self.media_app = _make_app()
+        self.admin_media_app = _make_app()
+        self.mount_table = MountTable()
+        self.mount_table['/'] = self.root_app
+        self.mount_table['/media/'] = self.media_app
+        self.mount_table['/media/admin'] = self.admin_media_app
+    
+    def test_root(self):
+        environ = self._call("/blog/post")
+        
+        self.assertIs(self.root_app.environ, environ)
+        self.assertEqual(environ['SCRIPT_NAME'], "/site")
+        self.assertEqual(environ['PATH_INFO'], "/blog/post")
+    
+    def test_prefix(self):
+        environ = self._call("/media/css/site.css")
+        
+        self.assertIs(self.media_app.environ, environ)
+        self.assertEqual(environ['SCRIPT_NAME'], "/site/media")
+        self.assertEqual(environ['PATH_INFO'], "/css/site.css")
+    
+    def test_longest_prefix(self):
+        environ = self._call("/media/admin/css/base.css")
+        
+        self.assertIs(self.admin_media_app.environ, environ)
+        self.assertEqual(environ['SCRIPT_NAME'], "/site/media/admin")
+        self.assertEqual(environ['PATH_INFO'], "/css/base.css")
+    
+    def test_whole_path(self):
+        environ = self._call("/media")
+        
+        self.assertIs(self.media_app.environ, environ)
+        self.assertEqual(environ['SCRIPT_NAME'], "/site/media")
+        self.assertEqual(environ['PATH_INFO'], "")
+    
+    def test_trailing_slash(self):
+        environ = self._call("/media/admin/")
+        
+        self.assertIs(self.admin_media_app.environ, environ)
+        self.assertEqual(environ['PATH_INFO'], "/")
+    
+    def test_partial_segment(self):
+        environ = self._call("/mediafiles/site.css")
+        
+        self.assertIs(self.root_app.environ, environ)
+        self.assertEqual(environ['PATH_INFO'], "/mediafiles/site.css")
+    
+    def test_multiple_slashes(self):
+        environ = self._call("//media//css/site.css")
+        
+        self.assertIs(self.media_app.environ, environ)
+        self.assertEqual(environ['PATH_INFO'], "/css/site.css")
+    
+    def test_intermediate_segment_without_app(self):
+        mount_table = MountTable()
+        mount_table['/a/b'] = self.media_app
+        
+        start_response = MockStartResponse()
+        body = mount_table(complete_environ(PATH_INFO="/a/c"), start_response)
+        
+        self.assertEqual(start_response.status, "404 Not Found")
+        self.assertEqual(body, ["Not Found"])
+    
+    def test_custom_not_found_app(self):
+        mount_table = MountTable(self.root_app)
+        mount_table['/media'] = self.media_app
+        environ = complete_environ(PATH_INFO="/blog")
+        
+        mount_table(environ, MockStartResponse())
+        
+        self.assertIs(self.root_app.environ, environ)
+    
+    #{ Hosts
+    
+    def test_host(self):
+        host_app = _make_app()
+        self.mount_table['http://Example.com/media'] = host_app
+        
+        environ = self._call("/media/site.css", HTTP_HOST="example.com")
+        
+        self.assertIs(host_app.environ, environ)
+        self.assertEqual(environ['PATH_INFO'], "/site.css")
+    
+    def test_other_host(self):
+        self.mount_table[("example.com", "/media")] = _make_app()
+        
+        environ = self._call("/media/site.css", HTTP_HOST="example.org")
+        
+        self.assertIs(self.media_app.environ, environ)
+    
+    def test_host_precedence(self):
+        host_app = _make_app()
+        self.mount_table["http://example.com/"] = host_app
+        
+        environ = self._call("/media/admin/css/base.css",
+                             HTTP_HOST="example.com")
+        
+        self.assertIs(host_app.environ, environ)
+        self.assertEqual(environ['PATH_INFO'], "/media/admin/css/base.css")
+    
+    def test_host_with_port(self):
+        host_app = _make_app()
+        self.mount_table["https://example.com:443/media"] = host_app
+        
+        environ = self._call("/media/site.css", HTTP_HOST="example.com",
+                             **{'wsgi.url_scheme': "https"})
+        
+        self.assertIs(host_app.environ, environ)
+    
+    def test_server_name(self):
+        host_app = _make_app()
+        self.mount_table["http://example.org/media"] = host_app
+        
+        environ = self._call("/media/site.css")
+        
+        self.assertIs(host_app.environ, environ)
+    
+    #}
+    
+    #{ Dictionary interface
+    
+    def test_getting_mounts(self):
+        self.assertIs(self.mount_table['/media'], self.media_app)
+        self.assertIs(self.mount_table[(None, "/media/")], self.media_app)
+        self.assertRaises(KeyError, lambda: self.mount_table['/other'])
+    
+    def test_replacing_mount(self):
+        other_app = _make_app()
+        self.mount_table['/media'] = other_app
+        
+        environ = self._call("/media/site.css")
+        
+        self.assertIs(other_app.environ, environ)
+        self.assertEqual(len(self.mount_table), 3)
+    
+    def test_deleting_mount(self):
+        del self.mount_table['/media/admin/']
+        
+        environ = self._call("/media/admin/css/base.css")
+        
+        self.assertIs(self.media_app.environ, environ)
+        self.assertRaises(KeyError, self.mount_table.__delitem__, "/other")
+    
+    def test_assigning_none(self):
+        self.mount_table['/media/admin'] = None
+        self.mount_table['/other'] = None
+        
+        self.assertNotIn("/media/admin", self.mount_table)
+    
+    def test_applications(self):
+        host_app = _make_app()
+        self.mount_table['http://example.com/'] = host_app
+        
+        self.assertEqual(self.mount_table.applications, [
+            (("example.com", ""), host_app),
+            ((None, "/media/admin"), self.admin_media_app),
+            ((None, "/media"), self.media_app),
+            ((None, ""), self.root_app),
+            ])
+        self.assertEqual(self.mount_table.keys(), [
+            ("example.com", ""),
+            (None, "/media/admin"),
+            (None, "/media"),
+            (None, ""),
+            ])
+    
+    def test_relative_path(self):
+        self.assertRaises(ValueError, self.mount_table.__setitem__, "media",
+                          self.media_app)
+    
+    #}
+    
+    def _call(self, path_info, **environ):
+        environ = complete_environ(SCRIPT_NAME="/site", PATH_INFO=path_info,
+                                   **environ)
+        self.mount_table(environ, MockStartResponse())
+        return environ
+
+
+def _make_app():
+    return MockApp("200 OK", [])
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the pool of processes running WSGI applications.
+
+"""
+from StringIO import StringIO
+import os
+
+from django.utils import unittest
+
+from twod.wsgi.exc import ApplicationCallError
+from twod.wsgi.process_pool import ProcessPoolApplication
+
+from . import MockStartResponse, complete_environ
+
+
+class TestProcessPoolApplication(unittest.TestCase):
+    """Tests for :class:`ProcessPoolApplication`."""
+    
+    def setUp(self):
+        self.app = ProcessPoolApplication(lambda: echo_app, processes=2)
+    
+    def tearDown(self):
+        self.app.close()
+    
+    def test_response(self):
+        environ = complete_environ(PATH_INFO="/foo")
+        start_response = MockStartResponse()
+        
+        body = self.app(environ, start_response)
+        
+        self.assertEqual(start_response.status, "200 OK")
+        self.assertIn(("X-PATH", "/foo"), start_response.response_headers)
+        self.assertEqual(list(body), ["/foo"])
+    
+    def test_request_body(self):
+        environ = complete_environ(REQUEST_METHOD="POST", PATH_INFO="/foo",
+                                   CONTENT_LENGTH="6",
+                                   **{'wsgi.input': StringIO("foobarbaz")})
+        
+        body = self.app(environ, MockStartResponse())
+        
+        self.assertEqual(list(body), ["/foo", "foobar"])
+    
+    def test_app_runs_in_another_process(self):
+        environ = complete_environ(PATH_INFO="/foo")
+        start_response = MockStartResponse()
+        
+        list(self.app(environ, start_response))
+        
+        headers = dict(start_response.response_headers)
+        self.assertNotEqual(headers['X-PID'], str(os.getpid()))
+    
+    def test_unpicklable_items_are_skipped(self):
+        environ = complete_environ(PATH_INFO="/foo", **{'custom.obj': object()})
+        
+        body = self.app(environ, MockStartResponse())
+        
+        self.assertEqual(list(body), ["/foo"])
+    
+    def test_closed_response_releases_worker(self):
+        """Workers must be reusable even if the body was not read."""
+        for i in range(5):
+            body = self.app(complete_environ(PATH_INFO="/%s" % i),
+                            MockStartResponse())
+            body.close()
+        
+        body = self.app(complete_environ(PATH_INFO="/bar"), MockStartResponse())
+        self.assertEqual(list(body), ["/bar"])
+    
+    def test_app_error(self):
+        environ = complete_environ(PATH_INFO="/error")
+        
+        self.assertRaises(ApplicationCallError, self.app, environ,
+                          MockStartResponse())
+        # The worker can still be used:
+        body = self.app(complete_environ(PATH_INFO="/foo"), MockStartResponse())
+        self.assertEqual(list(body), ["/foo"])
+
+
+#{ Test utilities
+
+
+def echo_app(environ, start_response):
+    """Return the path and the body of the request."""
+    if environ['PATH_INFO'] == "/error":
+        raise ValueError("Error requested")
+    headers = [
+        ("X-PATH", environ['PATH_INFO']),
+        ("X-PID", str(os.getpid())),
+        ]
+    start_response("200 OK", headers)
+    return [environ['PATH_INFO'], environ['wsgi.input'].read()]
+
+
+#}
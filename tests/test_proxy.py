@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the HTTP proxy to embed applications served by other servers.
+
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from threading import Thread
+from time import sleep
+
+from django.utils import unittest
+
+from twod.wsgi.embedded_wsgi import make_proxy_view
+from twod.wsgi.exc import ApplicationCallError
+from twod.wsgi.proxy import HTTPProxyApplication
+
+from . import BaseDjangoTestCase, MockStartResponse, complete_environ
+from .test_embedded_wsgi import _make_request
+
+
+class TestHTTPProxyApplication(unittest.TestCase):
+    """Tests for :class:`HTTPProxyApplication`."""
+    
+    def setUp(self):
+        self.server = _UpstreamServer()
+        self.proxy = HTTPProxyApplication(self.server.url + "/upstream",
+                                          timeout=2)
+    
+    def tearDown(self):
+        self.server.stop()
+    
+    def test_request_forwarded(self):
+        environ = complete_environ(PATH_INFO="/wiki/Main Page",
+                                   QUERY_STRING="a=b", HTTP_HOST="example.org",
+                                   HTTP_X_FOO="bar", REMOTE_ADDR="10.0.0.1",
+                                   SCRIPT_NAME="/trac")
+        
+        self._get_response(environ)
+        
+        request = self.server.requests[0]
+        self.assertEqual(request['method'], "GET")
+        self.assertEqual(request['path'], "/upstream/wiki/Main%20Page?a=b")
+        self.assertEqual(request['headers']['host'], "example.org")
+        self.assertEqual(request['headers']['x-foo'], "bar")
+        self.assertEqual(request['headers']['x-forwarded-for'], "10.0.0.1")
+        self.assertEqual(request['headers']['x-forwarded-host'],
+                         "example.org")
+        self.assertEqual(request['headers']['x-forwarded-script-name'],
+                         "/trac")
+        self.assertNotIn("x-remote-user", request['headers'])
+    
+    def test_remote_user(self):
+        environ = complete_environ(PATH_INFO="/", REMOTE_USER="foobar")
+        
+        self._get_response(environ)
+        
+        self.assertEqual(self.server.requests[0]['headers']['x-remote-user'],
+                         "foobar")
+    
+    def test_spoofed_remote_user(self):
+        environ = complete_environ(PATH_INFO="/", HTTP_X_REMOTE_USER="admin")
+        
+        self._get_response(environ)
+        
+        self.assertNotIn("x-remote-user", self.server.requests[0]['headers'])
+    
+    def test_spoofed_remote_user_with_remote_user(self):
+        environ = complete_environ(PATH_INFO="/", HTTP_X_REMOTE_USER="admin",
+                                   REMOTE_USER="bob")
+        
+        self._get_response(environ)
+        
+        remote_user_lines = [
+            header_line for header_line in
+            self.server.requests[0]['header_lines']
+            if header_line.lower().startswith("x-remote-user:")
+            ]
+        self.assertEqual(remote_user_lines, ["X-Remote-User: bob\r\n"])
+    
+    def test_spoofed_custom_remote_user_header(self):
+        proxy = HTTPProxyApplication(self.server.url, remote_user_header="X-U")
+        environ = complete_environ(PATH_INFO="/", HTTP_X_U="admin")
+        
+        list(proxy(environ, MockStartResponse()))
+        
+        self.assertNotIn("x-u", self.server.requests[0]['headers'])
+    
+    def test_spoofed_forwarded_headers(self):
+        environ = complete_environ(
+            PATH_INFO="/",
+            HTTP_HOST="example.org",
+            REMOTE_ADDR="10.0.0.1",
+            HTTP_X_FORWARDED_FOR="192.168.0.1",
+            HTTP_X_FORWARDED_HOST="evil.example.com",
+            HTTP_X_FORWARDED_SCRIPT_NAME="/admin",
+            HTTP_X_FORWARDED_PROTO="https",
+            )
+        
+        self._get_response(environ)
+        
+        headers = self.server.requests[0]['headers']
+        self.assertEqual(headers['x-forwarded-for'], "10.0.0.1")
+        self.assertEqual(headers['x-forwarded-host'], "example.org")
+        self.assertEqual(headers['x-forwarded-script-name'], "")
+        self.assertNotIn("x-forwarded-proto", headers)
+    
+    def test_custom_remote_user_header(self):
+        proxy = HTTPProxyApplication(self.server.url, remote_user_header="X-U")
+        environ = complete_environ(PATH_INFO="/", REMOTE_USER="foobar")
+        
+        list(proxy(environ, MockStartResponse()))
+        
+        self.assertEqual(self.server.requests[0]['headers']['x-u'], "foobar")
+    
+    def test_hop_by_hop_headers_not_forwarded(self):
+        environ = complete_environ(PATH_INFO="/", HTTP_CONNECTION="close",
+                                   HTTP_KEEP_ALIVE="300")
+        
+        self._get_response(environ)
+        
+        headers = self.server.requests[0]['headers']
+        self.assertNotIn("keep-alive", headers)
+        self.assertNotEqual(headers.get("connection"), "close")
+    
+    def test_request_body(self):
+        environ = complete_environ(REQUEST_METHOD="POST", PATH_INFO="/",
+                                   CONTENT_TYPE="text/plain",
+                                   CONTENT_LENGTH="6",
+                                   **{'wsgi.input': StringIO("foobarbaz")})
+        
+        self._get_response(environ)
+        
+        request = self.server.requests[0]
+        self.assertEqual(request['body'], "foobar")
+        self.assertEqual(request['headers']['content-type'], "text/plain")
+    
+    def test_chunked_request_body(self):
+        body = "x" * 100000
+        environ = complete_environ(REQUEST_METHOD="POST", PATH_INFO="/",
+                                   HTTP_TRANSFER_ENCODING="chunked",
+                                   **{'wsgi.input': StringIO(body)})
+        
+        self._get_response(environ)
+        
+        self.assertEqual(self.server.requests[0]['body'], body)
+    
+    def test_response(self):
+        environ = complete_environ(PATH_INFO="/cookies")
+        
+        (start_response, body) = self._get_response(environ)
+        
+        self.assertEqual(start_response.status, "201 Created Here")
+        headers = start_response.response_headers
+        self.assertIn(("Set-Cookie", "a=1"), headers)
+        self.assertIn(("Set-Cookie", "b=2"), headers)
+        self.assertNotIn("connection",
+                         [name.lower() for (name, value) in headers])
+        self.assertEqual(body, "/upstream/cookies")
+    
+    def test_response_is_streamed(self):
+        environ = complete_environ(PATH_INFO="/big")
+        
+        app_iter = self.proxy(environ, MockStartResponse())
+        chunks = list(app_iter)
+        
+        self.assertTrue(1 < len(chunks))
+        self.assertEqual("".join(chunks), "x" * _BIG_BODY_SIZE)
+    
+    def test_connections_reused(self):
+        for path in ("/foo", "/bar", "/baz"):
+            self._get_response(complete_environ(PATH_INFO=path))
+        
+        client_addresses = set(request['client_address'] for request in
+                               self.server.requests)
+        self.assertEqual(len(client_addresses), 1)
+    
+    def test_closed_response_discards_connection(self):
+        app_iter = self.proxy(complete_environ(PATH_INFO="/big"),
+                              MockStartResponse())
+        app_iter.close()
+        
+        self._get_response(complete_environ(PATH_INFO="/foo"))
+        
+        client_addresses = set(request['client_address'] for request in
+                               self.server.requests)
+        self.assertEqual(len(client_addresses), 2)
+    
+    def test_connection_closed_by_server(self):
+        """Idle connections closed by the server must be replaced."""
+        self._get_response(complete_environ(PATH_INFO="/foo"))
+        self.server.close_connections()
+        
+        (start_response, body) = self._get_response(
+            complete_environ(PATH_INFO="/bar"),
+            )
+        
+        self.assertEqual(body, "/upstream/bar")
+    
+    def test_server_unavailable(self):
+        self.server.stop()
+        proxy = HTTPProxyApplication(self.server.url, timeout=1)
+        
+        self.assertRaises(ApplicationCallError, proxy,
+                          complete_environ(PATH_INFO="/"), MockStartResponse())
+    
+    def test_timeout(self):
+        proxy = HTTPProxyApplication(self.server.url, timeout=0.1)
+        
+        self.assertRaises(ApplicationCallError, proxy,
+                          complete_environ(PATH_INFO="/slow"),
+                          MockStartResponse())
+    
+    def _get_response(self, environ):
+        start_response = MockStartResponse()
+        app_iter = self.proxy(environ, start_response)
+        try:
+            body = "".join(app_iter)
+        finally:
+            app_iter.close()
+        return (start_response, body)
+
+
+class TestProxyView(BaseDjangoTestCase):
+    """Tests for make_proxy_view()."""
+    
+    def setUp(self):
+        super(TestProxyView, self).setUp()
+        self.server = _UpstreamServer()
+    
+    def tearDown(self):
+        self.server.stop()
+        super(TestProxyView, self).tearDown()
+    
+    def test_it(self):
+        django_view = make_proxy_view(self.server.url, timeout=2)
+        environ = complete_environ(SCRIPT_NAME="/dev",
+                                   PATH_INFO="/trac/wiki", HTTP_HOST="a.org")
+        request = _make_request(authenticated=True, **environ)
+        
+        django_response = django_view(request, "/wiki")
+        
+        self.assertEqual(django_response.status_code, 200)
+        self.assertEqual(django_response.content, "/wiki")
+        headers = self.server.requests[0]['headers']
+        self.assertEqual(headers['x-forwarded-script-name'], "/dev/trac")
+        self.assertEqual(headers['x-remote-user'], "foobar")
+        self.assertIsInstance(django_view.proxy, HTTPProxyApplication)
+
+
+#{ Mock upstream server
+
+
+_BIG_BODY_SIZE = 200 * 1024
+
+
+class _UpstreamServer(object):
+    """HTTP/1.1 server which records the requests it gets."""
+    
+    def __init__(self):
+        self.requests = []
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0),
+                                           _UpstreamRequestHandler)
+        self.server.upstream = self
+        self.url = "http://127.0.0.1:%s" % self.server.server_port
+        self.thread = Thread(target=self.server.serve_forever,
+                             kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.handlers = []
+    
+    def close_connections(self):
+        for handler in self.handlers:
+            handler.close_connection = 1
+            handler.connection.close()
+        # Giving the server time to notice:
+        sleep(0.1)
+    
+    def stop(self):
+        if self.thread.is_alive():
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UpstreamRequestHandler(BaseHTTPRequestHandler):
+    
+    protocol_version = "HTTP/1.1"
+    
+    def do_GET(self):
+        self.server.upstream.handlers.append(self)
+        body = self._read_body()
+        self.server.upstream.requests.append({
+            'method': self.command,
+            'path': self.path,
+            'headers': dict(self.headers.items()),
+            'header_lines': list(self.headers.headers),
+            'body': body,
+            'client_address': self.client_address,
+            })
+        
+        if self.path.endswith("/slow"):
+            sleep(0.5)
+        
+        if self.path.endswith("/cookies"):
+            self.send_response(201, "Created Here")
+            self.send_header("Set-Cookie", "a=1")
+            self.send_header("Set-Cookie", "b=2")
+        else:
+            self.send_response(200)
+        
+        if self.path.endswith("/big"):
+            response_body = "x" * _BIG_BODY_SIZE
+        else:
+            response_body = self.path
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+    
+    do_POST = do_GET
+    
+    def _read_body(self):
+        if "chunked" in self.headers.get("transfer-encoding", ""):
+            chunks = []
+            chunk_size = int(self.rfile.readline().strip(), 16)
+            while chunk_size:
+                chunks.append(self.rfile.read(chunk_size))
+                self.rfile.readline()
+                chunk_size = int(self.rfile.readline().strip(), 16)
+            self.rfile.readline()
+            return "".join(chunks)
+        return self.rfile.read(int(self.headers.get("content-length", 0)))
+    
+    def log_message(self, *args):
+        pass
+
+
+#}
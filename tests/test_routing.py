@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the resolution of Django URLs.
+
+"""
+import re
+
+from django.conf.urls.defaults import patterns, url
+from django.core.urlresolvers import RegexURLResolver, Resolver404
+
+from twod.wsgi.routing import CompiledURLResolver, _get_regex_prefix
+
+from . import BaseDjangoTestCase
+from .fixtures.sampledjango import routing_urls
+
+
+class TestCompiledURLResolver(BaseDjangoTestCase):
+    """Tests for :class:`CompiledURLResolver`."""
+    
+    paths = (
+        "/",
+        "/blog/",
+        "/blog/2010/",
+        "/blog/2010/hello-world/",
+        "/blog/2010/07/",
+        "/blog/feed/",
+        "/blog/feeds/",
+        "/blog/2010/hello world/",
+        "/es/blog/2010/hola/",
+        "/fr/blog/2010/",
+        "/wiki/MainPage",
+        "/wiki/Main/edit",
+        "/users/3/",
+        "/users/x/",
+        "/about.html",
+        "/aboutXhtml",
+        "/help",
+        "/help/",
+        "/Search",
+        "/Searching",
+        "/find/",
+        "/CASELESS/",
+        "/aaab/",
+        "/b/",
+        "/static/css/site.css",
+        "/anything/latest/",
+        "/nested/42/",
+        "/blog/index.php",
+        "/nowhere",
+        u"/blog/2010/caf\xe9/",
+        )
+    
+    def setUp(self):
+        super(TestCompiledURLResolver, self).setUp()
+        self.django_resolver = RegexURLResolver(r"^/", routing_urls)
+        self.compiled_resolver = RegexURLResolver(
+            r"^/",
+            [CompiledURLResolver(routing_urls.urlpatterns)],
+            )
+    
+    def test_same_matches_as_django(self):
+        for path in self.paths:
+            django_match = _resolve(self.django_resolver, path)
+            compiled_match = _resolve(self.compiled_resolver, path)
+            self.assertEqual(django_match, compiled_match,
+                             "%r != %r for %s" % (django_match,
+                                                  compiled_match, path))
+    
+    def test_urlconf_module(self):
+        resolver = CompiledURLResolver(
+            "tests.fixtures.sampledjango.routing_urls",
+            regex=r"^/",
+            )
+        
+        match = resolver.resolve("/users/3/")
+        
+        self.assertEqual(match.url_name, "user")
+        self.assertEqual(match.args, ("3", ))
+    
+    def test_not_found(self):
+        resolver = CompiledURLResolver(routing_urls.urlpatterns)
+        
+        try:
+            resolver.resolve("nowhere")
+        except Resolver404, exc:
+            self.assertEqual(exc.args[0]['path'], "nowhere")
+            self.assertEqual(len(exc.args[0]['tried']), 23)
+        else:
+            self.fail("Resolver404 not raised")
+    
+    def test_reverse(self):
+        resolver = RegexURLResolver(
+            r"^/",
+            [CompiledURLResolver(routing_urls.urlpatterns)],
+            )
+        
+        self.assertEqual(resolver.reverse("user", 3), "users/3/")
+        self.assertEqual(resolver.reverse("nested", id=4), "nested/4/")
+
+
+class TestMatchCaching(BaseDjangoTestCase):
+    """Tests for the cache of matches in :class:`CompiledURLResolver`."""
+    
+    def setUp(self):
+        super(TestMatchCaching, self).setUp()
+        self.urlpatterns = patterns('',
+            url(r"^users/(?P<id>\d+)/$", routing_urls.post_view, name="user"),
+            url(r"^about/$", routing_urls.archive_view, name="about"),
+            )
+        self.resolver = CompiledURLResolver(self.urlpatterns,
+                                            max_cached_paths=2)
+    
+    def test_same_matches_as_django(self):
+        django_resolver = RegexURLResolver(r"^/", routing_urls)
+        compiled_resolver = RegexURLResolver(
+            r"^/",
+            [CompiledURLResolver(routing_urls.urlpatterns,
+                                 max_cached_paths=100)],
+            )
+        
+        for i in range(2):
+            for path in TestCompiledURLResolver.paths:
+                self.assertEqual(_resolve(django_resolver, path),
+                                 _resolve(compiled_resolver, path))
+    
+    def test_cache_disabled_by_default(self):
+        resolver = CompiledURLResolver(self.urlpatterns)
+        
+        resolver.resolve("about/")
+        resolver.resolve("about/")
+        
+        self.assertEqual(resolver.cache_hits, 0)
+        self.assertEqual(resolver.cache_misses, 0)
+        self.assertIsNone(resolver.cache_hit_rate)
+    
+    def test_cached_match(self):
+        first_match = self.resolver.resolve("users/1/")
+        second_match = self.resolver.resolve("users/1/")
+        
+        self.assertEqual(_get_match_data(first_match),
+                         _get_match_data(second_match))
+        self.assertEqual(self.resolver.cache_hits, 1)
+        self.assertEqual(self.resolver.cache_misses, 1)
+        self.assertEqual(self.resolver.cache_hit_rate, 0.5)
+    
+    def test_cached_arguments_are_copied(self):
+        self.resolver.resolve("users/1/").kwargs['id'] = "2"
+        self.resolver.resolve("users/1/").kwargs['id'] = "3"
+        
+        self.assertEqual(self.resolver.resolve("users/1/").kwargs,
+                         {'id': "1"})
+    
+    def test_least_recently_used_path_evicted(self):
+        for path in ("users/1/", "users/2/", "users/1/", "about/",
+                     "users/1/", "users/2/"):
+            self.resolver.resolve(path)
+        
+        self.assertEqual(self.resolver.cache_hits, 2)
+        self.assertEqual(self.resolver.cache_misses, 4)
+    
+    def test_unmatched_paths_not_cached(self):
+        for i in range(2):
+            self.assertRaises(Resolver404, self.resolver.resolve, "nowhere/")
+        
+        self.assertEqual(self.resolver.cache_hits, 0)
+        self.assertEqual(self.resolver.cache_misses, 2)
+    
+    def test_replaced_patterns(self):
+        urlconf = MockURLConf(self.urlpatterns)
+        resolver = CompiledURLResolver(urlconf, max_cached_paths=2)
+        resolver.resolve("about/")
+        
+        urlconf.urlpatterns = patterns('',
+            url(r"^about/$", routing_urls.post_view, name="new-about"),
+            )
+        
+        self.assertEqual(resolver.resolve("about/").url_name, "new-about")
+        self.assertEqual(resolver.cache_hits, 0)
+    
+    def test_appended_patterns(self):
+        self.resolver.resolve("users/1/")
+        self.assertRaises(Resolver404, self.resolver.resolve, "contact/")
+        
+        self.urlpatterns.append(url(r"^contact/$", routing_urls.post_view,
+                                    name="contact"))
+        self.urlpatterns.insert(0, url(r"^users/1/$", routing_urls.post_view,
+                                       name="first-user"))
+        
+        self.assertEqual(self.resolver.resolve("contact/").url_name,
+                         "contact")
+        self.assertEqual(self.resolver.resolve("users/1/").url_name,
+                         "first-user")
+    
+    def test_clear(self):
+        self.resolver.resolve("about/")
+        self.urlpatterns[1] = url(r"^about/$", routing_urls.post_view,
+                                  name="new-about")
+        
+        self.resolver.clear()
+        
+        self.assertEqual(self.resolver.resolve("about/").url_name,
+                         "new-about")
+        self.assertEqual(self.resolver.cache_hits, 0)
+
+
+class TestRegexPrefix(BaseDjangoTestCase):
+    """Tests for the extraction of the static prefix of regular expressions."""
+    
+    def test_static_regex(self):
+        self._check_prefix(r"^blog/", "blog/", True)
+    
+    def test_escaped_characters(self):
+        self._check_prefix(r"^about\.html\/", "about.html/", True)
+    
+    def test_groups(self):
+        self._check_prefix(r"^blog/(?P<year>\d+)/$", "blog/", False)
+    
+    def test_character_classes(self):
+        self._check_prefix(r"^blog\d", "blog", False)
+    
+    def test_optional_character(self):
+        self._check_prefix(r"^feeds?/", "feed", False)
+        self._check_prefix(r"^feeds*/", "feed", False)
+        self._check_prefix(r"^feeds{0,1}/", "feed", False)
+    
+    def test_repeated_character(self):
+        self._check_prefix(r"^feeds+/", "feeds", False)
+    
+    def test_unanchored_regex(self):
+        self._check_prefix(r"blog/", "", False)
+    
+    def test_alternation(self):
+        self._check_prefix(r"^blog/|^news/", "", False)
+        self._check_prefix(r"^(blog|news)/", "", False)
+        self._check_prefix(r"^blog/(a|b)", "blog/", False)
+        self._check_prefix(r"^blog/[|]", "blog/", False)
+    
+    def test_case_insensitive_regex(self):
+        self._check_prefix(r"(?i)^blog/", "", False)
+        self._check_prefix(r"^blog/(?i)", "", False)
+        self.assertEqual(_get_regex_prefix(re.compile("^blog/", re.I)),
+                         ("", False))
+    
+    def _check_prefix(self, pattern, prefix, is_static_regex):
+        self.assertEqual(_get_regex_prefix(re.compile(pattern)),
+                         (prefix, is_static_regex))
+
+
+class MockURLConf(object):
+    """Mock URL configuration module."""
+    
+    def __init__(self, urlpatterns):
+        self.urlpatterns = urlpatterns
+
+
+def _resolve(resolver, path):
+    try:
+        match = resolver.resolve(path)
+    except Resolver404:
+        return None
+    return _get_match_data(match)
+
+
+def _get_match_data(match):
+    return (match.func, match.args, match.kwargs, match.url_name,
+            match.app_name, match.namespaces)
@@ -46,7 +46,17 @@ def wsgify_django(global_config, **local_conf):
     
     """
     _set_up_settings(global_config, local_conf)
-    return DjangoApplication()
+    
+    input_memory_threshold = global_config.get("twod.input_memory_threshold")
+    if input_memory_threshold:
+        input_memory_threshold = asint(input_memory_threshold)
+    else:
+        input_memory_threshold = None
+    
+    deadline_header = global_config.get("twod.deadline_header")
+    
+    return DjangoApplication(input_memory_threshold,
+                             deadline_header=deadline_header)
 
 
 def _set_up_settings(global_conf, local_conf):
@@ -18,16 +18,47 @@ Utilities to use WSGI applications within Django.
 
 """
 
-from Cookie import SimpleCookie
+from collections import deque, OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+from math import ceil
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from threading import Event, Lock
+from time import time
+import sys
+
+from webob import Request
+from webob.cachecontrol import CacheControl
 
 from twod.wsgi import TwodResponse
 from twod.wsgi.exc import ApplicationCallError
+from twod.wsgi.handler import _DEADLINE_ENVIRON_KEY
+from twod.wsgi.proxy import HTTPProxyApplication
+
+
+__all__ = ("call_wsgi_app", "call_wsgi_apps", "make_wsgi_view",
+           "make_pooled_wsgi_view", "make_proxy_view", "WSGIApplicationPool",
+           "WSGIResponseCache", "RequestCoalescer", "CircuitBreaker",
+           "FAN_OUT_THREADS", "DEADLINE_THREADS", "MAX_ENFORCED_BUDGET")
+
+
+#: The maximum number of embedded applications run at the same time by
+#: :func:`call_wsgi_apps`, across all the requests.
+FAN_OUT_THREADS = 10
 
+#: The maximum number of embedded applications with a deadline run at the same
+#: time by :func:`call_wsgi_app`, across all the requests.
+DEADLINE_THREADS = 10
 
-__all__ = ("call_wsgi_app", "make_wsgi_view")
+#: The number of seconds left before a deadline above which it's not enforced
+#: by :func:`call_wsgi_app`, so that the application is run in the thread
+#: serving the request.
+MAX_ENFORCED_BUDGET = 60
 
 
-def call_wsgi_app(wsgi_app, request, path_info):
+def call_wsgi_app(wsgi_app, request, path_info, stream=False, cache=None,
+                  coalescer=None, timeout=None, make_timeout_response=None,
+                  circuit_breaker=None):
     """
     Call the ``wsgi_app`` with ``request`` and return its response.
     
@@ -37,14 +68,793 @@ def call_wsgi_app(wsgi_app, request, path_info):
     :type request: :class:`twod.wsgi.handler.TwodWSGIRequest`
     :param path_info: The ``PATH_INFO`` to be used by the WSGI application.
     :type path: :class:`basestring`
+    :param stream: Whether the body of the response should never be buffered.
+    :type stream: :class:`bool`
+    :param cache: The cache where the response may be found or stored, if
+        any.
+    :type cache: :class:`WSGIResponseCache`
+    :param coalescer: The coalescer through which identical concurrent calls
+        are made, if any.
+    :type coalescer: :class:`RequestCoalescer`
+    :param timeout: The number of seconds after which the application is
+        given up on, if any.
+    :type timeout: :class:`float`
+    :param make_timeout_response: The callable which returns the response
+        to be used when the application is given up on, given ``request``;
+        defaults to an empty ``504 Gateway Timeout`` response.
+    :param circuit_breaker: The circuit breaker for ``wsgi_app``, if any.
+    :type circuit_breaker: :class:`CircuitBreaker`
     :raises twod.wsgi.exc.ApplicationCallError: If ``path_info`` is not the
         last portion of the ``PATH_INFO`` in ``request``.
     :return: The response from the WSGI application, turned into a Django
         response.
     :rtype: :class:`twod.wsgi.TwodResponse`
     
+    When ``stream`` is enabled, the body of the response is the iterable
+    returned by the WSGI application (or an iterator over it, if the body
+    had to be read to get the status), so it's only read as it's served. Any
+    ``wsgi.file_wrapper`` object returned by the application is preserved.
+    Streamed responses are neither cached nor coalesced.
+    
+    The application is given up on after ``timeout`` seconds or by the
+    deadline in the ``twod.wsgi.deadline`` item of the WSGI environment (as
+    seconds since the epoch), whichever comes first. The deadline is passed on
+    to the application in the same item. The application keeps running in
+    the background when it's given up on, and so do streamed bodies, which
+    are not subject to the deadline once the status has been received.
+    
+    To enforce the deadline, the application is run in a thread pool shared
+    by all the requests, whose size is limited by ``DEADLINE_THREADS``, so the
+    thread-local state of the request (e.g., the database connection or the
+    active translation) is not available to it. Deadlines more than
+    ``MAX_ENFORCED_BUDGET`` seconds away are passed on but not enforced, and
+    the application is then run in the current thread.
+    
+    """
+    # The body is shared with the embedded application instead of copied, so
+    # it only has to be buffered when it can't be rewound:
+    if "wsgi.input" in request.environ:
+        request.make_body_seekable()
+    new_request = _make_embedded_request(request, path_info)
+    deadline = _get_deadline(request.environ, timeout)
+    if deadline is not None:
+        new_request.environ[_DEADLINE_ENVIRON_KEY] = deadline
+    
+    def get_response():
+        if stream or (cache is None and coalescer is None):
+            return _get_wsgi_response(wsgi_app, new_request, stream)
+        return _get_shared_wsgi_response(wsgi_app, new_request, cache,
+                                         coalescer)
+    
+    def get_django_response():
+        if deadline is None or time() + MAX_ENFORCED_BUDGET < deadline:
+            return _make_django_response(*get_response())
+        
+        response = _get_response_by_deadline(get_response, deadline,
+                                             not stream)
+        if response is None:
+            return (make_timeout_response or _make_timeout_response)(request)
+        return _make_django_response(*response)
+    
+    if circuit_breaker is None:
+        return get_django_response()
+    return circuit_breaker._call(get_django_response, request)
+
+
+def call_wsgi_apps(wsgi_apps, request, timeout=None, stream=False):
+    """
+    Call the WSGI applications in ``wsgi_apps`` concurrently with
+    ``request`` and return their responses.
+    
+    :param wsgi_apps: The WSGI applications to be run, along with the
+        ``PATH_INFO`` to be used by each of them.
+    :type wsgi_apps: iterable of ``(wsgi_app, path_info)`` tuples
+    :param request: The Django request.
+    :type request: :class:`twod.wsgi.handler.TwodWSGIRequest`
+    :param timeout: The number of seconds after which an application that
+        hasn't returned its response is given up on, if any.
+    :type timeout: :class:`float`
+    :param stream: Whether the body of the responses should never be buffered.
+    :type stream: :class:`bool`
+    :raises twod.wsgi.exc.ApplicationCallError: If an application doesn't
+        respond within ``timeout`` seconds (or by the deadline in the WSGI
+        environment) or under the same circumstances as
+        :func:`call_wsgi_app`.
+    :return: The responses from the WSGI applications, turned into Django
+        responses, in the same order as ``wsgi_apps``.
+    :rtype: :class:`list` of :class:`twod.wsgi.TwodResponse`
+    
+    Each application gets its own request, derived from ``request`` as in
+    :func:`call_wsgi_app`, and is run in a thread pool shared by all the
+    calls to this function, whose size is limited by ``FAN_OUT_THREADS``.
+    Any exception raised by an application is propagated, once the
+    applications before it have responded. Unless ``stream`` is set, the
+    bodies are read in the thread pool too, so they're subject to
+    ``timeout``.
+    
+    An application which timed out cannot be interrupted, so it keeps
+    running in its thread until it returns. The bodies of the responses are
+    closed when the call fails or times out, including those which arrive
+    late.
+    
+    """
+    if "wsgi.input" in request.environ:
+        request.make_body_seekable()
+    # The body will be read from several threads:
+    input_lock = Lock()
+    new_requests = [
+        (wsgi_app, _make_embedded_request(request, path_info, input_lock))
+        for (wsgi_app, path_info) in wsgi_apps
+        ]
+    
+    deadline = _get_deadline(request.environ, timeout)
+    if deadline is not None:
+        for (wsgi_app, new_request) in new_requests:
+            new_request.environ[_DEADLINE_ENVIRON_KEY] = deadline
+    
+    (calls, pending_responses) = _start_wsgi_calls(new_requests, stream)
+    
+    django_responses = []
+    try:
+        for (call, pending_response) in zip(calls, pending_responses):
+            response = _wait_for_wsgi_response(call.wsgi_app,
+                                               pending_response, deadline)
+            django_responses.append(_make_django_response(*response))
+    except:
+        # None of the responses will be served:
+        for call in calls:
+            call.abandon()
+        raise
+    
+    return django_responses
+
+
+def make_wsgi_view(wsgi_app, stream=False, cache=None, coalescer=None,
+                   timeout=None, make_timeout_response=None,
+                   circuit_breaker=None):
+    """
+    Return a callable which can be used as a Django view powered by the
+    ``wsgi_app``.
+    
+    :param wsgi_app: The WSGI which will run the view.
+    :param stream: Whether the body of the responses should never be buffered.
+    :type stream: :class:`bool`
+    :param cache: The cache for the responses from ``wsgi_app``, if any.
+    :type cache: :class:`WSGIResponseCache`
+    :param coalescer: The coalescer for the concurrent calls to ``wsgi_app``,
+        if any.
+    :type coalescer: :class:`RequestCoalescer`
+    :param timeout: The number of seconds after which ``wsgi_app`` is given
+        up on, if any.
+    :type timeout: :class:`float`
+    :param make_timeout_response: The callable which returns the response
+        to be used when ``wsgi_app`` is given up on, given the request.
+    :param circuit_breaker: The circuit breaker for ``wsgi_app``, if any.
+    :type circuit_breaker: :class:`CircuitBreaker`
+    :return: The view callable.
+    
+    See :func:`call_wsgi_app`.
+    
     """
-    new_request = request.copy()
+    
+    def view(request, path_info):
+        return call_wsgi_app(wsgi_app, request, path_info, stream, cache,
+                             coalescer, timeout, make_timeout_response,
+                             circuit_breaker)
+    
+    return view
+
+
+def make_pooled_wsgi_view(app_factory, key_function, stream=False, **pool_options):
+    """
+    Return a callable which can be used as a Django view powered by WSGI
+    applications built on demand and kept in a :class:`WSGIApplicationPool`.
+    
+    :param app_factory: The callable which builds the WSGI application for a
+        given key.
+    :param key_function: The callable which returns the key of the WSGI
+        application to be used, given the request and the named arguments for
+        the view.
+    :param stream: Whether the body of the responses should never be buffered.
+    :type stream: :class:`bool`
+    :return: The view callable.
+    
+    The rest of the arguments are passed on to :class:`WSGIApplicationPool`.
+    The pool is available in the ``pool`` attribute of the view. The
+    applications are not closed while they're being called, or while the
+    body of their response is being served if ``stream`` is set.
+    
+    """
+    pool = WSGIApplicationPool(app_factory, **pool_options)
+    
+    def view(request, path_info, **kwargs):
+        wsgi_app = pool.acquire_app(key_function(request, **kwargs))
+        try:
+            response = call_wsgi_app(wsgi_app, request, path_info, stream)
+        except:
+            pool.release_app(wsgi_app)
+            raise
+        
+        if not stream:
+            # The body has been read already:
+            pool.release_app(wsgi_app)
+            return response
+        
+        # The call is over once the body has been served:
+        close_response = response.close
+        def close():
+            try:
+                close_response()
+            finally:
+                pool.release_app(wsgi_app)
+        response.close = close
+        return response
+    
+    view.pool = pool
+    return view
+
+
+def make_proxy_view(upstream_url, **proxy_options):
+    """
+    Return a callable which can be used as a Django view powered by the HTTP
+    server at ``upstream_url``.
+    
+    :param upstream_url: The URL to the HTTP server.
+    :type upstream_url: :class:`basestring`
+    :return: The view callable.
+    
+    The rest of the arguments are passed on to
+    :class:`~twod.wsgi.proxy.HTTPProxyApplication`, whose connections to the
+    server are kept alive and reused across requests. The bodies of the
+    responses are always streamed.
+    
+    The proxy application is available in the ``proxy`` attribute of the view.
+    
+    """
+    proxy = HTTPProxyApplication(upstream_url, **proxy_options)
+    
+    def view(request, path_info):
+        return call_wsgi_app(proxy, request, path_info, stream=True)
+    
+    view.proxy = proxy
+    return view
+
+
+class WSGIApplicationPool(object):
+    """
+    Thread-safe pool of WSGI applications, built on demand by
+    ``app_factory``.
+    
+    :param app_factory: The callable which builds the WSGI application for a
+        given key.
+    :param max_size: The maximum number of applications kept in the pool; the
+        least recently used ones are evicted first.
+    :type max_size: :class:`int`
+    :param idle_ttl: The number of seconds after which an application which
+        has not been used is evicted, if any.
+    :type idle_ttl: :class:`int`
+    :param close_app: The callable to be called with the key and the
+        application when it's evicted, if any.
+    
+    Each application is built once, even if it's requested by several threads
+    at the same time.
+    
+    The applications obtained with :meth:`acquire_app` are not closed while
+    they're in use: If they're evicted in the meantime, ``close_app`` is
+    called once they've all been released with :meth:`release_app`.
+    
+    """
+    
+    def __init__(self, app_factory, max_size=10, idle_ttl=None, close_app=None):
+        self.app_factory = app_factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.close_app = close_app
+        
+        # The applications and the time they were last used, with the least
+        # recently used ones first:
+        self._apps = OrderedDict()
+        self._lock = Lock()
+        self._construction_locks = {}
+        # The number of calls in progress to each application acquired, and
+        # the evicted applications to be closed once they're over, by the id
+        # of the application:
+        self._calls_in_progress = {}
+        self._apps_to_close = {}
+    
+    def get_app(self, key):
+        """Return the application for ``key``, building it if necessary."""
+        return self._get_app(key, False)
+    
+    def acquire_app(self, key):
+        """
+        Return the application for ``key``, building it if necessary, and
+        prevent it from being closed until it's released with
+        :meth:`release_app`.
+        
+        """
+        return self._get_app(key, True)
+    
+    def release_app(self, wsgi_app):
+        """
+        Report that a call to ``wsgi_app``, obtained with :meth:`acquire_app`,
+        is over, and close it if it was evicted and there are no other calls
+        in progress.
+        
+        """
+        app_id = id(wsgi_app)
+        with self._lock:
+            call_count = self._calls_in_progress[app_id] - 1
+            if call_count:
+                self._calls_in_progress[app_id] = call_count
+                return
+            del self._calls_in_progress[app_id]
+            app_to_close = self._apps_to_close.pop(app_id, None)
+        if app_to_close:
+            self.close_app(*app_to_close)
+    
+    def _get_app(self, key, acquire):
+        with self._lock:
+            evicted_apps = self._evict_idle_apps()
+            wsgi_app = self._use_app(key, acquire)
+            if wsgi_app is None:
+                construction_lock = self._construction_locks.setdefault(key,
+                                                                        Lock())
+        self._close_apps(evicted_apps)
+        
+        if wsgi_app is not None:
+            return wsgi_app
+        
+        with construction_lock:
+            # It may have been built by another thread in the meantime:
+            with self._lock:
+                wsgi_app = self._use_app(key, acquire)
+            if wsgi_app is not None:
+                return wsgi_app
+            
+            try:
+                wsgi_app = self.app_factory(key)
+            except:
+                with self._lock:
+                    self._construction_locks.pop(key, None)
+                raise
+            
+            with self._lock:
+                self._apps[key] = (wsgi_app, time())
+                self._construction_locks.pop(key, None)
+                if acquire:
+                    self._acquire(wsgi_app)
+                evicted_apps = []
+                while len(self._apps) > self.max_size:
+                    evicted_apps.append(self._apps.popitem(last=False))
+        
+        self._close_apps(evicted_apps)
+        return wsgi_app
+    
+    def evict(self, key):
+        """Remove the application for ``key`` from the pool, if it's there."""
+        with self._lock:
+            app_and_time = self._apps.pop(key, None)
+        if app_and_time:
+            self._close_apps([(key, app_and_time)])
+    
+    def clear(self):
+        """Remove all the applications from the pool."""
+        with self._lock:
+            evicted_apps = self._apps.items()
+            self._apps.clear()
+        self._close_apps(evicted_apps)
+    
+    def __len__(self):
+        return len(self._apps)
+    
+    def __contains__(self, key):
+        return key in self._apps
+    
+    def _use_app(self, key, acquire=False):
+        """Return the application for ``key``, marking it as just used."""
+        app_and_time = self._apps.pop(key, None)
+        if app_and_time is None:
+            return None
+        wsgi_app = app_and_time[0]
+        self._apps[key] = (wsgi_app, time())
+        if acquire:
+            self._acquire(wsgi_app)
+        return wsgi_app
+    
+    def _acquire(self, wsgi_app):
+        app_id = id(wsgi_app)
+        self._calls_in_progress[app_id] = \
+            self._calls_in_progress.get(app_id, 0) + 1
+    
+    def _evict_idle_apps(self):
+        evicted_apps = []
+        if self.idle_ttl is not None:
+            oldest_time_allowed = time() - self.idle_ttl
+            # The least recently used applications come first:
+            for (key, (wsgi_app, last_used)) in self._apps.items():
+                if oldest_time_allowed <= last_used:
+                    break
+                evicted_apps.append((key, self._apps.pop(key)))
+        return evicted_apps
+    
+    def _close_apps(self, evicted_apps):
+        if not self.close_app:
+            return
+        
+        apps_to_close = []
+        with self._lock:
+            for (key, (wsgi_app, last_used)) in evicted_apps:
+                if id(wsgi_app) in self._calls_in_progress:
+                    # It'll be closed once the last call is over:
+                    self._apps_to_close[id(wsgi_app)] = (key, wsgi_app)
+                else:
+                    apps_to_close.append((key, wsgi_app))
+        for (key, wsgi_app) in apps_to_close:
+            self.close_app(key, wsgi_app)
+
+
+class WSGIResponseCache(object):
+    """
+    Thread-safe cache of the responses from embedded WSGI applications, with
+    the least recently used responses evicted first.
+    
+    :param max_bytes: The maximum combined size of the bodies of the cached
+        responses.
+    :type max_bytes: :class:`int`
+    
+    Only the responses to ``GET`` and ``HEAD`` requests are cached, for as
+    long as their ``Cache-Control`` (``s-maxage`` or ``max-age``) or
+    ``Expires`` headers allow, as long as they don't set cookies. They're
+    kept by ``SCRIPT_NAME``, ``PATH_INFO``, query string, ``REMOTE_USER``
+    and the values of the request headers in their ``Vary`` header.
+    Responses marked as ``private`` are only cached when there's a
+    ``REMOTE_USER``.
+    
+    """
+    
+    def __init__(self, max_bytes=10 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        
+        # The responses and their expiry time, by request and the values of
+        # the headers they vary on, with the least recently used ones first:
+        self._responses = OrderedDict()
+        # The names of the headers the responses vary on and the number of
+        # responses cached, by request:
+        self._vary_header_names = {}
+        self._response_counts = {}
+        self._size = 0
+        self._lock = Lock()
+    
+    def clear(self):
+        """Remove all the responses from the cache."""
+        with self._lock:
+            self._responses.clear()
+            self._vary_header_names.clear()
+            self._response_counts.clear()
+            self._size = 0
+    
+    def __len__(self):
+        return len(self._responses)
+    
+    def _get_response(self, new_request):
+        """
+        Return the status, the headers and the body of the cached response
+        to ``new_request``, if it's still fresh.
+        
+        """
+        request_key = _get_request_cache_key(new_request)
+        if request_key is None:
+            return None
+        
+        with self._lock:
+            vary_header_names = self._vary_header_names.get(request_key)
+            if vary_header_names is None:
+                return None
+            key = (request_key,
+                   _get_vary_header_values(new_request, vary_header_names))
+            cached_response = self._responses.pop(key, None)
+            if cached_response is None:
+                return None
+            (expiry_time, response, size) = cached_response
+            if expiry_time <= time():
+                self._forget_response(key, size)
+                return None
+            self._responses[key] = cached_response
+        return response
+    
+    def _store_response(self, new_request, status, headers, body):
+        """
+        Cache the response to ``new_request``, if possible, and return its
+        status, headers and body.
+        
+        The body is read in order to cache it.
+        
+        """
+        request_key = _get_request_cache_key(new_request)
+        if request_key is None:
+            return (status, headers, body)
+        
+        lifetime = _get_freshness_lifetime(status, headers,
+                                           bool(new_request.remote_user))
+        if not lifetime:
+            return (status, headers, body)
+        
+        vary_header_names = _get_vary_header_names(headers)
+        if vary_header_names is None:
+            return (status, headers, body)
+        
+        body = ["".join(body)]
+        size = len(body[0])
+        if self.max_bytes < size:
+            return (status, headers, body)
+        
+        key = (request_key,
+               _get_vary_header_values(new_request, vary_header_names))
+        response = (status, headers, body)
+        with self._lock:
+            previous_response = self._responses.pop(key, None)
+            if previous_response:
+                self._forget_response(key, previous_response[2])
+            self._responses[key] = (time() + lifetime, response, size)
+            self._vary_header_names[request_key] = vary_header_names
+            self._response_counts[request_key] = \
+                self._response_counts.get(request_key, 0) + 1
+            self._size += size
+            while self.max_bytes < self._size:
+                (evicted_key, evicted_response) = \
+                    self._responses.popitem(last=False)
+                self._forget_response(evicted_key, evicted_response[2])
+        
+        return response
+    
+    def _forget_response(self, key, size):
+        """
+        Account for the removal of the response cached under ``key``, which
+        takes ``size`` bytes.
+        
+        The names of the headers the responses to a request vary on are
+        forgotten along with the last of them.
+        
+        This must be called with the lock held.
+        
+        """
+        self._size -= size
+        request_key = key[0]
+        response_count = self._response_counts.pop(request_key) - 1
+        if response_count:
+            self._response_counts[request_key] = response_count
+        else:
+            del self._vary_header_names[request_key]
+
+
+class RequestCoalescer(object):
+    """
+    Thread-safe registry of the calls in progress to embedded WSGI
+    applications, so that identical concurrent calls share a single call.
+    
+    Only ``GET`` and ``HEAD`` requests are coalesced, when they're for the
+    same application, ``SCRIPT_NAME``, ``PATH_INFO``, query string and
+    ``REMOTE_USER``. The threads which join a call in progress get a copy of
+    its response, or the exception it raised.
+    
+    Requests with a ``Cookie`` or ``Authorization`` header are never
+    coalesced, since the application may identify users by them. Responses
+    which set cookies are not shared either: The threads which joined such a
+    call make their own.
+    
+    The number of calls made to the applications and the number of calls
+    which were coalesced into them are available in the ``calls`` and
+    ``coalesced_calls`` attributes, respectively.
+    
+    """
+    
+    def __init__(self):
+        self.calls = 0
+        self.coalesced_calls = 0
+        
+        self._calls_in_progress = {}
+        self._lock = Lock()
+    
+    def _get_response(self, wsgi_app, new_request, get_response):
+        """
+        Return the status, the headers and the body of the response from
+        ``get_response``, or those from the identical call in progress.
+        
+        """
+        request_key = _get_request_cache_key(new_request)
+        if request_key is None or \
+           _has_credentials(new_request.environ):
+            return self._call(get_response)
+        
+        key = (wsgi_app, request_key)
+        with self._lock:
+            call = self._calls_in_progress.get(key)
+            if call is None:
+                call = _CallInProgress()
+                self._calls_in_progress[key] = call
+                self.calls += 1
+                is_leader = True
+            else:
+                self.coalesced_calls += 1
+                is_leader = False
+        
+        if is_leader:
+            try:
+                call.response = _read_wsgi_response(*get_response())
+            except:
+                call.exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._calls_in_progress[key]
+                call.finished.set()
+        else:
+            call.finished.wait()
+        
+        if call.exc_info:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        (status, headers, body) = call.response
+        if not is_leader and _sets_cookies(headers):
+            # The cookies may identify the user who made the first request:
+            with self._lock:
+                self.coalesced_calls -= 1
+            return self._call(get_response)
+        return (status, list(headers), list(body))
+    
+    def _call(self, get_response):
+        with self._lock:
+            self.calls += 1
+        return _read_wsgi_response(*get_response())
+
+
+class CircuitBreaker(object):
+    """
+    Thread-safe circuit breaker for the calls to an embedded WSGI
+    application.
+    
+    :param window_size: The number of most recent calls taken into account.
+    :type window_size: :class:`int`
+    :param min_calls: The minimum number of calls in the window before the
+        circuit can be opened.
+    :type min_calls: :class:`int`
+    :param error_rate_threshold: The proportion of failed calls in the window
+        at which the circuit is opened.
+    :type error_rate_threshold: :class:`float`
+    :param latency_threshold: The number of seconds which the
+        ``latency_percentile`` of the calls in the window must not exceed, if
+        any.
+    :type latency_threshold: :class:`float`
+    :param latency_percentile: The percentile of the latencies in the window
+        compared to ``latency_threshold``, between 0 and 100.
+    :type latency_percentile: :class:`float`
+    :param reset_timeout: The number of seconds after which an open circuit
+        lets a trial call through.
+    :type reset_timeout: :class:`float`
+    :param make_fallback_response: The callable which returns the response to
+        be used while the circuit is open, given the request; defaults to an
+        empty ``503 Service Unavailable`` response.
+    
+    The circuit is closed initially, so all the calls go through. Calls which
+    raise an exception or return a 5xx response (including timeouts) are
+    failures. Once the error rate or the latency percentile in the window
+    exceed their thresholds, the circuit is opened and the application is not
+    called. After ``reset_timeout`` seconds, it's half-open: One call goes
+    through and, if it succeeds, the circuit is closed again; otherwise, it's
+    opened again.
+    
+    The current state is available in the ``state`` attribute.
+    
+    """
+    
+    CLOSED = "closed"
+    
+    OPEN = "open"
+    
+    HALF_OPEN = "half-open"
+    
+    def __init__(self, window_size=20, min_calls=10, error_rate_threshold=0.5,
+                 latency_threshold=None, latency_percentile=95,
+                 reset_timeout=30, make_fallback_response=None):
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.latency_threshold = latency_threshold
+        self.latency_percentile = latency_percentile
+        self.reset_timeout = reset_timeout
+        self.make_fallback_response = \
+            make_fallback_response or _make_fallback_response
+        
+        self.state = self.CLOSED
+        # The outcome and the latency of the most recent calls:
+        self._calls = deque(maxlen=window_size)
+        self._opening_time = None
+        self._trial_call_in_progress = False
+        self._lock = Lock()
+    
+    @property
+    def error_rate(self):
+        """The proportion of failed calls in the window."""
+        calls = list(self._calls)
+        if not calls:
+            return 0.0
+        failed_calls = [call for call in calls if not call[0]]
+        return float(len(failed_calls)) / len(calls)
+    
+    @property
+    def latency(self):
+        """The ``latency_percentile`` of the latencies in the window."""
+        latencies = sorted(call[1] for call in self._calls)
+        if not latencies:
+            return 0.0
+        index = int(ceil(len(latencies) * self.latency_percentile / 100.0))
+        return latencies[max(index - 1, 0)]
+    
+    def _call(self, get_response, request):
+        """
+        Return the response from ``get_response`` or the fallback response,
+        depending on the state of the circuit.
+        
+        """
+        with self._lock:
+            if self.state == self.OPEN and \
+               self._opening_time + self.reset_timeout <= time():
+                self.state = self.HALF_OPEN
+            is_call_allowed = self.state == self.CLOSED or \
+                (self.state == self.HALF_OPEN and
+                 not self._trial_call_in_progress)
+            is_trial_call = self.state == self.HALF_OPEN and is_call_allowed
+            if is_trial_call:
+                self._trial_call_in_progress = True
+        
+        if not is_call_allowed:
+            return self.make_fallback_response(request)
+        
+        start_time = time()
+        try:
+            response = get_response()
+        except:
+            self._record_call(False, time() - start_time, is_trial_call)
+            raise
+        self._record_call(response.status_code < 500, time() - start_time,
+                          is_trial_call)
+        return response
+    
+    def _record_call(self, succeeded, latency, is_trial_call):
+        with self._lock:
+            if is_trial_call:
+                self._trial_call_in_progress = False
+                if succeeded:
+                    self.state = self.CLOSED
+                    self._calls.clear()
+                else:
+                    self._open()
+                return
+            
+            self._calls.append((succeeded, latency))
+            if self.state == self.CLOSED and self.min_calls <= len(self._calls):
+                if self.error_rate_threshold <= self.error_rate:
+                    self._open()
+                elif self.latency_threshold is not None and \
+                     self.latency_threshold < self.latency:
+                    self._open()
+    
+    def _open(self):
+        self.state = self.OPEN
+        self._opening_time = time()
+
+
+#{ Internals
+
+
+def _make_embedded_request(request, path_info, input_lock=None):
+    """
+    Return the request for an embedded application, derived from the Django
+    ``request``.
+    
+    """
+    new_request = Request(request.environ.copy())
+    if "wsgi.input" in request.environ:
+        new_request.environ['wsgi.input'] = \
+            _SharedInput(request.environ['wsgi.input'], input_lock)
     
     # Moving the portion of the path consumed by the current view, from the
     # PATH_INTO to the SCRIPT_NAME:
@@ -68,47 +878,519 @@ def call_wsgi_app(wsgi_app, request, path_info):
     if "webob.adhoc_attrs" in request.environ:
         del new_request.environ['webob.adhoc_attrs']
     
-    # Calling the WSGI application and getting its response:
-    (status, headers, body) = new_request.call_application(wsgi_app)
+    return new_request
+
+
+def _get_wsgi_response(wsgi_app, new_request, stream):
+    """
+    Call ``wsgi_app`` with ``new_request``.
+    
+    :return: The status, the headers and the body of the response.
     
-    # Turning its response into a Django response:
-    cookies = SimpleCookie()
+    """
+    if stream:
+        return _call_wsgi_app_lazily(wsgi_app, new_request.environ)
+    return new_request.call_application(wsgi_app)
+
+
+def _start_wsgi_calls(calls, stream):
+    """
+    Call the WSGI applications in ``calls`` with their respective requests in
+    the fan-out thread pool.
+    
+    :param calls: The WSGI applications along with their requests.
+    :type calls: iterable of ``(wsgi_app, new_request)`` tuples
+    :param stream: Whether the body of the responses should be left unread.
+    :type stream: :class:`bool`
+    :return: The calls in progress and their pending responses, in the same
+        order as ``calls``.
+    
+    """
+    thread_pool = _get_fan_out_pool()
+    fan_out_calls = [_FanOutCall(wsgi_app, new_request, stream)
+                     for (wsgi_app, new_request) in calls]
+    pending_responses = [thread_pool.apply_async(fan_out_call.run)
+                         for fan_out_call in fan_out_calls]
+    return (fan_out_calls, pending_responses)
+
+
+class _FanOutCall(object):
+    """
+    Call to a WSGI application in the fan-out thread pool, whose response is
+    closed if it's given up on.
+    
+    """
+    
+    def __init__(self, wsgi_app, new_request, stream):
+        self.wsgi_app = wsgi_app
+        self.new_request = new_request
+        self.stream = stream
+        self.response = None
+        self.is_abandoned = False
+        self._lock = Lock()
+    
+    def run(self):
+        """Return the status, the headers and the body of the response."""
+        response = _get_wsgi_response(self.wsgi_app, self.new_request,
+                                      self.stream)
+        if not self.stream:
+            response = _read_wsgi_response(*response)
+        
+        with self._lock:
+            if not self.is_abandoned:
+                self.response = response
+                return response
+        _close_app_iter(response[2])
+        return None
+    
+    def abandon(self):
+        """
+        Close the body of the response, and that of the response to come if
+        the call is still in progress.
+        
+        """
+        with self._lock:
+            self.is_abandoned = True
+            response = self.response
+            self.response = None
+        if response is not None:
+            _close_app_iter(response[2])
+
+
+def _wait_for_wsgi_response(wsgi_app, pending_response, deadline):
+    """
+    Return the status, the headers and the body of the ``pending_response``
+    from ``wsgi_app``, once it's available.
+    
+    :raises twod.wsgi.exc.ApplicationCallError: If the response is not
+        available by ``deadline``.
+    
+    """
+    if deadline is None:
+        return pending_response.get()
+    
+    try:
+        return pending_response.get(max(deadline - time(), 0))
+    except TimeoutError:
+        raise ApplicationCallError("WSGI application %r did not respond in "
+                                   "time" % wsgi_app)
+
+
+def _make_django_response(status, headers, body):
+    """Turn the response from a WSGI application into a Django response."""
     django_response = TwodResponse(body, status=status)
     for (header, value) in headers:
         if header.upper() == "SET-COOKIE":
-            if isinstance(value, unicode):
-                # It can't be Unicode:
-                value = value.encode("us-ascii")
-            cookies.load(value)
+            django_response.set_raw_cookie(value)
         else:
             django_response[header] = value
-    
-    # Setting the cookies from Django:
-    for (cookie_name, cookie) in cookies.items():
-        cookie_attributes = {
-            'key': cookie_name,
-            'value': cookie.value,
-            'max_age': cookie.get("max-age"),
-            'expires': cookie.get("expires"),
-            'path': cookie.get("path", "/"),
-            'domain': cookie.get("domain"),
-            }
-        django_response.set_cookie(**cookie_attributes)
     return django_response
 
 
-def make_wsgi_view(wsgi_app):
+def _get_shared_wsgi_response(wsgi_app, new_request, cache, coalescer):
     """
-    Return a callable which can be used as a Django view powered by the
-    ``wsgi_app``.
+    Return the status, the headers and the body of the response to
+    ``new_request`` from ``cache`` or from ``wsgi_app``, through
+    ``coalescer``.
     
-    :param wsgi_app: The WSGI which will run the view.
-    :return: The view callable.
+    """
+    if cache is not None:
+        response = cache._get_response(new_request)
+        if response is not None:
+            return response
+    
+    def get_response():
+        response = new_request.call_application(wsgi_app)
+        if cache is not None:
+            response = cache._store_response(new_request, *response)
+        return response
+    
+    if coalescer is None:
+        return get_response()
+    return coalescer._get_response(wsgi_app, new_request, get_response)
+
+
+def _read_wsgi_response(status, headers, app_iter):
+    """Read the body of a response, so that it can be shared."""
+    try:
+        body = ["".join(app_iter)]
+    finally:
+        _close_app_iter(app_iter)
+    return (status, headers, body)
+
+
+def _close_app_iter(app_iter):
+    if hasattr(app_iter, "close"):
+        app_iter.close()
+
+
+class _CallInProgress(object):
+    """Call to a WSGI application, whose response may be shared."""
     
+    def __init__(self):
+        self.finished = Event()
+        self.response = None
+        self.exc_info = None
+
+
+def _get_deadline(environ, timeout):
     """
+    Return the time by which the call to an embedded application must
+    finish, if any, given the deadline in ``environ`` and ``timeout``.
     
-    def view(request, path_info):
-        return call_wsgi_app(wsgi_app, request, path_info)
+    """
+    deadline = environ.get(_DEADLINE_ENVIRON_KEY)
+    if timeout is not None:
+        call_deadline = time() + timeout
+        if deadline is None or call_deadline < deadline:
+            deadline = call_deadline
+    return deadline
+
+
+def _get_response_by_deadline(get_response, deadline, read_body):
+    """
+    Return the status, the headers and the body of the response from
+    ``get_response``, or ``None`` if it's not available by ``deadline``.
     
-    return view
+    ``get_response`` is run in the deadline thread pool, and it's abandoned
+    if the deadline is missed.
+    
+    """
+    if deadline <= time():
+        return None
+    
+    call = _CallByDeadline(get_response, read_body)
+    _get_deadline_pool().apply_async(call.run)
+    
+    return call.get_response(deadline)
+
+
+class _CallByDeadline(object):
+    """Call to a WSGI application which may be abandoned."""
+    
+    def __init__(self, get_response, read_body):
+        self.call_app = get_response
+        self.read_body = read_body
+        self.finished = Event()
+        self.response = None
+        self.exc_info = None
+        self.abandoned = False
+        self._lock = Lock()
+    
+    def run(self):
+        with self._lock:
+            if self.abandoned:
+                # The deadline was missed while waiting for a thread.
+                return
+        
+        response = None
+        exc_info = None
+        try:
+            response = self.call_app()
+            if self.read_body:
+                response = _read_wsgi_response(*response)
+        except:
+            exc_info = sys.exc_info()
+        
+        with self._lock:
+            self.response = response
+            self.exc_info = exc_info
+            self.finished.set()
+            abandoned = self.abandoned
+        
+        if abandoned and response and hasattr(response[2], "close"):
+            response[2].close()
+    
+    def get_response(self, deadline):
+        self.finished.wait(max(deadline - time(), 0))
+        with self._lock:
+            if not self.finished.is_set():
+                self.abandoned = True
+                return None
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.response
+
+
+def _make_timeout_response(request):
+    return TwodResponse("", status=504)
+
+
+def _make_fallback_response(request):
+    return TwodResponse("", status=503)
+
+
+def _get_request_cache_key(new_request):
+    """
+    Return the key for the responses to ``new_request`` in a
+    :class:`WSGIResponseCache`, if they can be cached.
+    
+    """
+    environ = new_request.environ
+    if environ['REQUEST_METHOD'] not in ("GET", "HEAD"):
+        return None
+    return (
+        environ['REQUEST_METHOD'],
+        environ.get("SCRIPT_NAME", ""),
+        environ.get("PATH_INFO", ""),
+        environ.get("QUERY_STRING", ""),
+        environ.get("REMOTE_USER"),
+        )
+
+
+def _has_credentials(environ):
+    """
+    Report whether the request in ``environ`` may identify its user through
+    its headers.
+    
+    """
+    return "HTTP_COOKIE" in environ or "HTTP_AUTHORIZATION" in environ
+
+
+def _sets_cookies(headers):
+    return any(name.lower() == "set-cookie" for (name, value) in headers)
+
+
+def _get_freshness_lifetime(status, headers, is_user_specific):
+    """
+    Return the number of seconds for which the response can be cached, if
+    any.
+    
+    """
+    if int(status.split(" ", 1)[0]) not in _CACHEABLE_STATUS_CODES:
+        return None
+    
+    headers = dict((name.lower(), value) for (name, value) in headers)
+    if "set-cookie" in headers:
+        return None
+    
+    cache_control = CacheControl.parse(headers.get("cache-control", ""),
+                                       type="response")
+    if cache_control.no_store or cache_control.no_cache:
+        return None
+    if cache_control.private and not is_user_specific:
+        return None
+    
+    if cache_control.s_maxage is not None:
+        return int(cache_control.s_maxage)
+    if cache_control.max_age is not None:
+        return int(cache_control.max_age)
+    
+    expires = _parse_http_date(headers.get("expires"))
+    if expires is None:
+        return None
+    date = _parse_http_date(headers.get("date")) or time()
+    return max(expires - date, 0)
+
+
+def _get_vary_header_names(headers):
+    """
+    Return the names of the request headers the response varies on, or
+    ``None`` if it varies on anything.
+    
+    """
+    vary_header_names = set()
+    for (name, value) in headers:
+        if name.lower() == "vary":
+            vary_header_names.update(
+                header_name.strip().lower() for header_name in value.split(",")
+                if header_name.strip()
+                )
+    if "*" in vary_header_names:
+        return None
+    return tuple(sorted(vary_header_names))
+
+
+def _get_vary_header_values(new_request, vary_header_names):
+    return tuple(
+        new_request.environ.get("HTTP_" + name.upper().replace("-", "_"))
+        for name in vary_header_names
+        )
+
+
+def _parse_http_date(value):
+    if not value:
+        return None
+    parsed_date = parsedate_tz(value)
+    if parsed_date is None:
+        return None
+    return mktime_tz(parsed_date)
+
+
+# Status codes of the responses which can be cached when they're explicitly
+# fresh: http://www.w3.org/Protocols/rfc2616/rfc2616-sec13.html#sec13.4
+_CACHEABLE_STATUS_CODES = frozenset([200, 203, 300, 301, 404, 410])
+
+
+def _get_fan_out_pool():
+    """Return the thread pool used by :func:`call_wsgi_apps`."""
+    global _fan_out_pool
+    with _fan_out_pool_lock:
+        if _fan_out_pool is None:
+            _fan_out_pool = ThreadPool(FAN_OUT_THREADS)
+    return _fan_out_pool
+
+
+_fan_out_pool = None
+
+_fan_out_pool_lock = Lock()
+
+
+def _get_deadline_pool():
+    """
+    Return the thread pool used by :func:`call_wsgi_app` to enforce the
+    deadlines.
+    
+    """
+    global _deadline_pool
+    with _deadline_pool_lock:
+        if _deadline_pool is None:
+            _deadline_pool = ThreadPool(DEADLINE_THREADS)
+    return _deadline_pool
+
+
+_deadline_pool = None
+
+_deadline_pool_lock = Lock()
+
+
+def _call_wsgi_app_lazily(wsgi_app, environ):
+    """
+    Call ``wsgi_app`` without reading its body beyond what's necessary to get
+    the status and the headers.
+    
+    :return: The status, the headers and the body of the response.
+    
+    """
+    captured = []
+    pending_chunks = deque()
+    
+    def start_response(status, headers, exc_info=None):
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        captured[:] = [status, headers]
+        return pending_chunks.append
+    
+    app_iter = wsgi_app(environ, start_response)
+    
+    if captured and not pending_chunks:
+        # The application iterable can be used as is:
+        return (captured[0], captured[1], app_iter)
+    
+    # The application either used write() or has not called start_response()
+    # yet, in which case we have to iterate over the body until it does:
+    iterator = iter(app_iter)
+    try:
+        while not captured:
+            try:
+                pending_chunks.append(iterator.next())
+            except StopIteration:
+                raise ApplicationCallError("WSGI application %r did not call "
+                                           "start_response()" % wsgi_app)
+    except:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+        raise
+    
+    body = _LazyAppIter(pending_chunks, iterator, app_iter)
+    return (captured[0], captured[1], body)
+
+
+class _SharedInput(object):
+    """
+    Proxy for a seekable ``wsgi.input`` which is shared with another request.
+    
+    It keeps its own position, so the position of the original input is
+    not altered when it's read through this proxy.
+    
+    """
+    
+    def __init__(self, original_input, lock=None):
+        self.original_input = original_input
+        self.position = 0
+        self.lock = lock
+    
+    def read(self, size=-1):
+        return self._call_original("read", size)
+    
+    def readline(self, size=-1):
+        return self._call_original("readline", size)
+    
+    def readlines(self, hint=None):
+        return list(self)
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            original_position = self.original_input.tell()
+            self.original_input.seek(0, 2)
+            offset += self.original_input.tell()
+            self.original_input.seek(original_position)
+        self.position = max(offset, 0)
+    
+    def tell(self):
+        return self.position
+    
+    def _call_original(self, method_name, size):
+        if self.lock is None:
+            return self._call_original_unlocked(method_name, size)
+        with self.lock:
+            return self._call_original_unlocked(method_name, size)
+    
+    def _call_original_unlocked(self, method_name, size):
+        original_position = self.original_input.tell()
+        self.original_input.seek(self.position)
+        try:
+            if size is None or size < 0:
+                data = getattr(self.original_input, method_name)()
+            else:
+                data = getattr(self.original_input, method_name)(size)
+        finally:
+            self.original_input.seek(original_position)
+        self.position += len(data)
+        return data
+
+
+class _LazyAppIter(object):
+    """
+    Iterable for the body of a response which has been partially read.
+    
+    The chunks read beforehand (or passed to the ``write()`` callable) are
+    returned first, and ``close()`` is passed on to the original iterable.
+    
+    """
+    
+    def __init__(self, pending_chunks, iterator, original_app_iter):
+        self.pending_chunks = pending_chunks
+        self.iterator = iterator
+        self.original_app_iter = original_app_iter
+    
+    def __iter__(self):
+        pending_chunks = self.pending_chunks
+        while pending_chunks:
+            yield pending_chunks.popleft()
+        for chunk in self.iterator:
+            # write() may have been called while getting this chunk:
+            while pending_chunks:
+                yield pending_chunks.popleft()
+            yield chunk
+        while pending_chunks:
+            yield pending_chunks.popleft()
+    
+    def close(self):
+        if hasattr(self.original_app_iter, "close"):
+            self.original_app_iter.close()
+
+
+#}
 
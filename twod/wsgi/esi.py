@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Resolution of ESI includes against embedded WSGI applications.
+
+"""
+from collections import OrderedDict
+from StringIO import StringIO
+from threading import Lock
+from time import time
+import re
+
+from webob.cachecontrol import CacheControl
+
+from twod.wsgi.embedded_wsgi import (_make_embedded_request,
+                                     _start_wsgi_calls,
+                                     _wait_for_wsgi_response)
+from twod.wsgi.exc import ApplicationCallError
+
+
+__all__ = ("ESIIncludeProcessor", )
+
+
+_ESI_INCLUDE_RE = re.compile(
+    r"<esi:include\b(?P<attributes>[^>]*?)/?>(?:\s*</esi:include>)?",
+    re.IGNORECASE,
+    )
+
+_ESI_ATTRIBUTE_RE = re.compile(r"""(\w+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+class ESIIncludeProcessor(object):
+    """
+    Response processor for :class:`~twod.wsgi.DjangoApplication` which
+    replaces the ``<esi:include src="/path" />`` markers in HTML responses
+    with the body of the response from the embedded WSGI application mounted
+    on that path.
+    
+    :param mounts: The WSGI applications, by the path prefix (relative to the
+        ``SCRIPT_NAME`` of the Django application) where they're mounted.
+    :type mounts: :class:`dict`
+    :param timeout: The number of seconds after which the fragments that
+        haven't been received are given up on, if any.
+    :type timeout: :class:`float`
+    :param max_cached_fragments: The maximum number of fragments kept in the
+        cache.
+    :type max_cached_fragments: :class:`int`
+    
+    The fragments of a response are requested in parallel, with a ``GET``
+    request derived from the original request as in
+    :func:`~twod.wsgi.call_wsgi_app`. Fragments whose response can be stored
+    by a shared cache are kept for ``max-age`` (or ``s-maxage``) seconds,
+    and a separate copy is kept for each ``REMOTE_USER`` and combination of
+    the values of the request headers in their ``Vary`` header.
+    
+    If a fragment cannot be retrieved or its status is not 2xx,
+    :class:`~twod.wsgi.exc.ApplicationCallError` is raised, unless its marker
+    has the ``onerror="continue"`` attribute, in which case the marker is
+    removed. Markers in the fragments are not processed.
+    
+    :class:`~twod.wsgi.DjangoApplication` runs it before the response
+    middleware, so it gets the page before it's compressed and before its
+    ``ETag`` is computed, and the errors are handled by Django.
+    
+    """
+    
+    def __init__(self, mounts, timeout=None, max_cached_fragments=1000):
+        # Longer prefixes take precedence:
+        self.mounts = sorted(mounts.items(), key=lambda mount: -len(mount[0]))
+        self.timeout = timeout
+        self.max_cached_fragments = max_cached_fragments
+        
+        self._cached_fragments = OrderedDict()
+        self._vary_header_names = {}
+        self._cache_lock = Lock()
+    
+    def __call__(self, request, response):
+        content_type = response.get("Content-Type", "")
+        if not content_type.startswith("text/html") or \
+           not getattr(response, "_is_string", False):
+            return response
+        
+        content = response.content
+        includes = list(_ESI_INCLUDE_RE.finditer(content))
+        if not includes:
+            return response
+        
+        # Getting the fragments which are not in the cache:
+        fragments = {}
+        calls = []
+        requested_paths = set()
+        for include in includes:
+            attributes = _get_attributes(include.group("attributes"))
+            path = attributes.get("src", "").replace("&amp;", "&")
+            if path in fragments or path in requested_paths:
+                continue
+            cached_fragment = self._get_cached_fragment(path, request)
+            if cached_fragment is not None:
+                fragments[path] = cached_fragment
+                continue
+            try:
+                (wsgi_app, fragment_request) = \
+                    self._make_fragment_request(request, path)
+            except ApplicationCallError, exc:
+                fragments[path] = exc
+            else:
+                calls.append((path, wsgi_app, fragment_request))
+                requested_paths.add(path)
+        
+        (fragment_calls, pending_responses) = _start_wsgi_calls(
+            [(wsgi_app, fragment_request) for (path, wsgi_app,
+                                               fragment_request) in calls],
+            False,
+            )
+        if self.timeout is None:
+            deadline = None
+        else:
+            deadline = time() + self.timeout
+        for ((path, wsgi_app, fragment_request), fragment_call,
+             pending_response) in zip(calls, fragment_calls,
+                                      pending_responses):
+            try:
+                (status, headers, app_iter) = _wait_for_wsgi_response(
+                    wsgi_app,
+                    pending_response,
+                    deadline,
+                    )
+            except Exception, exc:
+                fragment_call.abandon()
+                fragments[path] = exc
+                continue
+            
+            try:
+                body = "".join(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+            if status.startswith("2"):
+                fragments[path] = body
+                self._cache_fragment(path, request, headers, body)
+            else:
+                fragments[path] = ApplicationCallError(
+                    "Fragment %s could not be retrieved: %s" % (path, status)
+                    )
+        
+        # Replacing the markers:
+        new_content = []
+        position = 0
+        for include in includes:
+            attributes = _get_attributes(include.group("attributes"))
+            path = attributes.get("src", "").replace("&amp;", "&")
+            fragment = fragments[path]
+            if isinstance(fragment, Exception):
+                if attributes.get("onerror") != "continue":
+                    raise fragment
+                fragment = ""
+            new_content.append(content[position:include.start()])
+            new_content.append(fragment)
+            position = include.end()
+        new_content.append(content[position:])
+        
+        response.content = "".join(new_content)
+        if response.has_header("Content-Length"):
+            response['Content-Length'] = str(len(response.content))
+        return response
+    
+    def _make_fragment_request(self, request, path):
+        """
+        Return the WSGI application mounted on ``path`` and the request it
+        should get.
+        
+        :raises twod.wsgi.exc.ApplicationCallError: If no application is
+            mounted on ``path``.
+        
+        """
+        if "?" in path:
+            (path_info, query_string) = path.split("?", 1)
+        else:
+            (path_info, query_string) = (path, "")
+        
+        for (mount_point, wsgi_app) in self.mounts:
+            mount_point = mount_point.rstrip("/")
+            if path_info == mount_point or \
+               path_info.startswith(mount_point + "/"):
+                break
+        else:
+            raise ApplicationCallError("No WSGI application is mounted on %s"
+                                       % path)
+        
+        environ = request.environ.copy()
+        environ.update({
+            'REQUEST_METHOD': "GET",
+            'PATH_INFO': path_info,
+            'QUERY_STRING': query_string,
+            'CONTENT_LENGTH': "0",
+            'wsgi.input': StringIO(""),
+            })
+        environ.pop("CONTENT_TYPE", None)
+        parent_request = request.__class__(environ)
+        parent_request.user = request.user
+        
+        fragment_request = _make_embedded_request(
+            parent_request,
+            path_info[len(mount_point):],
+            )
+        # The preconditions and ranges apply to the page, and the fragments
+        # must not be compressed because they're embedded in it:
+        fragment_request.remove_conditional_headers()
+        return (wsgi_app, fragment_request)
+    
+    #{ Fragment caching
+    
+    def _get_cached_fragment(self, path, request):
+        with self._cache_lock:
+            if path not in self._vary_header_names:
+                return None
+            cache_key = _get_cache_key(path, self._vary_header_names[path],
+                                       request)
+            if cache_key not in self._cached_fragments:
+                return None
+            (expiry_time, body) = self._cached_fragments.pop(cache_key)
+            if expiry_time <= time():
+                return None
+            # Making it the most recently used fragment:
+            self._cached_fragments[cache_key] = (expiry_time, body)
+            return body
+    
+    def _cache_fragment(self, path, request, headers, body):
+        headers = dict((name.lower(), value) for (name, value) in headers)
+        cache_control = CacheControl.parse(headers.get("cache-control", ""),
+                                           type="response")
+        max_age = cache_control.s_maxage
+        if max_age is None:
+            max_age = cache_control.max_age
+        if not max_age or cache_control.private or cache_control.no_store or \
+           cache_control.no_cache or "set-cookie" in headers:
+            return
+        vary_header_names = tuple(sorted(
+            header_name.strip().lower()
+            for header_name in headers.get("vary", "").split(",")
+            if header_name.strip()
+            ))
+        if "*" in vary_header_names:
+            return
+        
+        cache_key = _get_cache_key(path, vary_header_names, request)
+        with self._cache_lock:
+            self._vary_header_names[path] = vary_header_names
+            self._cached_fragments.pop(cache_key, None)
+            self._cached_fragments[cache_key] = (time() + int(max_age), body)
+            while len(self._cached_fragments) > self.max_cached_fragments:
+                self._cached_fragments.popitem(last=False)
+    
+    #}
+
+
+#{ Internals
+
+
+def _get_attributes(raw_attributes):
+    attributes = {}
+    for (name, double_quoted_value, single_quoted_value) in \
+        _ESI_ATTRIBUTE_RE.findall(raw_attributes):
+        attributes[name.lower()] = double_quoted_value or single_quoted_value
+    return attributes
+
+
+def _get_cache_key(path, vary_header_names, request):
+    vary_header_values = tuple(
+        request.environ.get("HTTP_" + header_name.upper().replace("-", "_"))
+        for header_name in vary_header_names
+        )
+    # The fragments are requested on behalf of the user, as in
+    # _make_embedded_request():
+    if request.user.is_authenticated():
+        remote_user = request.user.username
+    else:
+        remote_user = request.environ.get("REMOTE_USER")
+    return (path, remote_user, vary_header_values)
+
+
+#}
@@ -19,36 +19,81 @@ Miscellaneous PasteDeploy Application Factories.
 """
 from os import path
 
-from paste.urlmap import URLMap
+from paste.deploy.converters import asbool
 from paste.urlparser import StaticURLParser
+from paste.util.import_string import eval_import
 from django import __file__ as django_init
 
+from twod.wsgi.media import (MediaApplication, MediaManifest,
+                             register_media_manifest)
+from twod.wsgi.middleware import PrefixDispatcher
+from twod.wsgi.mounts import MountTable
 
-__all__ = ("make_full_django_app", "add_media_to_app")
+
+__all__ = ("make_full_django_app", "add_media_to_app",
+           "make_prefix_dispatcher")
 
 
 _DJANGO_ROOT = path.dirname(django_init)
 
+_MEDIA_APP_CLASSES = {
+    'paste': StaticURLParser,
+    'twod': MediaApplication,
+    }
+
 
 def make_full_django_app(loader, global_conf, **local_conf):
     """
     Return a WSGI application made up of the Django application, its media and
     the Django Admin media.
     
+    The ``media_app`` option sets the application which serves the media:
+    ``paste`` for :class:`paste.urlparser.StaticURLParser` or ``twod`` for
+    :class:`~twod.wsgi.media.MediaApplication`.
+    
+    The ``fingerprint_media`` option, if enabled, makes the media available
+    under fingerprinted paths too (see :func:`add_media_to_app`), in which
+    case ``media_app`` defaults to ``twod``; otherwise it defaults to
+    ``paste``.
+    
     This is a PasteDeploy Composite Application Factory.
     
     """
     django_app = loader.get_app(local_conf['django_app'], global_conf=global_conf)
-    return add_media_to_app(django_app)
+    fingerprint_media = asbool(local_conf.get("fingerprint_media", False))
+    default_media_app = "twod" if fingerprint_media else "paste"
+    media_app_class = \
+        _MEDIA_APP_CLASSES[local_conf.get("media_app", default_media_app)]
+    return add_media_to_app(django_app, media_app_class, fingerprint_media)
 
 
-def add_media_to_app(django_app):
+def add_media_to_app(django_app, media_app_class=StaticURLParser,
+                     fingerprint_media=False):
     """
     Return a WSGI application made up of the Django application, its media and
     the Django Admin media.
     
+    :param media_app_class: The WSGI application class which serves the
+        files in a directory, given its path.
+    :param fingerprint_media: Whether to fingerprint the media, so that the
+        files can also be requested by a path which contains the hash of their
+        contents and cached by the clients for a year.
+    :type fingerprint_media: :class:`bool`
+    :raises ValueError: If ``fingerprint_media`` is set but
+        ``media_app_class`` is not a
+        :class:`~twod.wsgi.media.MediaApplication`.
+    
+    The media is fingerprinted by walking the media directories once, when
+    this function is called, and the resulting manifests are registered so
+    that :func:`~twod.wsgi.media.get_media_url` returns the fingerprinted URLs
+    to the files.
+    
     """
-    app = URLMap()
+    if fingerprint_media and not issubclass(media_app_class, MediaApplication):
+        raise ValueError("Only %s can serve the fingerprinted media, not %s" %
+                         (MediaApplication.__name__, media_app_class.__name__))
+    
+    app = MountTable()
     app['/'] = django_app
     
     # The Django App has been loaded, so it's now safe to access the settings:
@@ -56,11 +101,69 @@ def add_media_to_app(django_app):
     
     # Setting up the Admin media:
     admin_media = path.join(_DJANGO_ROOT, "contrib", "admin", "media")
-    app[settings.ADMIN_MEDIA_PREFIX] = StaticURLParser(admin_media)
+    app[settings.ADMIN_MEDIA_PREFIX] = _make_media_app(
+        media_app_class,
+        admin_media,
+        settings.ADMIN_MEDIA_PREFIX,
+        fingerprint_media,
+        )
     
     # Setting up the media for the Django application:
-    app[settings.MEDIA_URL] = StaticURLParser(settings.MEDIA_ROOT)
+    app[settings.MEDIA_URL] = _make_media_app(
+        media_app_class,
+        settings.MEDIA_ROOT,
+        settings.MEDIA_URL,
+        fingerprint_media,
+        )
     
     return app
+
+
+def make_prefix_dispatcher(loader, global_conf, **local_conf):
+    """
+    Return a :class:`~twod.wsgi.middleware.PrefixDispatcher` for the Django
+    application, with the WSGI applications mounted on the paths set in the
+    options which start with a slash.
+    
+    The ``identity_resolver`` option, if set, is the import path to the
+    identity resolver (e.g.,
+    ``twod.wsgi.middleware:resolve_django_session_identity``).
+    
+    This is a PasteDeploy Composite Application Factory.
     
+    """
+    django_app = loader.get_app(local_conf.pop("django_app"),
+                                global_conf=global_conf)
+    
+    identity_resolver = local_conf.pop("identity_resolver", None)
+    if identity_resolver:
+        identity_resolver = eval_import(identity_resolver)
+    
+    mounts = {}
+    for (prefix, app_name) in local_conf.items():
+        if prefix.startswith("/"):
+            mounts[prefix] = loader.get_app(app_name, global_conf=global_conf)
+    
+    return PrefixDispatcher(django_app, mounts, identity_resolver)
+
+
+#{ Internals
+
+
+def _make_media_app(media_app_class, root_directory, url_prefix,
+                    fingerprint_media):
+    """
+    Return the application which serves the files in ``root_directory``,
+    with their fingerprinted paths if ``fingerprint_media`` is set.
+    
+    """
+    # An unset MEDIA_ROOT must not be taken for the current directory:
+    if not fingerprint_media or not root_directory:
+        return media_app_class(root_directory)
+    
+    manifest = MediaManifest(root_directory, url_prefix)
+    register_media_manifest(manifest)
+    return media_app_class(root_directory, manifest=manifest)
+
 
+#}
@@ -17,14 +17,47 @@
 Django request/response handling a la WSGI.
 
 """
+from cgi import FieldStorage
+from Cookie import Morsel, SimpleCookie
+from tempfile import SpooledTemporaryFile
+from time import time
+
 from webob import Request
+from webob.multidict import MultiDict, NoVars
 from django.core.handlers.wsgi import WSGIRequest, WSGIHandler
 from django.http import HttpResponse
 
 __all__ = ("TwodWSGIRequest", "TwodResponse", "DjangoApplication")
 
 
-_ACTUAL_REASON_HEADER = "X-Actual-Status-Reason"
+_STATUS_REASON_ENVIRON_KEY = "twod.wsgi.status_reason"
+
+_DEADLINE_ENVIRON_KEY = "twod.wsgi.deadline"
+
+# Attributes set by Django's request class, which must never be treated as
+# WebOb ad-hoc attributes:
+_DJANGO_REQUEST_ATTRIBUTES = frozenset([
+    "environ",
+    "path",
+    "path_info",
+    "method",
+    "META",
+    "_encoding",
+    "_files",
+    "_get",
+    "_post",
+    "_post_parse_error",
+    "_raw_post_data",
+    "_read_started",
+    "_stream",
+    "_upload_handlers",
+    ])
+
+_FORM_CONTENT_TYPES = frozenset([
+    "",
+    "application/x-www-form-urlencoded",
+    "multipart/form-data",
+    ])
 
 
 class TwodWSGIRequest(WSGIRequest, Request):
@@ -50,9 +83,25 @@ class TwodWSGIRequest(WSGIRequest, Request):
     META = None
     
     def __init__(self, environ):
-        Request.__init__(self, environ)
+        # WebOb keeps all its state in the environ, which is set by Django, so
+        # there's nothing else to build for the WebOb side of the request:
         WSGIRequest.__init__(self, environ)
     
+    def __setattr__(self, attr, value):
+        """
+        Set ``attr`` on the request object, unless it's a WebOb ad-hoc
+        attribute.
+        
+        The attributes set by Django on every request bypass the lookups in
+        :meth:`webob.Request.__setattr__`, which would end up setting them on
+        the object anyway.
+        
+        """
+        if attr in _DJANGO_REQUEST_ATTRIBUTES:
+            object.__setattr__(self, attr, value)
+        else:
+            Request.__setattr__(self, attr, value)
+    
     #{ Handing arguments
     
     uPOST = Request.POST
@@ -62,18 +111,41 @@ class TwodWSGIRequest(WSGIRequest, Request):
     @property
     def str_POST(self):
         """
-        Return the POST arguments by using WebOb.
+        Return the POST arguments in a WebOb multi-dictionary.
+        
+        The body of POST requests is only ever parsed by Django, so that it
+        doesn't have to be read twice; WebOb's dictionary is built out of
+        Django's ``POST`` and ``FILES`` dictionaries.
         
         """
-        # Before returning the POST arguments, we have to restore the content
-        # length, which is reset by WebOb:
-        original_content_length = self.environ.get("CONTENT_LENGTH")
-        try:
+        if self.method != "POST":
+            # Django only parses the body of POST requests:
             return super(TwodWSGIRequest, self).str_POST
-        finally:
-            self.environ['CONTENT_LENGTH'] = original_content_length
-            # "Resetting" the input so Django will read it:
-            self._seek_input()
+        
+        if "webob._parsed_post_vars" in self.environ:
+            (post_vars, body_file) = self.environ['webob._parsed_post_vars']
+            if body_file is self.body_file:
+                return post_vars
+        
+        content_type = self.content_type.split(";", 1)[0]
+        if content_type not in _FORM_CONTENT_TYPES:
+            return NoVars("Not an HTML form submission (Content-Type: %s)" %
+                          content_type)
+        
+        from django.conf import settings
+        encoding = self.encoding or settings.DEFAULT_CHARSET
+        post_vars = MultiDict()
+        for (name, values) in self.POST.lists():
+            name = name.encode(encoding)
+            for value in values:
+                post_vars.add(name, value.encode(encoding))
+        for (name, uploaded_files) in self.FILES.lists():
+            name = name.encode(encoding)
+            for uploaded_file in uploaded_files:
+                post_vars.add(name, _UploadedFieldStorage(name, uploaded_file))
+        
+        self.environ['webob._parsed_post_vars'] = (post_vars, self.body_file)
+        return post_vars
     
     # django.core.handlers.wsgi.WSGIRequest
     def _load_post_and_files(self):
@@ -84,12 +156,18 @@ class TwodWSGIRequest(WSGIRequest, Request):
         try:
             return super(TwodWSGIRequest, self)._load_post_and_files()
         finally:
-            # "Resetting" the input so WebOb will read it:
+            # "Resetting" the input so that WebOb's ``body`` and
+            # ``body_file`` still have the whole body:
             self._seek_input()
     
     def _seek_input(self):
-        if "wsgi.input" in self.environ:
-            self.environ['wsgi.input'].seek(0)
+        wsgi_input = self.environ.get("wsgi.input")
+        if hasattr(wsgi_input, "seek"):
+            try:
+                wsgi_input.seek(0)
+            except IOError:
+                # It's not really seekable (e.g., it's a pipe).
+                pass
     
     #}
 
@@ -120,55 +198,371 @@ class TwodResponse(HttpResponse):
         
         super(TwodResponse, self).__init__(content, mimetype, status_code,
                                            *args, **kwargs)
+    
+    def set_raw_cookie(self, raw_cookie):
+        """
+        Set a cookie from the value of a ``Set-Cookie`` header, which will be
+        sent as is.
         
-        # Including the actual reason header if necessary:
-        if self.status_reason:
-            reason_header = "%s %s" % (self.status_code, self.status_reason)
-            self._headers[_ACTUAL_REASON_HEADER.lower()] = \
-                (_ACTUAL_REASON_HEADER, reason_header)
+        Unlike :meth:`set_cookie`, this doesn't parse the cookie attributes and
+        therefore all of them are kept. The cookie can still be replaced with
+        :meth:`set_cookie`, like any other cookie.
+        
+        """
+        if isinstance(raw_cookie, unicode):
+            # It can't be Unicode:
+            raw_cookie = raw_cookie.encode("us-ascii")
+        cookie = _RawCookie(raw_cookie)
+        # Bypassing SimpleCookie.__setitem__, which would parse the value:
+        dict.__setitem__(self.cookies, cookie.key, cookie)
 
 
 class DjangoApplication(WSGIHandler):
     """
     Django request handler which uses our enhanced WSGI request class.
     
+    :param input_memory_threshold: The maximum size (in bytes) of the request
+        bodies kept in memory when ``wsgi.input`` has to be made seekable;
+        bigger bodies are spooled to a temporary file.
+    :type input_memory_threshold: :class:`int`
+    :param response_processors: The callables which may replace the
+        responses from Django, given the request and the response, in order.
+        They run before the response middleware, so that those which
+        transform the responses (e.g., ``GZipMiddleware``) or compute their
+        ``ETag`` get the processed responses, and their exceptions are handled
+        by Django.
+    :type response_processors: iterable
+    :param deadline_header: The name of the request header with the number
+        of seconds the client is willing to wait for the response, if any.
+    :type deadline_header: :class:`basestring`
+    
+    Non-seekable ``wsgi.input`` objects are replaced with a buffer which reads
+    the original input on demand, so that the body can be read by both Django
+    and WebOb.
+    
+    When ``deadline_header`` is set, the time by which the response is due is
+    set in the ``twod.wsgi.deadline`` item of the WSGI environment (as seconds
+    since the epoch), so that it's enforced when calling embedded WSGI
+    applications.
+    
     """
     request_class = TwodWSGIRequest
     
+    input_memory_threshold = 1024 * 1024
+    
+    def __init__(self, input_memory_threshold=None, response_processors=(),
+                 deadline_header=None):
+        super(DjangoApplication, self).__init__()
+        if input_memory_threshold is not None:
+            self.input_memory_threshold = input_memory_threshold
+        self.response_processors = list(response_processors)
+        if deadline_header:
+            self.deadline_environ_key = \
+                "HTTP_" + deadline_header.upper().replace("-", "_")
+        else:
+            self.deadline_environ_key = None
+    
     def __call__(self, environ, start_response):
-        start_response_wrapper = _StartResponseWrapper(start_response)
-        return super(DjangoApplication, self).__call__(environ,
-                                                       start_response_wrapper)
+        wsgi_input = environ.get("wsgi.input")
+        if wsgi_input is not None and not hasattr(wsgi_input, "seek"):
+            environ['wsgi.input'] = _SpooledInput(
+                wsgi_input,
+                environ.get("CONTENT_LENGTH"),
+                self.input_memory_threshold,
+                _is_input_terminated(environ),
+                )
+        
+        if self.deadline_environ_key in environ:
+            _set_deadline(environ, environ[self.deadline_environ_key])
+        
+        start_response_wrapper = _StartResponseWrapper(start_response, environ)
+        response = super(DjangoApplication, self).__call__(
+            environ,
+            start_response_wrapper,
+            )
+        
+        # Passing on the objects made by the server's file wrapper (e.g., by
+        # embedded WSGI applications), so that the server can optimise them:
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        response_body = getattr(response, "_container", None)
+        try:
+            is_wrapped_file = isinstance(response_body, file_wrapper)
+        except TypeError:
+            # The file wrapper is not set or it's not a class:
+            is_wrapped_file = False
+        # Unless something else has to be done when the response is closed
+        # (e.g., by make_pooled_wsgi_view()):
+        if is_wrapped_file and "close" not in vars(response):
+            response = response_body
+        
+        return response
+    
+    def load_middleware(self):
+        super(DjangoApplication, self).load_middleware()
+        # The response middleware run in this order, so the response
+        # processors go first:
+        self._response_middleware.insert(0, self._process_response)
+    
+    def get_response(self, request):
+        """
+        Return the response for ``request`` and keep its status reason phrase,
+        if any, so that it can be passed on to the WSGI server.
+        
+        """
+        response = super(DjangoApplication, self).get_response(request)
+        status_reason = getattr(response, "status_reason", None)
+        if status_reason:
+            request.environ[_STATUS_REASON_ENVIRON_KEY] = status_reason
+        return response
+    
+    def _process_response(self, request, response):
+        """Pass ``response`` through the response processors."""
+        for response_processor in self.response_processors:
+            response = response_processor(request, response)
+        return response
 
 
 #{ Internals
 
 
+def _is_input_terminated(environ):
+    """
+    Report whether ``wsgi.input`` can be read until it's exhausted, without
+    relying on the ``CONTENT_LENGTH``.
+    
+    """
+    if environ.get("wsgi.input_terminated"):
+        return True
+    transfer_encoding = environ.get("HTTP_TRANSFER_ENCODING", "")
+    return "chunked" in transfer_encoding.lower()
+
+
+def _set_deadline(environ, budget):
+    """
+    Set the deadline in ``environ`` to ``budget`` seconds from now, unless
+    there's an earlier deadline already.
+    
+    """
+    try:
+        deadline = time() + float(budget)
+    except ValueError:
+        return
+    if deadline < environ.get(_DEADLINE_ENVIRON_KEY, deadline + 1):
+        environ[_DEADLINE_ENVIRON_KEY] = deadline
+
+
+class _UploadedFieldStorage(FieldStorage):
+    """
+    :class:`cgi.FieldStorage` proxy for a file uploaded through Django, as
+    found in WebOb's POST arguments.
+    
+    """
+    
+    def __init__(self, name, uploaded_file):
+        # The body has already been parsed by Django, so the constructor in
+        # FieldStorage must not be called.
+        self.name = name
+        self.filename = uploaded_file.name
+        self.file = uploaded_file
+        self.type = uploaded_file.content_type
+        self.type_options = {}
+        if uploaded_file.charset:
+            self.type_options['charset'] = uploaded_file.charset
+        self.disposition = "form-data"
+        self.disposition_options = {'name': name, 'filename': self.filename}
+        self.headers = {}
+        self.list = None
+
+
+class _RawCookie(Morsel):
+    """
+    Cookie whose ``Set-Cookie`` header value is output as is, unless it's
+    changed.
+    
+    Only the name and the value are extracted from the header value; the
+    other attributes are only parsed when the cookie is changed.
+    
+    """
+    
+    def __init__(self, raw_cookie):
+        Morsel.__init__(self)
+        cookie_pair = raw_cookie.split(";", 1)[0]
+        (key, value) = (cookie_pair.split("=", 1) + [""])[:2]
+        self.key = key.strip()
+        self.value = self.coded_value = value.strip()
+        self.raw_cookie = raw_cookie
+    
+    def set(self, *args, **kwargs):
+        self._parse_raw_cookie()
+        Morsel.set(self, *args, **kwargs)
+    
+    def __setitem__(self, key, value):
+        self._parse_raw_cookie()
+        Morsel.__setitem__(self, key, value)
+    
+    def OutputString(self, attrs=None):
+        if self.raw_cookie is None:
+            return Morsel.OutputString(self, attrs)
+        return self.raw_cookie
+    
+    def _parse_raw_cookie(self):
+        """Load the attributes in the raw cookie, which won't be used anymore."""
+        if self.raw_cookie is None:
+            return
+        
+        cookies = SimpleCookie()
+        cookies.load(self.raw_cookie)
+        if self.key in cookies:
+            for (attribute, value) in cookies[self.key].items():
+                dict.__setitem__(self, attribute, value)
+        self.raw_cookie = None
+
+
+class _SpooledInput(object):
+    """
+    Seekable proxy for a non-seekable ``wsgi.input``.
+    
+    The original input is only read when the data is requested, and what's
+    been read is kept in a :class:`tempfile.SpooledTemporaryFile`, so the
+    memory used is bounded by ``memory_threshold``.
+    
+    When the ``content_length`` is not set, the original input is only read
+    until it's exhausted if the server marked it as terminated
+    (``is_terminated``, e.g., with chunked requests); otherwise the body is
+    empty, since reading a socket past the end of the request would block.
+    
+    """
+    
+    chunk_size = 64 * 1024
+    
+    def __init__(self, original_input, content_length, memory_threshold,
+                 is_terminated=False):
+        self.original_input = original_input
+        try:
+            self.remaining = int(content_length)
+        except (ValueError, TypeError):
+            self.remaining = -1
+        if self.remaining < 0:
+            self.remaining = None if is_terminated else 0
+        self.buffer = SpooledTemporaryFile(max_size=memory_threshold)
+        self.buffer_length = 0
+        self.position = 0
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            self._fill()
+        else:
+            self._fill(self.position + size)
+        self.buffer.seek(self.position)
+        if size is None or size < 0:
+            data = self.buffer.read()
+        else:
+            data = self.buffer.read(size)
+        self.position += len(data)
+        return data
+    
+    def readline(self, size=-1):
+        while True:
+            self.buffer.seek(self.position)
+            if size is None or size < 0:
+                line = self.buffer.readline()
+            else:
+                line = self.buffer.readline(size)
+            
+            line_complete = line.endswith("\n") or len(line) == size
+            if line_complete or not self._fill_chunk():
+                break
+        
+        self.position += len(line)
+        return line
+    
+    def readlines(self, hint=None):
+        return list(self)
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            self._fill()
+            offset += self.buffer_length
+        self.position = max(offset, 0)
+    
+    def tell(self):
+        return self.position
+    
+    def close(self):
+        self.buffer.close()
+    
+    def _fill(self, length=None):
+        """
+        Read the original input until ``length`` bytes have been buffered, or
+        until it's exhausted if ``length`` is not set.
+        
+        """
+        while length is None or self.buffer_length < length:
+            if not self._fill_chunk():
+                break
+    
+    def _fill_chunk(self):
+        """
+        Buffer another chunk from the original input and return whether there
+        was anything left.
+        
+        """
+        chunk_size = self.chunk_size
+        if self.remaining is not None:
+            chunk_size = min(chunk_size, self.remaining)
+        if not chunk_size:
+            return False
+        
+        chunk = self.original_input.read(chunk_size)
+        if not chunk:
+            self.remaining = 0
+            return False
+        
+        if self.remaining is not None:
+            self.remaining -= len(chunk)
+        self.buffer.seek(self.buffer_length)
+        self.buffer.write(chunk)
+        self.buffer_length += len(chunk)
+        return True
+
+
 class _StartResponseWrapper(object):
     """
     Wrapper for an actual start_response() callable which replaces the
     ``status`` with the actual status reason, if any.
     
-    We need to iterate over all the ``response_headers`` until we find the
-    actual status reason. If it's not there, we'd have wasted time and
-    resources, but there's no other way around this until Django fixes the bug:
-    http://code.djangoproject.com/ticket/12747
+    Django ignores custom reason phrases (http://code.djangoproject.com/ticket/12747),
+    so :class:`DjangoApplication` stores them in the ``environ`` once the
+    response has been built. The ``response_headers`` are passed on untouched,
+    so responses without a custom reason phrase are not altered at all.
     
     """
     
-    def __init__(self, original_start_response):
+    def __init__(self, original_start_response, environ):
         self.original_start_response = original_start_response
+        self.environ = environ
     
     def __call__(self, status, response_headers, exc_info=None):
-        final_headers = []
-        
-        for (header_name, header_value) in response_headers:
-            if header_name == _ACTUAL_REASON_HEADER:
-                status = header_value
-            else:
-                final_headers.append((header_name, header_value))
+        status_reason = self.environ.pop(_STATUS_REASON_ENVIRON_KEY, None)
+        if status_reason:
+            status_code = status.split(" ", 1)[0]
+            status = "%s %s" % (status_code, status_reason)
         
-        return self.original_start_response(status, final_headers)
+        if exc_info:
+            return self.original_start_response(status, response_headers,
+                                                exc_info)
+        return self.original_start_response(status, response_headers)
 
 
 #}
@@ -0,0 +1,1002 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+WSGI application to serve static files.
+
+"""
+from collections import OrderedDict
+from email.utils import formatdate
+from errno import ENOENT, ENOTDIR
+from gzip import GzipFile
+from hashlib import md5
+from mimetypes import guess_type
+from mmap import ACCESS_READ, mmap
+from multiprocessing import Pool
+from optparse import OptionParser
+import posixpath
+from os import chmod, path, remove, rename, stat, utime, walk
+from stat import S_IMODE, S_ISREG
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
+
+from twod.wsgi.embedded_wsgi import _parse_http_date
+
+
+__all__ = ("MediaApplication", "MediaManifest", "register_media_manifest",
+           "get_media_url", "compress_media", "compress_media_command")
+
+
+class MediaApplication(object):
+    """
+    WSGI application which serves the files in ``root_directory``.
+    
+    :param root_directory: The path to the directory with the files.
+    :type root_directory: :class:`basestring`
+    :param stat_ttl: The number of seconds for which the status of a file
+        (e.g., its size) is reused before it's checked again.
+    :type stat_ttl: :class:`float`
+    :param max_cached_file_size: The size (in bytes) of the biggest file whose
+        contents may be kept in memory.
+    :type max_cached_file_size: :class:`int`
+    :param max_cache_size: The maximum size (in bytes) of the files kept in
+        memory, with the least recently used ones evicted first.
+    :type max_cache_size: :class:`int`
+    :param cache_max_age: The number of seconds for which the files may be
+        cached by the clients, if any.
+    :type cache_max_age: :class:`int`
+    :param block_size: The size (in bytes) of the blocks in which the files are
+        read.
+    :type block_size: :class:`int`
+    :param max_mapped_size: The maximum size (in bytes) of the files mapped in
+        memory, with the least recently used ones unmapped first; ``0`` (the
+        default) disables the mappings.
+    :type max_mapped_size: :class:`int`
+    :param precompressed_encodings: The content codings of the precompressed
+        variants of the files which may be served, by order of preference.
+    :type precompressed_encodings: iterable
+    :param manifest: The manifest of the fingerprinted paths to the files, if
+        they may be requested by those paths.
+    :type manifest: :class:`MediaManifest`
+    
+    The files which are not kept in memory are passed on to the server's
+    ``wsgi.file_wrapper``, if any, so that it can send them without copying
+    them (e.g., with ``sendfile()``). Otherwise, and for byte ranges, they're
+    read in blocks of ``block_size`` bytes.
+    
+    When ``max_mapped_size`` is set, the files which are read are served from
+    a read-only memory mapping instead, which is shared by all the requests
+    for the file and backed by the page cache of the operating system; each
+    block sent is still copied out of the mapping. Only
+    enable it if the files are always replaced (e.g., renamed over) instead
+    of modified in place: Reading past the end of a mapped file which was
+    truncated raises ``SIGBUS``, which kills the process.
+    
+    The responses have a strong ``ETag`` and ``Last-Modified`` header, so that
+    conditional requests are answered with ``304 Not Modified`` when the file
+    has not changed, and requests for a single byte range are answered with
+    ``206 Partial Content``.
+    
+    If a file has a precompressed variant next to it (e.g., ``site.css.gz``
+    for ``site.css``) which is not older than the file, the variant is
+    served to the clients which accept its content coding. The extensions of
+    the variants are ``.br`` for ``br`` and ``.gz`` for ``gzip``; the latter
+    can be generated with :func:`compress_media`.
+    
+    The files requested by their fingerprinted path (e.g.,
+    ``site.0123456789ab.css`` for ``site.css``) can be cached by the clients
+    for a year, since a new path is used when they change. This doesn't apply
+    if the file changed after the ``manifest`` was created, in which case it's
+    served as if it had been requested by its path.
+    
+    """
+    
+    def __init__(self, root_directory, stat_ttl=1, max_cached_file_size=65536,
+                 max_cache_size=16 * 1024 * 1024, cache_max_age=None,
+                 block_size=65536, precompressed_encodings=("br", "gzip"),
+                 manifest=None, max_mapped_size=0):
+        self.root_directory = path.abspath(root_directory)
+        self.stat_ttl = stat_ttl
+        self.max_cached_file_size = max_cached_file_size
+        self.max_cache_size = max_cache_size
+        self.cache_max_age = cache_max_age
+        self.block_size = block_size
+        self.max_mapped_size = max_mapped_size
+        self.precompressed_encodings = [
+            encoding for encoding in precompressed_encodings
+            if encoding in _PRECOMPRESSED_FILE_EXTENSIONS
+            ]
+        self.manifest = manifest
+        
+        # The expiry time and the status of each file, if it exists, with the
+        # oldest ones first:
+        self._file_stats = OrderedDict()
+        self._file_stats_lock = Lock()
+        # The contents of the small files, by path, with the least recently
+        # used ones first:
+        self._cached_files = OrderedDict()
+        self._cached_files_size = 0
+        self._cached_files_lock = Lock()
+        # The memory mappings of the big files, by path, with the least
+        # recently used ones first:
+        self._mapped_files = OrderedDict()
+        self._mapped_files_size = 0
+        self._mapped_files_lock = Lock()
+    
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] not in ("GET", "HEAD"):
+            start_response("405 Method Not Allowed", [
+                ("Allow", "GET, HEAD"),
+                ("Content-Type", "text/plain"),
+                ("Content-Length", "0"),
+                ])
+            return []
+        
+        path_info = environ.get("PATH_INFO", "")
+        logical_path = None
+        if self.manifest is not None:
+            logical_path = self.manifest.get_logical_path(path_info)
+            if logical_path is not None:
+                path_info = logical_path
+        
+        media_file = self._get_media_file(path_info,
+                                          environ.get("HTTP_ACCEPT_ENCODING"))
+        if media_file is None:
+            return _respond_with_error("404 Not Found", start_response)
+        
+        headers = [
+            ("ETag", media_file.etag),
+            ("Last-Modified", media_file.last_modified),
+            ]
+        if logical_path is not None and self._is_fingerprint_current(
+           logical_path):
+            headers.append(("Cache-Control",
+                            _FINGERPRINTED_FILE_CACHE_CONTROL))
+        elif self.cache_max_age is not None:
+            headers.append(("Cache-Control",
+                            "max-age=%s" % self.cache_max_age))
+        if media_file.has_variants:
+            headers.append(("Vary", "Accept-Encoding"))
+        
+        if not _is_modified(environ, media_file):
+            start_response("304 Not Modified", headers)
+            return []
+        
+        headers.extend([
+            ("Content-Type", media_file.content_type),
+            ("Accept-Ranges", "bytes"),
+            ])
+        if media_file.content_encoding:
+            headers.append(("Content-Encoding", media_file.content_encoding))
+        byte_range = _get_byte_range(environ, media_file)
+        if byte_range is _UNSATISFIABLE_RANGE:
+            headers.extend([
+                ("Content-Range", "bytes */%s" % media_file.size),
+                ("Content-Length", "0"),
+                ])
+            start_response("416 Requested Range Not Satisfiable", headers)
+            return []
+        
+        if byte_range is None:
+            status = "200 OK"
+            (start, length) = (0, media_file.size)
+        else:
+            status = "206 Partial Content"
+            (start, length) = byte_range
+            headers.append((
+                "Content-Range",
+                "bytes %s-%s/%s" % (start, start + length - 1, media_file.size),
+                ))
+        headers.append(("Content-Length", str(length)))
+        
+        if environ['REQUEST_METHOD'] == "HEAD":
+            body = []
+        else:
+            # The file is opened before the response is started, so that an
+            # error can still be reported:
+            try:
+                body = self._get_body(environ, media_file, start, length)
+            except IOError, exc:
+                if exc.errno in (ENOENT, ENOTDIR):
+                    # The file was removed after its status was retrieved:
+                    return _respond_with_error("404 Not Found",
+                                               start_response)
+                return _respond_with_error("500 Internal Server Error",
+                                           start_response)
+        
+        start_response(status, headers)
+        return body
+    
+    def _get_media_file(self, path_info, accept_encoding=None):
+        """
+        Return the file at ``path_info``, or ``None`` if it doesn't exist or
+        is not a regular file.
+        
+        The precompressed variant of the file which is preferred by the
+        client, given its ``accept_encoding``, is returned instead if there's
+        any.
+        
+        """
+        file_path = self._get_file_path(path_info)
+        if file_path is None:
+            return None
+        
+        file_stat = self._get_file_stat(file_path)
+        if file_stat is None:
+            return None
+        media_file = _MediaFile(file_path, file_stat)
+        if media_file.content_encoding or not self.precompressed_encodings:
+            return media_file
+        
+        variants = []
+        for encoding in self.precompressed_encodings:
+            variant_path = file_path + _PRECOMPRESSED_FILE_EXTENSIONS[encoding]
+            variant_stat = self._get_file_stat(variant_path)
+            # Variants older than the file are outdated:
+            if variant_stat is not None and \
+               not _is_older(variant_stat, file_stat):
+                variants.append(_MediaFile(
+                    variant_path,
+                    variant_stat,
+                    media_file.content_type,
+                    encoding,
+                    ))
+        if not variants:
+            return media_file
+        
+        media_file.has_variants = True
+        encoding_qualities = _parse_accept_encoding(accept_encoding)
+        best_variant = None
+        best_quality = 0
+        for variant in variants:
+            quality = encoding_qualities.get(
+                variant.content_encoding,
+                encoding_qualities.get("*", 0),
+                )
+            if best_quality < quality:
+                (best_variant, best_quality) = (variant, quality)
+        if best_variant is None:
+            return media_file
+        best_variant.has_variants = True
+        return best_variant
+    
+    def _is_fingerprint_current(self, logical_path):
+        """
+        Report whether the file at ``logical_path`` has not changed since it
+        was fingerprinted in the manifest.
+        
+        """
+        file_stat = self._get_file_stat(self._get_file_path(logical_path))
+        return self.manifest.is_current(logical_path, file_stat)
+    
+    def _get_file_path(self, path_info):
+        segments = []
+        for segment in path_info.split("/"):
+            if segment in ("", "."):
+                continue
+            if segment == ".." or "\x00" in segment or path.sep in segment or \
+               (path.altsep and path.altsep in segment):
+                return None
+            segments.append(segment)
+        if not segments:
+            return None
+        return path.join(self.root_directory, *segments)
+    
+    def _get_file_stat(self, file_path):
+        now = time()
+        with self._file_stats_lock:
+            cached_stat = self._file_stats.get(file_path)
+        if cached_stat is not None and now < cached_stat[0]:
+            return cached_stat[1]
+        
+        try:
+            file_stat = stat(file_path)
+        except (OSError, UnicodeError):
+            file_stat = None
+        else:
+            if not S_ISREG(file_stat.st_mode):
+                file_stat = None
+        
+        with self._file_stats_lock:
+            self._file_stats.pop(file_path, None)
+            self._file_stats[file_path] = (now + self.stat_ttl, file_stat)
+            # Requests for lots of different paths (e.g., missing files) must
+            # not make the cache grow indefinitely:
+            while len(self._file_stats) > _MAX_FILE_STATS:
+                self._file_stats.popitem(last=False)
+        return file_stat
+    
+    def _get_body(self, environ, media_file, start, length):
+        """
+        Return the ``length`` bytes of ``media_file`` from ``start``.
+        
+        :raises IOError: If the file can't be opened.
+        
+        """
+        if media_file.size <= self.max_cached_file_size:
+            contents = self._get_file_contents(media_file)
+            if contents is not None:
+                return [contents[start:start + length]]
+        
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if file_wrapper is None or length != media_file.size:
+            mapping = self._get_file_mapping(media_file)
+            if mapping is not None:
+                return _MappingIterator(mapping, start, length,
+                                        self.block_size)
+        
+        file_ = open(media_file.path, "rb")
+        if file_wrapper is not None and length == media_file.size:
+            return file_wrapper(file_, self.block_size)
+        return _FileIterator(file_, start, length, self.block_size)
+    
+    #{ In-memory cache of small files
+    
+    def _get_file_contents(self, media_file):
+        """
+        Return the contents of ``media_file``, reading them if they're not
+        in the cache.
+        
+        """
+        with self._cached_files_lock:
+            cached_file = self._cached_files.pop(media_file.path, None)
+            if cached_file is not None and cached_file[0] == media_file.etag:
+                # Making it the most recently used file:
+                self._cached_files[media_file.path] = cached_file
+                return cached_file[1]
+            if cached_file is not None:
+                self._cached_files_size -= len(cached_file[1])
+        
+        try:
+            with open(media_file.path, "rb") as file_:
+                contents = file_.read()
+        except IOError:
+            return None
+        if len(contents) != media_file.size:
+            # The file changed after its status was retrieved:
+            return None
+        
+        with self._cached_files_lock:
+            previous_file = self._cached_files.pop(media_file.path, None)
+            if previous_file is not None:
+                self._cached_files_size -= len(previous_file[1])
+            self._cached_files[media_file.path] = (media_file.etag, contents)
+            self._cached_files_size += len(contents)
+            while self._cached_files_size > self.max_cache_size:
+                evicted_file = self._cached_files.popitem(last=False)[1]
+                self._cached_files_size -= len(evicted_file[1])
+        return contents
+    
+    #}
+    
+    #{ Memory mappings of big files
+    
+    def _get_file_mapping(self, media_file):
+        """
+        Return the read-only memory mapping of ``media_file``, mapping it if
+        it's not mapped yet, or ``None`` if it's too big to be mapped.
+        
+        """
+        if self.max_mapped_size < media_file.size:
+            return None
+        
+        with self._mapped_files_lock:
+            mapped_file = self._mapped_files.pop(media_file.path, None)
+            if mapped_file is not None and mapped_file[0] == media_file.etag:
+                # Making it the most recently used file:
+                self._mapped_files[media_file.path] = mapped_file
+                return mapped_file[1]
+            if mapped_file is not None:
+                self._mapped_files_size -= len(mapped_file[1])
+        
+        try:
+            with open(media_file.path, "rb") as file_:
+                mapping = mmap(file_.fileno(), 0, access=ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            return None
+        if len(mapping) != media_file.size:
+            # The file changed after its status was retrieved:
+            mapping.close()
+            return None
+        
+        # The mappings which are removed are not closed, since they may be
+        # being served; they're closed once they're no longer referenced.
+        with self._mapped_files_lock:
+            previous_file = self._mapped_files.pop(media_file.path, None)
+            if previous_file is not None:
+                self._mapped_files_size -= len(previous_file[1])
+            self._mapped_files[media_file.path] = (media_file.etag, mapping)
+            self._mapped_files_size += len(mapping)
+            while self._mapped_files_size > self.max_mapped_size:
+                evicted_file = self._mapped_files.popitem(last=False)[1]
+                self._mapped_files_size -= len(evicted_file[1])
+        return mapping
+    
+    #}
+
+
+class MediaManifest(object):
+    """
+    Manifest of the fingerprinted paths to the files in ``root_directory``,
+    which contain the hash of their contents (e.g.,
+    ``css/site.0123456789ab.css`` for ``css/site.css``).
+    
+    :param root_directory: The path to the directory with the files,
+        including those in its subdirectories.
+    :type root_directory: :class:`basestring`
+    :param url_prefix: The URL under which the files are served (e.g.,
+        ``MEDIA_URL``).
+    :type url_prefix: :class:`basestring`
+    
+    The files are hashed once, when the manifest is created, so it must be
+    created again (e.g., by restarting the application) after deploying new
+    media. The precompressed variants of the files are not fingerprinted on
+    their own, since they are served for the path to the file.
+    
+    """
+    
+    def __init__(self, root_directory, url_prefix):
+        self.root_directory = path.abspath(root_directory)
+        self.url_prefix = url_prefix
+        
+        # The fingerprinted path to each file, by path:
+        self.fingerprinted_paths = {}
+        # The path to each file, by fingerprinted path:
+        self._logical_paths = {}
+        # The size and modification time of each file when it was hashed:
+        self._file_versions = {}
+        for (logical_path, file_path, file_stat) in \
+            _get_fingerprintable_files(self.root_directory):
+            fingerprinted_path = _get_fingerprinted_path(
+                logical_path,
+                _hash_file(file_path),
+                )
+            self.fingerprinted_paths[logical_path] = fingerprinted_path
+            self._logical_paths[fingerprinted_path] = logical_path
+            self._file_versions[logical_path] = \
+                (file_stat.st_size, file_stat.st_mtime)
+    
+    def get_url(self, logical_path):
+        """
+        Return the URL to the file at ``logical_path``, which is fingerprinted
+        if the file is in the manifest.
+        
+        """
+        logical_path = logical_path.lstrip("/")
+        fingerprinted_path = self.fingerprinted_paths.get(logical_path,
+                                                          logical_path)
+        return self.url_prefix + fingerprinted_path
+    
+    def get_logical_path(self, fingerprinted_path):
+        """
+        Return the path to the file whose fingerprinted path is
+        ``fingerprinted_path``, or ``None`` if it's not in the manifest.
+        
+        """
+        return self._logical_paths.get(fingerprinted_path.lstrip("/"))
+    
+    def is_current(self, logical_path, file_stat):
+        """
+        Report whether the file at ``logical_path``, whose current status is
+        ``file_stat``, has not changed since it was hashed.
+        
+        """
+        return file_stat is not None and \
+            self._file_versions.get(logical_path) == \
+            (file_stat.st_size, file_stat.st_mtime)
+
+
+def register_media_manifest(manifest):
+    """
+    Make :func:`get_media_url` resolve the URLs under the ``url_prefix`` of
+    ``manifest`` through it, replacing the manifest previously registered for
+    that prefix, if any.
+    
+    :param manifest: The manifest to be registered.
+    :type manifest: :class:`MediaManifest`
+    
+    """
+    _MEDIA_MANIFESTS[manifest.url_prefix] = manifest
+
+
+def get_media_url(media_path):
+    """
+    Return the URL to the media file at ``media_path``, which is fingerprinted
+    if the file is in a registered manifest.
+    
+    :param media_path: The path to the file relative to ``MEDIA_URL`` (e.g.,
+        ``css/site.css``), or its absolute URL path (e.g.,
+        ``/static/admin/css/base.css``).
+    :type media_path: :class:`basestring`
+    :rtype: :class:`basestring`
+    
+    """
+    if media_path.startswith("/"):
+        url = media_path
+    else:
+        from django.conf import settings
+        url = settings.MEDIA_URL + media_path
+    
+    # The manifest with the longest prefix wins, in case they're nested:
+    manifest = None
+    for (url_prefix, candidate_manifest) in _MEDIA_MANIFESTS.items():
+        if url.startswith(url_prefix) and \
+           (manifest is None or len(manifest.url_prefix) < len(url_prefix)):
+            manifest = candidate_manifest
+    
+    if manifest is None:
+        return url
+    return manifest.get_url(url[len(manifest.url_prefix):])
+
+
+def compress_media(root_directory, compression_level=9, min_size=256,
+                   processes=None):
+    """
+    Write the gzip-compressed variant of the text files in ``root_directory``
+    (e.g., ``site.css.gz`` for ``site.css``), so that they can be served by
+    :class:`MediaApplication` to the clients which support it.
+    
+    :param root_directory: The path to the directory with the files,
+        including those in its subdirectories.
+    :type root_directory: :class:`basestring`
+    :param compression_level: The gzip compression level, from ``1`` to ``9``.
+    :type compression_level: :class:`int`
+    :param min_size: The size (in bytes) of the smallest file to be
+        compressed.
+    :type min_size: :class:`int`
+    :param processes: The number of processes which compress the files in
+        parallel, if not one per CPU.
+    :type processes: :class:`int`
+    :return: The paths to the files compressed.
+    :rtype: :class:`list`
+    
+    Files whose variant is up-to-date are skipped, and so are the files which
+    don't get smaller once compressed.
+    
+    """
+    file_paths = list(_get_compressible_files(root_directory, min_size))
+    if not file_paths:
+        return []
+    
+    pool = Pool(processes)
+    try:
+        compressions = pool.map(
+            _compress_file,
+            [(file_path, compression_level) for file_path in file_paths],
+            )
+    finally:
+        pool.close()
+        pool.join()
+    
+    return [file_path for (file_path, is_compressed) in
+            zip(file_paths, compressions) if is_compressed]
+
+
+def compress_media_command(argv=None):
+    """
+    Compress the media in the directories passed as arguments (or in
+    ``MEDIA_ROOT``) with :func:`compress_media`.
+    
+    This is the ``twod-compress-media`` command.
+    
+    """
+    parser = OptionParser(
+        usage="%prog [options] [DIRECTORY ...]",
+        description="Write the gzip-compressed variants of the text files in "
+                    "the directories (MEDIA_ROOT by default).",
+        )
+    parser.add_option("-l", "--compression-level", type="int", default=9,
+                      help="The gzip compression level (default: 9)")
+    parser.add_option("-m", "--min-size", type="int", default=256,
+                      help="The size of the smallest file to be compressed "
+                           "(default: 256 bytes)")
+    parser.add_option("-p", "--processes", type="int",
+                      help="The number of files to be compressed in parallel "
+                           "(default: the number of CPUs)")
+    (options, directories) = parser.parse_args(argv)
+    
+    if not directories:
+        from django.conf import settings
+        try:
+            media_root = settings.MEDIA_ROOT
+        except ImportError:
+            parser.error("No directory passed and the Django settings are "
+                         "not available")
+        if not media_root:
+            parser.error("No directory passed and MEDIA_ROOT is not set")
+        directories = [media_root]
+    
+    for directory in directories:
+        compressed_files = compress_media(
+            directory,
+            options.compression_level,
+            options.min_size,
+            options.processes,
+            )
+        print "%s: %s files compressed" % (directory, len(compressed_files))
+
+
+#{ Internals
+
+
+_MAX_FILE_STATS = 10000
+
+_FINGERPRINTED_FILE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_MEDIA_MANIFESTS = {}
+
+
+class _MediaFile(object):
+    """Static file with the metadata needed to serve it."""
+    
+    __slots__ = ("path", "size", "mtime", "etag", "last_modified",
+                 "content_type", "content_encoding", "has_variants")
+    
+    def __init__(self, file_path, file_stat, content_type=None,
+                 content_encoding=None):
+        self.path = file_path
+        self.size = file_stat.st_size
+        self.mtime = int(file_stat.st_mtime)
+        self.etag = '"%x-%x-%x"' % (
+            int(file_stat.st_mtime * 1000000),
+            file_stat.st_size,
+            file_stat.st_ino,
+            )
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.content_encoding = content_encoding
+        self.has_variants = False
+        
+        if content_type:
+            self.content_type = content_type
+        else:
+            (self.content_type, encoding) = guess_type(file_path)
+            if encoding:
+                # Compressed files requested directly (e.g., "site.css.gz")
+                # are served as is:
+                self.content_type = _COMPRESSED_FILE_CONTENT_TYPES.get(encoding)
+            self.content_type = self.content_type or "application/octet-stream"
+
+
+_PRECOMPRESSED_FILE_EXTENSIONS = {
+    'br': ".br",
+    'gzip': ".gz",
+    }
+
+_CONTENT_CODING_ALIASES = {
+    'x-gzip': "gzip",
+    }
+
+_COMPRESSED_FILE_CONTENT_TYPES = {
+    'gzip': "application/gzip",
+    'bzip2': "application/x-bzip2",
+    }
+
+
+def _respond_with_error(status, start_response):
+    """Start a plain text response with ``status`` and return its body."""
+    body = status.split(" ", 1)[1]
+    start_response(status, [
+        ("Content-Type", "text/plain"),
+        ("Content-Length", str(len(body))),
+        ])
+    return [body]
+
+
+def _parse_accept_encoding(accept_encoding):
+    """
+    Return the quality of each content coding in the ``Accept-Encoding``
+    header.
+    
+    """
+    encoding_qualities = {}
+    for encoding in (accept_encoding or "").split(","):
+        if ";" in encoding:
+            (encoding, parameters) = encoding.split(";", 1)
+            parameters = parameters.strip()
+            if parameters.startswith("q="):
+                try:
+                    quality = float(parameters[2:])
+                except ValueError:
+                    quality = 0
+            else:
+                quality = 1
+        else:
+            quality = 1
+        encoding = encoding.strip().lower()
+        encoding = _CONTENT_CODING_ALIASES.get(encoding, encoding)
+        if encoding:
+            encoding_qualities[encoding] = quality
+    return encoding_qualities
+
+
+def _is_modified(environ, media_file):
+    """
+    Report whether ``media_file`` changed since the version the client has,
+    if any.
+    
+    """
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        entity_tags = [entity_tag.strip() for entity_tag in
+                       if_none_match.split(",")]
+        # If-None-Match uses the weak comparison:
+        return "*" not in entity_tags and \
+            media_file.etag not in entity_tags and \
+            "W/" + media_file.etag not in entity_tags
+    
+    if_modified_since = _parse_http_date(environ.get("HTTP_IF_MODIFIED_SINCE"))
+    if if_modified_since is not None:
+        return if_modified_since < media_file.mtime
+    
+    return True
+
+
+def _get_byte_range(environ, media_file):
+    """
+    Return the offset and length of the byte range requested, if a single
+    range was requested, or :data:`_UNSATISFIABLE_RANGE` if it can't be
+    served.
+    
+    The whole file is served (``None`` is returned) when the ``Range`` header
+    is invalid, when it has several ranges or when the file changed since
+    the version in ``If-Range``.
+    
+    """
+    range_header = environ.get("HTTP_RANGE", "").strip()
+    if not range_header.startswith("bytes="):
+        return None
+    
+    if_range = environ.get("HTTP_IF_RANGE")
+    if if_range is not None and if_range != media_file.etag and \
+       if_range != media_file.last_modified:
+        return None
+    
+    byte_range = range_header[len("bytes="):].strip()
+    if "," in byte_range or "-" not in byte_range:
+        return None
+    (first_byte, last_byte) = [position.strip() for position in
+                               byte_range.split("-", 1)]
+    try:
+        if first_byte:
+            start = int(first_byte)
+            end = int(last_byte) if last_byte else None
+        else:
+            suffix_length = int(last_byte)
+            start = max(media_file.size - suffix_length, 0)
+            end = None
+            if not suffix_length:
+                return _UNSATISFIABLE_RANGE
+    except ValueError:
+        return None
+    
+    if end is not None and end < start:
+        return None
+    if media_file.size <= start:
+        return _UNSATISFIABLE_RANGE
+    if end is None or media_file.size <= end:
+        end = media_file.size - 1
+    return (start, end - start + 1)
+
+
+_UNSATISFIABLE_RANGE = object()
+
+
+class _MappingIterator(object):
+    """
+    Iterator over ``length`` bytes of the memory ``mapping`` from offset
+    ``start``.
+    
+    Each block is a copy of its slice of the mapping, since WSGI requires
+    strings. So this saves opening the file on every request, but not the
+    copy which reading it would make.
+    
+    """
+    
+    def __init__(self, mapping, start, length, block_size):
+        self.mapping = mapping
+        self.position = start
+        self.end = start + length
+        self.block_size = block_size
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        if self.end <= self.position:
+            raise StopIteration
+        block_end = min(self.position + self.block_size, self.end)
+        chunk = self.mapping[self.position:block_end]
+        self.position = block_end
+        return chunk
+
+
+def _get_fingerprintable_files(root_directory):
+    """
+    Yield the path (relative to ``root_directory``, with slashes), the
+    absolute path and the status of each regular file in ``root_directory``,
+    except for the precompressed variants of other files.
+    
+    """
+    for (directory, subdirectory_names, file_names) in walk(root_directory):
+        relative_directory = path.relpath(directory, root_directory)
+        if relative_directory == path.curdir:
+            directory_segments = []
+        else:
+            directory_segments = relative_directory.split(path.sep)
+        
+        file_names = set(file_names)
+        for file_name in file_names:
+            (base_name, extension) = path.splitext(file_name)
+            if extension in _PRECOMPRESSED_FILE_EXTENSIONS.values() and \
+               base_name in file_names:
+                continue
+            
+            file_path = path.join(directory, file_name)
+            try:
+                file_stat = stat(file_path)
+            except OSError:
+                # The file was removed while walking the directory.
+                continue
+            if S_ISREG(file_stat.st_mode):
+                logical_path = "/".join(directory_segments + [file_name])
+                yield (logical_path, file_path, file_stat)
+
+
+def _get_fingerprinted_path(logical_path, file_hash):
+    """
+    Return ``logical_path`` with ``file_hash`` before the extension of the
+    file, if any.
+    
+    """
+    (directory, file_name) = posixpath.split(logical_path)
+    (base_name, extension) = posixpath.splitext(file_name)
+    fingerprinted_file_name = "%s.%s%s" % (base_name, file_hash, extension)
+    return posixpath.join(directory, fingerprinted_file_name)
+
+
+def _hash_file(file_path, block_size=65536):
+    """Return the abbreviated MD5 hash of the contents of ``file_path``."""
+    file_hash = md5()
+    with open(file_path, "rb") as file_:
+        for block in iter(lambda: file_.read(block_size), ""):
+            file_hash.update(block)
+    return file_hash.hexdigest()[:12]
+
+
+class _FileIterator(object):
+    """Iterator over ``length`` bytes of ``file_`` from offset ``start``."""
+    
+    def __init__(self, file_, start, length, block_size):
+        self.file = file_
+        self.file.seek(start)
+        self.remaining_length = length
+        self.block_size = block_size
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        if self.remaining_length <= 0:
+            raise StopIteration
+        chunk = self.file.read(min(self.block_size, self.remaining_length))
+        if not chunk:
+            raise StopIteration
+        self.remaining_length -= len(chunk)
+        return chunk
+    
+    def close(self):
+        self.file.close()
+
+
+def _get_compressible_files(root_directory, min_size):
+    """
+    Yield the paths to the text files in ``root_directory`` whose
+    gzip-compressed variant is missing or outdated.
+    
+    """
+    for (directory, subdirectory_names, file_names) in walk(root_directory):
+        for file_name in file_names:
+            (content_type, encoding) = guess_type(file_name)
+            if encoding or not content_type or \
+               not (content_type.startswith("text/") or
+                    content_type in _COMPRESSIBLE_CONTENT_TYPES):
+                continue
+            
+            file_path = path.join(directory, file_name)
+            try:
+                file_stat = stat(file_path)
+            except OSError:
+                # The file was removed while walking the directory, or it's a
+                # broken symbolic link.
+                continue
+            if not S_ISREG(file_stat.st_mode) or file_stat.st_size < min_size:
+                continue
+            try:
+                variant_stat = stat(file_path + ".gz")
+            except OSError:
+                pass
+            else:
+                if not _is_older(variant_stat, file_stat):
+                    continue
+            yield file_path
+
+
+def _is_older(variant_stat, file_stat):
+    """
+    Report whether the variant of a file was last modified before the file.
+    
+    The modification times are compared in whole seconds, because the
+    variants can't be given the exact modification time of the files on
+    file systems with sub-microsecond timestamps.
+    
+    """
+    return int(variant_stat.st_mtime) < int(file_stat.st_mtime)
+
+
+_COMPRESSIBLE_CONTENT_TYPES = frozenset([
+    "application/javascript",
+    "application/json",
+    "application/x-javascript",
+    "application/xml",
+    "image/svg+xml",
+    "image/x-icon",
+    "image/vnd.microsoft.icon",
+    ])
+
+
+def _compress_file(compression):
+    """
+    Write the gzip-compressed variant of a file, unless it's not smaller than
+    the file or the file was removed.
+    
+    The variant has the same modification time and permissions as the file,
+    so that it doesn't change when the file is compressed again.
+    
+    """
+    (file_path, compression_level) = compression
+    try:
+        file_stat = stat(file_path)
+        with open(file_path, "rb") as file_:
+            contents = file_.read()
+    except (IOError, OSError):
+        # The file was removed after the directory was walked.
+        return False
+    
+    # The variant is written to a temporary file first, so that it's never
+    # served while incomplete:
+    temporary_file = NamedTemporaryFile(dir=path.dirname(file_path),
+                                        prefix=".", delete=False)
+    try:
+        gzip_file = GzipFile("", "wb", compression_level, temporary_file,
+                             int(file_stat.st_mtime))
+        gzip_file.write(contents)
+        gzip_file.close()
+        temporary_file.close()
+        
+        is_compressed = stat(temporary_file.name).st_size < len(contents)
+        if is_compressed:
+            utime(temporary_file.name,
+                  (file_stat.st_atime, file_stat.st_mtime))
+            chmod(temporary_file.name, S_IMODE(file_stat.st_mode))
+            rename(temporary_file.name, file_path + ".gz")
+    finally:
+        temporary_file.close()
+        if path.exists(temporary_file.name):
+            remove(temporary_file.name)
+    return is_compressed
+
+
+#}
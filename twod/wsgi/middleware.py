@@ -18,7 +18,8 @@ WSGI and Django middleware.
 
 """
 
-__all__ = ("RoutingArgsMiddleware", )
+__all__ = ("RoutingArgsMiddleware", "PrefixDispatcher",
+           "resolve_django_session_identity")
 
 
 class RoutingArgsMiddleware(object):
@@ -31,3 +32,109 @@ class RoutingArgsMiddleware(object):
     def process_view(self, request, view_func, view_args, view_kwargs):
         request.environ['wsgiorg.routing_args'] = (view_args, view_kwargs.copy())
 
+
+class PrefixDispatcher(object):
+    """
+    WSGI middleware which passes the requests for the paths under the given
+    prefixes on to the WSGI applications mounted there, instead of the
+    Django application.
+    
+    :param django_app: The Django application, which gets the rest of the
+        requests.
+    :param mounts: The WSGI applications, by the path prefix where they're
+        mounted.
+    :type mounts: :class:`dict`
+    :param identity_resolver: The callable which returns the name of the
+        user who made the request, given the WSGI environment, if any.
+    
+    As with :func:`~twod.wsgi.call_wsgi_app`, the prefix is moved from the
+    ``PATH_INFO`` to the ``SCRIPT_NAME``, and the ``REMOTE_USER`` is set to
+    the user found by ``identity_resolver``, if any.
+    
+    """
+    
+    def __init__(self, django_app, mounts, identity_resolver=None):
+        self.django_app = django_app
+        self.identity_resolver = identity_resolver
+        
+        # Longer prefixes take precedence:
+        self.mounts = sorted(
+            ((prefix.rstrip("/"), wsgi_app) for (prefix, wsgi_app)
+             in mounts.items()),
+            key=lambda mount: -len(mount[0]),
+            )
+    
+    def __call__(self, environ, start_response):
+        path_info = environ.get("PATH_INFO", "")
+        for (prefix, wsgi_app) in self.mounts:
+            if path_info.startswith(prefix) and \
+               path_info[len(prefix):len(prefix) + 1] in ("", "/"):
+                break
+        else:
+            return self.django_app(environ, start_response)
+        
+        environ = environ.copy()
+        environ['SCRIPT_NAME'] = environ.get("SCRIPT_NAME", "") + prefix
+        environ['PATH_INFO'] = path_info[len(prefix):]
+        
+        if self.identity_resolver:
+            remote_user = self.identity_resolver(environ)
+            if remote_user:
+                environ['REMOTE_USER'] = remote_user
+        
+        environ.pop("wsgiorg.routing_args", None)
+        environ.pop("webob.adhoc_attrs", None)
+        
+        return wsgi_app(environ, start_response)
+
+
+def resolve_django_session_identity(environ):
+    """
+    Return the name of the user logged in Django, if any, given the WSGI
+    environment.
+    
+    The user is found from the session cookie, without running the Django
+    middleware. The lookup is wrapped in the ``request_started`` and
+    ``request_finished`` signals, as Django's handler does, so that the
+    database connection it uses is closed afterwards.
+    
+    """
+    from django.conf import settings
+    from django.core.signals import request_finished, request_started
+    from django.http import parse_cookie
+    
+    cookies = parse_cookie(environ.get("HTTP_COOKIE", ""))
+    session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None
+    
+    request_started.send(sender=resolve_django_session_identity)
+    try:
+        return _get_session_username(session_key)
+    finally:
+        request_finished.send(sender=resolve_django_session_identity)
+
+
+#{ Internals
+
+
+def _get_session_username(session_key):
+    from django.conf import settings
+    from django.contrib.auth import (BACKEND_SESSION_KEY, SESSION_KEY,
+                                     load_backend)
+    from django.utils.importlib import import_module
+    
+    session_engine = import_module(settings.SESSION_ENGINE)
+    session = session_engine.SessionStore(session_key)
+    user_id = session.get(SESSION_KEY)
+    backend_path = session.get(BACKEND_SESSION_KEY)
+    if user_id is None or not backend_path:
+        return None
+    
+    user = load_backend(backend_path).get_user(user_id)
+    if user is None:
+        return None
+    return user.username
+
+
+#}
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+WSGI application to dispatch the requests to the applications mounted on
+path prefixes.
+
+"""
+import re
+from UserDict import DictMixin
+
+
+__all__ = ("MountTable", )
+
+
+class MountTable(DictMixin):
+    """
+    WSGI application which passes each request on to the application mounted
+    on the longest path prefix of the request.
+    
+    :param not_found_app: The WSGI application which gets the requests
+        for the paths where no application is mounted, if not the default
+        ``404 Not Found`` one.
+    
+    It's a drop-in replacement for :class:`paste.urlmap.URLMap`: The
+    applications are mounted by assigning them to their path (e.g.,
+    ``mount_table['/media'] = media_app``), optionally with a host (e.g.,
+    ``mount_table['http://example.com/media'] = media_app`` or
+    ``mount_table[('example.com', '/media')] = media_app``), and the prefix
+    is moved from the ``PATH_INFO`` to the ``SCRIPT_NAME``. The applications
+    mounted for the host of the request take precedence over those mounted
+    for any host.
+    
+    Unlike :class:`~paste.urlmap.URLMap`, which tries each mount in turn, the
+    mounts are kept in a tree of path segments, so finding the application
+    takes as long as walking the segments of the path, however many
+    applications are mounted.
+    
+    """
+    
+    def __init__(self, not_found_app=None):
+        self.not_found_application = not_found_app or _not_found_app
+        # The applications by (host, path prefix):
+        self._mounts = {}
+        # The tree of the mounts for each host, and the tree of the mounts for
+        # any host:
+        self._mount_trees = ({}, None)
+    
+    def __setitem__(self, url, wsgi_app):
+        if wsgi_app is None:
+            self.pop(url, None)
+            return
+        self._mounts[_normalize_url(url)] = wsgi_app
+        self._build_mount_trees()
+    
+    def __getitem__(self, url):
+        return self._mounts[_normalize_url(url)]
+    
+    def __delitem__(self, url):
+        del self._mounts[_normalize_url(url)]
+        self._build_mount_trees()
+    
+    def keys(self):
+        return [mount_url for (mount_url, wsgi_app) in self.applications]
+    
+    @property
+    def applications(self):
+        """
+        The ``((host, path_prefix), wsgi_app)`` mounts, in the order in which
+        :class:`~paste.urlmap.URLMap` would try them.
+        
+        """
+        def get_precedence(mount):
+            ((host, path_prefix), wsgi_app) = mount
+            # The mounts for any host go last:
+            return (host is None, host, -len(path_prefix))
+        return sorted(self._mounts.items(), key=get_precedence)
+    
+    def __call__(self, environ, start_response):
+        path_info = environ.get("PATH_INFO", "")
+        if "//" in path_info:
+            path_info = _MULTIPLE_SLASHES_RE.sub("/", path_info)
+        
+        (host_mount_trees, mount_tree) = self._mount_trees
+        mount = None
+        if host_mount_trees:
+            for host in _get_hosts(environ):
+                if host in host_mount_trees:
+                    mount = host_mount_trees[host].find(path_info)
+                    if mount is not None:
+                        break
+        if mount is None and mount_tree is not None:
+            mount = mount_tree.find(path_info)
+        if mount is None:
+            return self.not_found_application(environ, start_response)
+        
+        (prefix_length, wsgi_app) = mount
+        environ['SCRIPT_NAME'] = \
+            environ.get("SCRIPT_NAME", "") + path_info[:prefix_length]
+        environ['PATH_INFO'] = path_info[prefix_length:]
+        return wsgi_app(environ, start_response)
+    
+    def _build_mount_trees(self):
+        mount_trees = {}
+        for ((host, path_prefix), wsgi_app) in self._mounts.items():
+            mount_tree = mount_trees.setdefault(host, _MountNode())
+            mount_tree.add(path_prefix, wsgi_app)
+        any_host_mount_tree = mount_trees.pop(None, None)
+        # The trees are replaced at once, so that the requests being
+        # dispatched meanwhile don't see them half-built:
+        self._mount_trees = (mount_trees, any_host_mount_tree)
+
+
+#{ Internals
+
+
+_MULTIPLE_SLASHES_RE = re.compile("//+")
+
+_HOST_URL_RE = re.compile("^https?://", re.IGNORECASE)
+
+
+class _MountNode(object):
+    """
+    Node in the tree of path segments of the mounts, with the application
+    mounted on its path, if any.
+    
+    """
+    
+    __slots__ = ("children", "wsgi_app")
+    
+    def __init__(self):
+        self.children = {}
+        self.wsgi_app = None
+    
+    def add(self, path_prefix, wsgi_app):
+        node = self
+        for segment in path_prefix.split("/")[1:]:
+            node = node.children.setdefault(segment, _MountNode())
+        node.wsgi_app = wsgi_app
+    
+    def find(self, path_info):
+        """
+        Return the length of the longest mounted prefix of ``path_info`` and
+        the application mounted there, or ``None`` if there's none.
+        
+        """
+        if self.wsgi_app is None:
+            mount = None
+        else:
+            mount = (0, self.wsgi_app)
+        
+        node = self
+        segment_start = 0
+        path_info_length = len(path_info)
+        while node.children and segment_start < path_info_length and \
+              path_info[segment_start] == "/":
+            segment_end = path_info.find("/", segment_start + 1)
+            if segment_end == -1:
+                segment_end = path_info_length
+            node = node.children.get(path_info[segment_start + 1:segment_end])
+            if node is None:
+                break
+            if node.wsgi_app is not None:
+                mount = (segment_end, node.wsgi_app)
+            segment_start = segment_end
+        return mount
+
+
+def _normalize_url(url):
+    """
+    Return the host (if any) and the path prefix in ``url``, in the form in
+    which they're mounted.
+    
+    """
+    if isinstance(url, (list, tuple)):
+        (host, path_prefix) = url
+    else:
+        match = _HOST_URL_RE.match(url)
+        if match:
+            (host, path_prefix) = \
+                (url[match.end():].split("/", 1) + [""])[:2]
+            path_prefix = "/" + path_prefix
+        else:
+            (host, path_prefix) = (None, url)
+    
+    if path_prefix and not path_prefix.startswith("/"):
+        raise ValueError("Path prefixes must start with a slash, unlike %r" %
+                         path_prefix)
+    path_prefix = _MULTIPLE_SLASHES_RE.sub("/", path_prefix).rstrip("/")
+    if host:
+        host = host.lower()
+    else:
+        host = None
+    return (host, path_prefix)
+
+
+def _get_hosts(environ):
+    """
+    Return the host of the request without and with the port, if it's known.
+    
+    """
+    host = environ.get("HTTP_HOST") or environ.get("SERVER_NAME")
+    if not host:
+        return ()
+    host = host.lower()
+    if ":" in host:
+        return (host.split(":", 1)[0], host)
+    if environ.get("wsgi.url_scheme") == "https":
+        port = "443"
+    else:
+        port = "80"
+    return (host, "%s:%s" % (host, port))
+
+
+def _not_found_app(environ, start_response):
+    body = "Not Found"
+    start_response("404 Not Found", [
+        ("Content-Type", "text/plain"),
+        ("Content-Length", str(len(body))),
+        ])
+    return [body]
+
+
+#}
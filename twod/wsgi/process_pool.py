@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+WSGI application which runs another WSGI application in a pool of processes.
+
+"""
+from multiprocessing import cpu_count, Pipe, Process
+from Queue import Queue
+from tempfile import SpooledTemporaryFile
+from traceback import format_exc
+import sys
+
+from twod.wsgi.exc import ApplicationCallError
+
+
+__all__ = ("ProcessPoolApplication", )
+
+
+_PICKLABLE_ENVIRON_TYPES = (basestring, int, long, float, bool, type(None))
+
+
+class ProcessPoolApplication(object):
+    """
+    WSGI application which forwards the requests it gets to the WSGI
+    application run by a pool of pre-forked processes.
+    
+    :param app_factory: The callable which builds the WSGI application in
+        each process.
+    :param processes: The number of processes in the pool; defaults to the
+        number of CPUs.
+    :type processes: :class:`int`
+    :param chunk_size: The size of the chunks in which the request body is
+        sent to the processes.
+    :type chunk_size: :class:`int`
+    
+    This is useful to run CPU-bound applications without competing with the
+    Django application for the GIL, by passing it on to
+    :func:`~twod.wsgi.call_wsgi_app` or :func:`~twod.wsgi.make_wsgi_view`
+    instead of the application itself.
+    
+    Only the items in the WSGI environment whose values are strings, numbers
+    or ``None`` are passed on to the application; the response body is
+    streamed back as it's produced. If all the processes are busy, the
+    request waits until one is available.
+    
+    """
+    
+    def __init__(self, app_factory, processes=None, chunk_size=64 * 1024):
+        self.app_factory = app_factory
+        self.chunk_size = chunk_size
+        
+        self._idle_workers = Queue()
+        for worker_number in range(processes or cpu_count()):
+            self._idle_workers.put(_Worker(app_factory))
+    
+    def __call__(self, environ, start_response):
+        worker = self._idle_workers.get()
+        try:
+            worker.send_request(environ, self.chunk_size)
+            message = worker.receive()
+        except (EOFError, IOError):
+            # The process died, so it has to be replaced:
+            self._replace_worker(worker)
+            raise ApplicationCallError("The process running the WSGI "
+                                       "application exited unexpectedly")
+        
+        if message[0] == "error":
+            self._idle_workers.put(worker)
+            raise ApplicationCallError("The WSGI application raised an "
+                                       "exception:\n%s" % message[1])
+        
+        (status, headers) = message[1:]
+        start_response(status, headers)
+        return _WorkerResponseBody(worker, self)
+    
+    def close(self):
+        """Stop all the idle processes in the pool."""
+        while not self._idle_workers.empty():
+            self._idle_workers.get().stop()
+    
+    def _release_worker(self, worker):
+        self._idle_workers.put(worker)
+    
+    def _replace_worker(self, worker):
+        worker.stop()
+        self._idle_workers.put(_Worker(self.app_factory))
+
+
+#{ Internals
+
+
+class _Worker(object):
+    """Process running the WSGI application, and the pipe to talk to it."""
+    
+    def __init__(self, app_factory):
+        (self.connection, child_connection) = Pipe()
+        self.process = Process(target=_serve_requests,
+                               args=(app_factory, child_connection))
+        self.process.daemon = True
+        self.process.start()
+    
+    def send_request(self, environ, chunk_size):
+        picklable_environ = dict(
+            (key, value) for (key, value) in environ.items()
+            if isinstance(value, _PICKLABLE_ENVIRON_TYPES)
+            )
+        picklable_environ['wsgi.url_scheme'] = environ.get("wsgi.url_scheme",
+                                                           "http")
+        self.connection.send(picklable_environ)
+        
+        # The body is sent in chunks, ending with an empty one:
+        body = environ.get("wsgi.input")
+        try:
+            remaining = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            remaining = 0
+        while body is not None and 0 < remaining:
+            chunk = body.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            self.connection.send_bytes(chunk)
+        self.connection.send_bytes("")
+    
+    def receive(self):
+        return self.connection.recv()
+    
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except IOError:
+            pass
+        self.connection.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class _WorkerResponseBody(object):
+    """
+    Iterable over the chunks of a response body sent by a worker process.
+    
+    The worker is returned to the pool once the body has been read entirely,
+    or once it's closed.
+    
+    """
+    
+    def __init__(self, worker, pool):
+        self.worker = worker
+        self.pool = pool
+        self.finished = False
+    
+    def __iter__(self):
+        while not self.finished:
+            try:
+                message = self.worker.receive()
+            except (EOFError, IOError):
+                self.finished = True
+                self.pool._replace_worker(self.worker)
+                raise ApplicationCallError("The process running the WSGI "
+                                           "application exited unexpectedly")
+            
+            if message[0] == "chunk":
+                yield message[1]
+            else:
+                self.finished = True
+                self.pool._release_worker(self.worker)
+                if message[0] == "error":
+                    raise ApplicationCallError("The WSGI application raised "
+                                               "an exception:\n%s" % message[1])
+    
+    def close(self):
+        if not self.finished:
+            # Discarding the rest of the body, so that the worker can be
+            # reused:
+            try:
+                for chunk in self:
+                    pass
+            except ApplicationCallError:
+                pass
+
+
+def _serve_requests(app_factory, connection):
+    """Build the WSGI application and serve the requests sent by the pool."""
+    wsgi_app = app_factory()
+    
+    while True:
+        try:
+            environ = connection.recv()
+        except EOFError:
+            break
+        if environ is None:
+            break
+        
+        body = SpooledTemporaryFile(max_size=1024 * 1024)
+        chunk = connection.recv_bytes()
+        while chunk:
+            body.write(chunk)
+            chunk = connection.recv_bytes()
+        body.seek(0)
+        
+        environ.update({
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            })
+        try:
+            _serve_request(wsgi_app, environ, connection)
+        finally:
+            body.close()
+    
+    connection.close()
+
+
+def _serve_request(wsgi_app, environ, connection):
+    """Call ``wsgi_app`` and send its response through ``connection``."""
+    response_start = []
+    
+    def start_response(status, headers, exc_info=None):
+        if exc_info is not None and response_start and response_start[0]:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        response_start[:] = [False, status, headers]
+        return write
+    
+    def send_response_start():
+        if not response_start:
+            raise ApplicationCallError("start_response() was not called")
+        if not response_start[0]:
+            connection.send(("start", response_start[1], response_start[2]))
+            response_start[0] = True
+    
+    def write(chunk):
+        send_response_start()
+        if chunk:
+            connection.send(("chunk", chunk))
+    
+    try:
+        app_iter = wsgi_app(environ, start_response)
+        try:
+            for chunk in app_iter:
+                write(chunk)
+            send_response_start()
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+    except Exception:
+        connection.send(("error", format_exc()))
+    else:
+        connection.send(("end", ))
+
+
+#}
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+WSGI application which proxies the requests it gets to an HTTP server.
+
+"""
+from httplib import HTTPConnection, HTTPSConnection, HTTPException
+from Queue import LifoQueue, Empty, Full
+from socket import error as SocketError
+from urllib import quote
+from urlparse import urlsplit
+
+from twod.wsgi.exc import ApplicationCallError
+
+
+__all__ = ("HTTPProxyApplication", )
+
+
+# Hop-by-hop headers, which must not be passed on by proxies:
+# http://www.w3.org/Protocols/rfc2616/rfc2616-sec13.html#sec13.5.1
+_HOP_BY_HOP_HEADERS = frozenset([
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    ])
+
+# The headers set by the proxy, which can't be set by the clients:
+_FORWARDED_HEADERS_ENVIRON_PREFIX = "HTTP_X_FORWARDED_"
+
+_BODY_CHUNK_SIZE = 64 * 1024
+
+
+class HTTPProxyApplication(object):
+    """
+    WSGI application which passes the requests it gets on to the HTTP server
+    at ``upstream_url``, reusing the connections to it.
+    
+    :param upstream_url: The URL to the HTTP server, to which the
+        ``PATH_INFO`` of the requests will be appended.
+    :type upstream_url: :class:`basestring`
+    :param timeout: The number of seconds to wait for the server to accept
+        the connection or to send data, if any.
+    :type timeout: :class:`float`
+    :param max_idle_connections: The maximum number of idle keep-alive
+        connections to the server kept in the pool.
+    :type max_idle_connections: :class:`int`
+    :param remote_user_header: The name of the header used to pass the
+        ``REMOTE_USER`` on to the server.
+    :type remote_user_header: :class:`basestring`
+    :raises twod.wsgi.exc.ApplicationCallError: If the server cannot be
+        reached or it doesn't respond in time.
+    
+    The ``SCRIPT_NAME`` is passed on in the ``X-Forwarded-Script-Name``
+    header, and the ``Host`` and client address in the ``X-Forwarded-Host``
+    and ``X-Forwarded-For`` headers, respectively. Both the request and
+    response bodies are streamed.
+    
+    The ``remote_user_header`` and ``X-Forwarded-*`` headers sent by the
+    client are dropped, so that the server can trust the ones set by the
+    proxy.
+    
+    """
+    
+    def __init__(self, upstream_url, timeout=None, max_idle_connections=10,
+                 remote_user_header="X-Remote-User"):
+        upstream = urlsplit(upstream_url)
+        if upstream.scheme == "https":
+            self.connection_class = HTTPSConnection
+        else:
+            self.connection_class = HTTPConnection
+        self.host = upstream.hostname
+        self.port = upstream.port
+        self.path_prefix = upstream.path.rstrip("/")
+        self.timeout = timeout
+        self.remote_user_header = remote_user_header
+        self._remote_user_environ_key = \
+            "HTTP_" + remote_user_header.upper().replace("-", "_")
+        
+        self._idle_connections = LifoQueue(max_idle_connections)
+    
+    def __call__(self, environ, start_response):
+        (connection, response) = self._forward_request(environ)
+        
+        status = "%s %s" % (response.status, response.reason)
+        headers = []
+        for header_line in response.msg.headers:
+            if header_line[0] in " \t":
+                # Continuation of the previous header:
+                (header_name, header_value) = headers.pop()
+                header_value = header_value + " " + header_line.strip()
+            else:
+                (header_name, header_value) = header_line.split(":", 1)
+                header_name = header_name.strip()
+                header_value = header_value.strip()
+            headers.append((header_name, header_value))
+        headers = [(name, value) for (name, value) in headers
+                   if name.lower() not in _HOP_BY_HOP_HEADERS]
+        
+        start_response(status, headers)
+        return _ProxiedResponseBody(connection, response, self)
+    
+    def _forward_request(self, environ):
+        """
+        Send the request in ``environ`` to the server and return the
+        connection used and the response.
+        
+        """
+        method = environ['REQUEST_METHOD']
+        url = self.path_prefix + quote(environ.get("PATH_INFO", ""))
+        if environ.get("QUERY_STRING"):
+            url = url + "?" + environ['QUERY_STRING']
+        headers = self._get_request_headers(environ)
+        
+        try:
+            content_length = int(environ.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            content_length = 0
+        has_body = 0 < content_length or \
+            "chunked" in environ.get("HTTP_TRANSFER_ENCODING", "").lower()
+        
+        connection = self._get_connection()
+        try:
+            try:
+                self._send_request(connection, method, url, headers, environ,
+                                   content_length, has_body)
+                response = connection.getresponse()
+            except (HTTPException, SocketError):
+                connection.close()
+                if has_body or not getattr(connection, "reused", False):
+                    raise
+                # The server may have closed the idle connection, so let's
+                # try again with a new one:
+                connection = self._make_connection()
+                self._send_request(connection, method, url, headers, environ,
+                                   content_length, has_body)
+                response = connection.getresponse()
+        except (HTTPException, SocketError), exc:
+            connection.close()
+            raise ApplicationCallError("Could not get the response from "
+                                       "%s:%s: %s" % (self.host, self.port,
+                                                      exc))
+        
+        return (connection, response)
+    
+    def _send_request(self, connection, method, url, headers, environ,
+                      content_length, has_body):
+        connection.putrequest(method, url, skip_host=True,
+                              skip_accept_encoding=True)
+        for (header_name, header_value) in headers:
+            connection.putheader(header_name, header_value)
+        if has_body and not content_length:
+            connection.putheader("Transfer-Encoding", "chunked")
+        connection.endheaders()
+        
+        if not has_body:
+            return
+        
+        body = environ['wsgi.input']
+        if content_length:
+            remaining = content_length
+            while 0 < remaining:
+                chunk = body.read(min(_BODY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                connection.send(chunk)
+        else:
+            chunk = body.read(_BODY_CHUNK_SIZE)
+            while chunk:
+                connection.send("%x\r\n%s\r\n" % (len(chunk), chunk))
+                chunk = body.read(_BODY_CHUNK_SIZE)
+            connection.send("0\r\n\r\n")
+    
+    def _get_request_headers(self, environ):
+        headers = []
+        for (key, value) in environ.items():
+            if key.startswith("HTTP_") and \
+               not key.startswith(_FORWARDED_HEADERS_ENVIRON_PREFIX) and \
+               key != self._remote_user_environ_key:
+                header_name = key[5:].replace("_", "-").title()
+                if header_name.lower() not in _HOP_BY_HOP_HEADERS:
+                    headers.append((header_name, value))
+        
+        if environ.get("CONTENT_TYPE"):
+            headers.append(("Content-Type", environ['CONTENT_TYPE']))
+        if environ.get("CONTENT_LENGTH"):
+            headers.append(("Content-Length", environ['CONTENT_LENGTH']))
+        
+        if "HTTP_HOST" not in environ:
+            headers.append(("Host", environ.get("SERVER_NAME", self.host)))
+        if environ.get("HTTP_HOST"):
+            headers.append(("X-Forwarded-Host", environ['HTTP_HOST']))
+        if environ.get("REMOTE_ADDR"):
+            headers.append(("X-Forwarded-For", environ['REMOTE_ADDR']))
+        headers.append(("X-Forwarded-Script-Name",
+                        environ.get("SCRIPT_NAME", "")))
+        if environ.get("REMOTE_USER"):
+            headers.append((self.remote_user_header, environ['REMOTE_USER']))
+        
+        return headers
+    
+    #{ Connection pooling
+    
+    def _get_connection(self):
+        try:
+            connection = self._idle_connections.get_nowait()
+        except Empty:
+            connection = self._make_connection()
+        else:
+            connection.reused = True
+        return connection
+    
+    def _make_connection(self):
+        connection = self.connection_class(self.host, self.port,
+                                           timeout=self.timeout)
+        connection.reused = False
+        return connection
+    
+    def _release_connection(self, connection):
+        try:
+            self._idle_connections.put_nowait(connection)
+        except Full:
+            connection.close()
+    
+    #}
+
+
+#{ Internals
+
+
+class _ProxiedResponseBody(object):
+    """
+    Iterable over the body of a response from the server.
+    
+    The connection is returned to the pool once the body has been read
+    entirely, unless the server is going to close it.
+    
+    """
+    
+    def __init__(self, connection, response, proxy):
+        self.connection = connection
+        self.response = response
+        self.proxy = proxy
+        self.finished = False
+    
+    def __iter__(self):
+        while not self.finished:
+            try:
+                chunk = self.response.read(_BODY_CHUNK_SIZE)
+            except (HTTPException, SocketError), exc:
+                self.close()
+                raise ApplicationCallError("Could not read the response "
+                                           "from %s:%s: %s" % (self.proxy.host,
+                                                               self.proxy.port,
+                                                               exc))
+            if not chunk:
+                self._finish()
+                break
+            yield chunk
+    
+    def close(self):
+        if not self.finished:
+            # The rest of the body won't be read, so the connection cannot be
+            # reused:
+            self.finished = True
+            self.response.close()
+            self.connection.close()
+    
+    def _finish(self):
+        self.finished = True
+        if self.response.will_close:
+            self.connection.close()
+        else:
+            self.proxy._release_connection(self.connection)
+
+
+#}
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Faster resolution of Django URLs.
+
+"""
+from collections import OrderedDict
+from threading import Lock
+import re
+
+from django.core.urlresolvers import (RegexURLPattern, RegexURLResolver,
+                                      Resolver404, ResolverMatch)
+from django.utils.encoding import smart_str
+
+
+__all__ = ("CompiledURLResolver", )
+
+
+class CompiledURLResolver(RegexURLResolver):
+    """
+    Django URL resolver which finds the same matches as Django's resolver for
+    the URL patterns in ``urlconf_name``, but only tries the patterns which
+    may match the path given the text they start with.
+    
+    :param urlconf_name: The URL patterns or the name of the module which
+        contains them.
+    :param regex: The regular expression for the path prefix consumed by this
+        resolver.
+    :type regex: :class:`basestring`
+    :param max_cached_paths: The maximum number of paths whose match is kept
+        in the cache, if any.
+    :type max_cached_paths: :class:`int`
+    
+    The first time it's used, the patterns (including those in included
+    URL configurations) are compiled into a tree by the static text they
+    start with, so that the patterns which can't match a path are never
+    tried. The patterns which don't start with static text (e.g., those which
+    aren't anchored with ``^``) are always tried, in the same order as in
+    Django's resolver.
+    
+    If ``max_cached_paths`` is set, the matches for the paths resolved most
+    recently are kept, and they're reused before the patterns are tried. The
+    number of times the cache was (or wasn't) used is available in
+    ``cache_hits`` and ``cache_misses``. Paths which don't match any pattern
+    are not cached.
+    
+    The patterns are compiled again (and the cache is cleared) when the
+    URL patterns are replaced or new patterns are appended to them, but not
+    when included URL patterns change: Use :meth:`clear` then.
+    
+    It has to be put in the URL configuration, which means it can be used in
+    reverse URL lookups as if it were an :func:`include` without a prefix::
+        
+        urlpatterns = patterns('', ...)
+        urlpatterns = [CompiledURLResolver(urlpatterns)]
+    
+    """
+    
+    def __init__(self, urlconf_name, regex=r"^", max_cached_paths=0):
+        super(CompiledURLResolver, self).__init__(regex, urlconf_name)
+        self.max_cached_paths = max_cached_paths
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        self._patterns_tree = None
+        self._compilation_lock = Lock()
+        # The matches by path, with the least recently used ones first:
+        self._cached_matches = OrderedDict()
+        self._cache_lock = Lock()
+    
+    def resolve(self, path):
+        patterns_tree = self._get_patterns_tree()
+        
+        if self.max_cached_paths:
+            resolver_match = self._get_cached_match(path, patterns_tree)
+            if resolver_match:
+                return resolver_match
+        
+        match = self.regex.search(path)
+        if not match:
+            raise Resolver404({'path': path})
+        new_path = path[match.end():]
+        
+        resolver_matches = {}
+        for leaf in patterns_tree.get_leaves(new_path):
+            resolver_match = _resolve_leaf(leaf, new_path, resolver_matches,
+                                           (self, match))
+            if resolver_match:
+                if self.max_cached_paths:
+                    self._cache_match(path, patterns_tree, resolver_match)
+                return resolver_match
+        
+        raise Resolver404({'tried': patterns_tree.tried, 'path': new_path})
+    
+    @property
+    def cache_hit_rate(self):
+        """
+        The proportion of the paths resolved with the cache, if any has been
+        resolved.
+        
+        """
+        lookups = self.cache_hits + self.cache_misses
+        if not lookups:
+            return None
+        return float(self.cache_hits) / lookups
+    
+    def clear(self):
+        """Compile the URL patterns again and clear the cache."""
+        with self._compilation_lock:
+            self._patterns_tree = None
+        with self._cache_lock:
+            self._cached_matches.clear()
+    
+    def _get_patterns_tree(self):
+        url_patterns = self.url_patterns
+        patterns_tree = self._patterns_tree
+        if patterns_tree is None or \
+           not patterns_tree.is_compiled_from(url_patterns):
+            with self._compilation_lock:
+                patterns_tree = self._patterns_tree
+                if patterns_tree is None or \
+                   not patterns_tree.is_compiled_from(url_patterns):
+                    patterns_tree = _PatternsTree(url_patterns)
+                    self._patterns_tree = patterns_tree
+            with self._cache_lock:
+                self._cached_matches.clear()
+        return patterns_tree
+    
+    #{ Match caching
+    
+    def _get_cached_match(self, path, patterns_tree):
+        with self._cache_lock:
+            cached_match = self._cached_matches.pop(path, None)
+            # Matches found with outdated URL patterns are discarded:
+            if cached_match is None or cached_match[0] is not patterns_tree:
+                self.cache_misses += 1
+                return None
+            
+            self.cache_hits += 1
+            # Making it the most recently used path:
+            self._cached_matches[path] = cached_match
+        
+        # The arguments may be modified by the caller:
+        return _copy_resolver_match(cached_match[1])
+    
+    def _cache_match(self, path, patterns_tree, resolver_match):
+        resolver_match = _copy_resolver_match(resolver_match)
+        with self._cache_lock:
+            self._cached_matches[path] = (patterns_tree, resolver_match)
+            while len(self._cached_matches) > self.max_cached_paths:
+                self._cached_matches.popitem(last=False)
+    
+    #}
+
+
+#{ Internals
+
+
+class _PatternsTree(object):
+    """
+    Tree of the URL patterns in a URL configuration, by the characters their
+    static prefix is made of.
+    
+    Each leaf is a URL pattern along with the resolvers which include it.
+    
+    """
+    
+    def __init__(self, url_patterns):
+        self.url_patterns = url_patterns
+        self.pattern_count = len(url_patterns)
+        
+        self.leaves = list(_get_leaves(url_patterns, ()))
+        # The patterns as reported by Django when no pattern matches a path:
+        self.tried = [list(resolvers) + [pattern] for (resolvers, pattern) in
+                      self.leaves]
+        self.root = _PatternsTreeNode()
+        for (leaf_index, (resolvers, pattern)) in enumerate(self.leaves):
+            node = self.root
+            for character in _get_leaf_prefix(resolvers, pattern):
+                node = node.children.setdefault(character, _PatternsTreeNode())
+            node.leaf_indices.append(leaf_index)
+    
+    def is_compiled_from(self, url_patterns):
+        """
+        Report whether the tree was compiled from ``url_patterns`` in their
+        current state.
+        
+        """
+        return url_patterns is self.url_patterns and \
+            len(url_patterns) == self.pattern_count
+    
+    def get_leaves(self, path):
+        """
+        Return the leaves which may match ``path``, in the order they're
+        defined.
+        
+        """
+        node = self.root
+        leaf_indices = list(node.leaf_indices)
+        for character in path:
+            node = node.children.get(character)
+            if node is None:
+                break
+            leaf_indices.extend(node.leaf_indices)
+        
+        leaf_indices.sort()
+        return [self.leaves[leaf_index] for leaf_index in leaf_indices]
+
+
+class _PatternsTreeNode(object):
+    
+    __slots__ = ("children", "leaf_indices")
+    
+    def __init__(self):
+        self.children = {}
+        self.leaf_indices = []
+
+
+def _get_leaves(url_patterns, resolvers):
+    for pattern in url_patterns:
+        if _is_plain_resolver(pattern):
+            sub_resolvers = resolvers + (pattern, )
+            for leaf in _get_leaves(pattern.url_patterns, sub_resolvers):
+                yield leaf
+        else:
+            yield (resolvers, pattern)
+
+
+def _is_plain_resolver(pattern):
+    """
+    Report whether ``pattern`` is a resolver whose patterns can be resolved
+    like Django's.
+    
+    """
+    resolve_method = getattr(pattern.__class__, "resolve", None)
+    return isinstance(pattern, RegexURLResolver) and \
+        getattr(resolve_method, "im_func", None) is \
+        RegexURLResolver.resolve.im_func
+
+
+def _get_leaf_prefix(resolvers, pattern):
+    """
+    Return the static text which the paths matched by ``pattern`` (once
+    included by ``resolvers``) start with.
+    
+    """
+    prefix = ""
+    for resolver in resolvers:
+        (regex_prefix, is_static_regex) = _get_regex_prefix(resolver.regex)
+        prefix += regex_prefix
+        if not is_static_regex:
+            return prefix
+    
+    if isinstance(pattern, RegexURLPattern):
+        prefix += _get_regex_prefix(pattern.regex)[0]
+    return prefix
+
+
+def _get_regex_prefix(regex):
+    """
+    Return the static text which the strings matched by ``regex`` start with,
+    and whether the regular expression is made of that text only.
+    
+    Only the regular expressions anchored with ``^`` have a prefix.
+    
+    """
+    pattern = regex.pattern
+    if not pattern.startswith("^") or regex.flags & re.IGNORECASE or \
+       _INLINE_FLAGS_RE.search(pattern) or _has_top_level_alternation(pattern):
+        return ("", False)
+    
+    prefix = []
+    position = 1
+    while position < len(pattern):
+        character = pattern[position]
+        if character == "\\":
+            character = pattern[position + 1:position + 2]
+            if not character or character.isalnum():
+                break
+            next_position = position + 2
+        elif character in _REGEX_SPECIAL_CHARACTERS:
+            break
+        else:
+            next_position = position + 1
+        
+        if 127 < ord(character):
+            break
+        
+        next_character = pattern[next_position:next_position + 1]
+        if next_character and next_character in "*?{":
+            # The character is optional or may be repeated:
+            break
+        prefix.append(character)
+        if next_character == "+":
+            break
+        position = next_position
+    
+    is_static_regex = position == len(pattern)
+    return ("".join(prefix), is_static_regex)
+
+
+def _has_top_level_alternation(pattern):
+    depth = 0
+    in_character_class = False
+    position = 0
+    while position < len(pattern):
+        character = pattern[position]
+        if character == "\\":
+            position += 1
+        elif in_character_class:
+            in_character_class = character != "]"
+        elif character == "[":
+            in_character_class = True
+            if pattern[position + 1:position + 2] == "^":
+                position += 1
+            # A closing bracket right after the opening one is a literal:
+            if pattern[position + 1:position + 2] == "]":
+                position += 1
+        elif character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "|" and depth == 0:
+            return True
+        position += 1
+    return False
+
+
+_REGEX_SPECIAL_CHARACTERS = frozenset(".^$*+?{}[]()|")
+
+_INLINE_FLAGS_RE = re.compile(r"\(\?[iLmsux]+\)")
+
+
+def _copy_resolver_match(resolver_match):
+    return ResolverMatch(
+        resolver_match.func,
+        resolver_match.args,
+        resolver_match.kwargs.copy(),
+        resolver_match.url_name,
+        resolver_match.app_name,
+        list(resolver_match.namespaces),
+        )
+
+
+def _resolve_leaf(leaf, path, resolver_matches, parent_match):
+    """
+    Resolve ``path`` against the pattern in ``leaf`` as Django would, once
+    it's gone through the resolvers which include the pattern.
+    
+    The matches for the resolvers are shared across the leaves in
+    ``resolver_matches``. ``parent_match`` is the resolver which includes the
+    patterns in the tree and the match for its regular expression.
+    
+    """
+    (resolvers, pattern) = leaf
+    
+    matches = [parent_match]
+    for resolver in resolvers:
+        match_key = (id(resolver), path)
+        if match_key in resolver_matches:
+            match = resolver_matches[match_key]
+        else:
+            match = resolver.regex.search(path)
+            resolver_matches[match_key] = match
+        if not match:
+            return None
+        matches.append((resolver, match))
+        path = path[match.end():]
+    
+    try:
+        sub_match = pattern.resolve(path)
+    except Resolver404:
+        return None
+    if not sub_match:
+        return None
+    
+    # Merging the arguments and namespaces as each resolver would, from the
+    # outermost one (whose arguments are overridden by those of the inner
+    # ones):
+    kwargs = {}
+    app_name = None
+    namespaces = []
+    for (resolver, match) in matches:
+        for (key, value) in match.groupdict().iteritems():
+            kwargs[smart_str(key)] = value
+        for (key, value) in resolver.default_kwargs.iteritems():
+            kwargs[smart_str(key)] = value
+        app_name = app_name or resolver.app_name
+        namespaces.append(resolver.namespace)
+    for (key, value) in sub_match.kwargs.iteritems():
+        kwargs[smart_str(key)] = value
+    
+    return ResolverMatch(
+        sub_match.func,
+        sub_match.args,
+        kwargs,
+        sub_match.url_name,
+        app_name or sub_match.app_name,
+        namespaces + sub_match.namespaces,
+        )
+
+
+#}
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <gustavonarea@2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of twod.wsgi <https://github.com/2degrees/twod.wsgi/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Template tags to refer to the media files.
+
+Usage::
+    
+    {% load twod_media %}
+    <link rel="stylesheet" href="{% media_url "css/site.css" %}" />
+
+"""
+from django.template import Library
+
+from twod.wsgi.media import get_media_url
+
+
+__all__ = ("media_url", )
+
+
+register = Library()
+
+
+@register.simple_tag
+def media_url(media_path):
+    """
+    Return the URL to the media file at ``media_path``, which is fingerprinted
+    if the file is in a registered manifest.
+    
+    See :func:`twod.wsgi.media.get_media_url`.
+    
+    """
+    return get_media_url(media_path)